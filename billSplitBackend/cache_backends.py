@@ -0,0 +1,223 @@
+"""
+Cache backends shared by every worker process on a host.
+
+SQLiteCache stores entries in a single SQLite database in WAL mode, so all
+gunicorn workers read and invalidate the same entries without needing an
+external service. When a Redis server is available, settings switch to
+Django's built-in RedisCache instead.
+
+The namespace helpers work on any backend: keys built with namespaced_key()
+embed a per-namespace version number, and invalidate_namespace() bumps it,
+which orphans every key in the namespace for all workers at once.
+"""
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# The entry count is checked on about one write in this many
+CULL_CHECK_INTERVAL = 100
+# Entries expiring within this many seconds are never culled: they free their
+# space soon anyway, and they include short-lived coordination state such as
+# the rate limiter's leases and tokens
+CULL_MIN_REMAINING = 300
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cross-process cache backed by a SQLite file.
+
+    LOCATION is the path of the database file; its directory is created on
+    first use. Supports the usual TIMEOUT, MAX_ENTRIES and CULL_FREQUENCY
+    options. Each thread of each process keeps its own connection.
+
+    MAX_ENTRIES is a soft limit: the entry count is only checked on a sample
+    of writes. Culling removes expired entries, then the entries that expire
+    soonest, leaving alone entries without expiry and entries about to expire
+    (CULL_MIN_REMAINING).
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not be shared across a fork (e.g. gunicorn --preload)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self._path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache_entries ('
+            'cache_key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _is_live(expires):
+        return expires is None or expires > time.time()
+
+    def _write(self, conn, key, value, timeout):
+        expires = self.get_backend_timeout(timeout)
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entries (cache_key, value, expires) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value, self.pickle_protocol), expires)
+        )
+
+    def _maybe_cull(self, conn):
+        # Counting is a full scan, so only a sample of writes pays for it
+        if random.random() >= 1 / CULL_CHECK_INTERVAL:
+            return
+        count = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        if count < self._max_entries:
+            return
+        now = time.time()
+        count -= conn.execute('DELETE FROM cache_entries WHERE expires <= ?', (now,)).rowcount
+        if count >= self._max_entries:
+            limit = count if self._cull_frequency == 0 else count // self._cull_frequency
+            conn.execute(
+                'DELETE FROM cache_entries WHERE cache_key IN ('
+                'SELECT cache_key FROM cache_entries WHERE expires > ? ORDER BY expires LIMIT ?)',
+                (now + CULL_MIN_REMAINING, limit)
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT expires FROM cache_entries WHERE cache_key = ?', (key,)).fetchone()
+            if row is not None and self._is_live(row[0]):
+                conn.execute('COMMIT')
+                return False
+            self._maybe_cull(conn)
+            self._write(conn, key, value, timeout)
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache_entries WHERE cache_key = ?', (key,)
+        ).fetchone()
+        if row is None or not self._is_live(row[1]):
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._maybe_cull(conn)
+            self._write(conn, key, value, timeout)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'UPDATE cache_entries SET expires = ? WHERE cache_key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time())
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache_entries WHERE cache_key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT expires FROM cache_entries WHERE cache_key = ?', (key,)
+        ).fetchone()
+        return row is not None and self._is_live(row[0])
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent increments serialize
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value, expires FROM cache_entries WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is None or not self._is_live(row[1]):
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(row[0]) + delta
+            conn.execute(
+                'UPDATE cache_entries SET value = ? WHERE cache_key = ?',
+                (pickle.dumps(new_value, self.pickle_protocol), key)
+            )
+            conn.execute('COMMIT')
+            return new_value
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entries')
+
+    def close(self, **kwargs):
+        # Connections are reused across requests; nothing to release per request
+        pass
+
+
+def _namespace_key(namespace):
+    return f'ns:{namespace}:version'
+
+
+def _initial_version():
+    # Seeded from the clock so a namespace whose version key was evicted
+    # never reuses a version number that older entries were stored under
+    return int(time.time() * 1000)
+
+
+def namespace_version(namespace, using='default'):
+    """Current version number of a cache namespace."""
+    backend = caches[using]
+    version = backend.get(_namespace_key(namespace))
+    if version is None:
+        backend.add(_namespace_key(namespace), _initial_version(), timeout=None)
+        version = backend.get(_namespace_key(namespace), 0)
+    return version
+
+
+def namespaced_key(namespace, key, using='default'):
+    """Build a cache key that is invalidated together with its namespace."""
+    return f'{namespace}:v{namespace_version(namespace, using)}:{key}'
+
+
+def invalidate_namespace(namespace, using='default'):
+    """Invalidate every key in a namespace, for all processes sharing the cache."""
+    backend = caches[using]
+    try:
+        return backend.incr(_namespace_key(namespace))
+    except ValueError:
+        # No version stored yet, so nothing can be cached under the namespace
+        if backend.add(_namespace_key(namespace), _initial_version(), timeout=None):
+            return backend.get(_namespace_key(namespace))
+        return backend.incr(_namespace_key(namespace))
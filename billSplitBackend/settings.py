@@ -189,12 +189,90 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
 # Cache settings
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Shared by every gunicorn worker so invalidation is seen everywhere:
+# Redis when REDIS_URL is set, otherwise a local SQLite (WAL) cache file
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ["REDIS_URL"],
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'billSplitBackend.cache_backends.SQLiteCache',
+            'LOCATION': os.environ.get("CACHE_LOCATION", str(BASE_DIR / 'cache' / 'default.sqlite3')),
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+
+# Tests get a cache of their own, so rate limiter leases, counters and
+# namespace versions are not shared with earlier runs or live processes
+TEST_RUNNER = 'billSplitBackend.test_runner.IsolatedCacheTestRunner'
+
+# Maximum number of images of one upload that are OCR'd at once
+# (threads for Google Cloud Vision, processes for Tesseract)
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", 4))
+
+# Language of the long-lived Tesseract workers (see llm/tesseract_pool.py)
+TESSERACT_LANG = os.environ.get("TESSERACT_LANG", "eng")
+
+# Image preprocessing profiles (see llm/preprocessing.py) applied before OCR
+# and before images are uploaded to Gemini; 'none' sends images unchanged
+OCR_PREPROCESSING_PROFILE = os.environ.get("OCR_PREPROCESSING_PROFILE", "ocr")
+LLM_PREPROCESSING_PROFILE = os.environ.get("LLM_PREPROCESSING_PROFILE", "llm")
+
+# OCR results are cached per image (SHA-256 of the bytes, provider and OCR
+# settings); entries expire after the TTL (seconds) and the least recently
+# used are evicted beyond the maximum
+OCR_CACHE_TTL = int(os.environ.get("OCR_CACHE_TTL", 30 * 24 * 3600))
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", 5000))
+
+# Gemini responses are cached by model, generation config, prompt and
+# OCR text or image hash
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 2000))
+
+# Receipt scans (llm.ReceiptScan) not linked to a bill are deleted after the
+# TTL (seconds), and the oldest beyond the maximum; re-uploads within the TTL
+# reuse the scan
+RECEIPT_SCAN_TTL = int(os.environ.get("RECEIPT_SCAN_TTL", 30 * 24 * 3600))
+RECEIPT_SCAN_MAX_ENTRIES = int(os.environ.get("RECEIPT_SCAN_MAX_ENTRIES", 5000))
+
+# Rule-based receipt parser: OCR text whose items reconcile with the
+# receipt's totals at this confidence or above skips the LLM
+RECEIPT_PARSER_ENABLED = os.environ.get("RECEIPT_PARSER_ENABLED", "True").lower() == "true"
+RECEIPT_PARSER_MIN_CONFIDENCE = float(os.environ.get("RECEIPT_PARSER_MIN_CONFIDENCE", 0.8))
+
+# OCR text is compacted before it is sent to the LLM (see llm/compaction.py),
+# down to at most this many estimated tokens; 0 disables the limit
+OCR_TEXT_COMPACTION = os.environ.get("OCR_TEXT_COMPACTION", "True").lower() == "true"
+OCR_TEXT_TOKEN_BUDGET = int(os.environ.get("OCR_TEXT_TOKEN_BUDGET", 1500))
+
+# Receipt jobs (llm app)
+# A running job whose worker has not finished it within the timeout (seconds)
+# is requeued, up to the maximum number of attempts
+RECEIPT_JOB_TIMEOUT = int(os.environ.get("RECEIPT_JOB_TIMEOUT", 600))
+RECEIPT_JOB_MAX_ATTEMPTS = int(os.environ.get("RECEIPT_JOB_MAX_ATTEMPTS", 3))
+
+# LLM provider routing: providers are tried in this order (providers without
+# an API key are skipped), and a request still running after
+# LLM_HEDGE_AFTER_SECONDS is also sent to the next provider
+LLM_PROVIDER_ORDER = [p.strip() for p in os.environ.get("LLM_PROVIDER_ORDER", "gemini,openai").split(",") if p.strip()]
+LLM_HEDGE_AFTER_SECONDS = float(os.environ.get("LLM_HEDGE_AFTER_SECONDS", 8))
+
+# Outbound provider calls are rate limited across workers (see llm/rate_limit.py);
+# a call that gets no slot within this many seconds is answered with 429
+PROVIDER_WAIT_TIMEOUT = float(os.environ.get("PROVIDER_WAIT_TIMEOUT", 10))
+
+# Record/replay of provider calls (see llm/cassettes.py): 'off', 'record' or 'replay'.
+# Replayed responses take their recorded latency times PROVIDER_CASSETTE_LATENCY_SCALE
+PROVIDER_CASSETTE_MODE = os.environ.get("PROVIDER_CASSETTE_MODE", "off")
+PROVIDER_CASSETTE_DIR = os.environ.get("PROVIDER_CASSETTE_DIR", str(BASE_DIR / 'cassettes'))
+PROVIDER_CASSETTE_LATENCY_SCALE = float(os.environ.get("PROVIDER_CASSETTE_LATENCY_SCALE", 1.0))
 
 # Include logging configuration from logging_config.py
 # LOGGING is imported at the top of this file
\ No newline at end of file
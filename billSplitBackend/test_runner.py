@@ -0,0 +1,35 @@
+"""
+Test runner that gives every test run a cache of its own.
+
+Rate limiter leases, result cache counters and namespace versions live in
+the default cache, so tests must not share it with earlier runs or live
+processes. The runner points CACHES at a SQLite cache in a temporary
+directory for the run and deletes the directory afterwards.
+"""
+import os
+import shutil
+import tempfile
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class IsolatedCacheTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp(prefix='billsplit-test-cache-')
+        self._cache_override = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'billSplitBackend.cache_backends.SQLiteCache',
+                'LOCATION': os.path.join(self._cache_dir, 'default.sqlite3'),
+                'OPTIONS': {
+                    'MAX_ENTRIES': 10000,
+                },
+            }
+        })
+        self._cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_override.disable()
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from .cache_backends import SQLiteCache, invalidate_namespace, namespaced_key
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.location = os.path.join(directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def run_threads(self, target, count=8):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_incr_and_add_are_atomic_across_connections(self):
+        self.cache.set('counter', 0)
+        winners = []
+
+        def work():
+            # A backend per thread, like separate worker processes
+            cache = self.make_cache()
+            for _ in range(25):
+                cache.incr('counter')
+            if cache.add('lease', threading.get_ident()):
+                winners.append(threading.get_ident())
+
+        self.run_threads(work)
+
+        self.assertEqual(self.cache.get('counter'), 200)
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(self.cache.get('lease'), winners[0])
+
+    def test_expired_entries_are_gone_and_can_be_added_again(self):
+        self.cache.set('key', 'old', timeout=10)
+        self.assertTrue(self.cache.has_key('key'))
+
+        later = time.time() + 11
+        with patch('billSplitBackend.cache_backends.time.time', return_value=later):
+            self.assertIsNone(self.cache.get('key'))
+            with self.assertRaises(ValueError):
+                self.cache.incr('key')
+            self.assertTrue(self.cache.add('key', 'new', timeout=10))
+            self.assertEqual(self.cache.get('key'), 'new')
+
+    @patch('billSplitBackend.cache_backends.CULL_CHECK_INTERVAL', 1)
+    def test_cull_evicts_soonest_expiring_but_keeps_leases_and_persistent_keys(self):
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2)
+        cache.set('version', 1, timeout=None)
+        cache.set('lease', 'owner', timeout=60)
+        for i in range(10):
+            cache.set(f'entry{i}', i, timeout=3600 + i)
+
+        self.assertEqual(cache.get('version'), 1)
+        self.assertEqual(cache.get('lease'), 'owner')
+        self.assertIsNone(cache.get('entry0'))
+        self.assertEqual(cache.get('entry9'), 9)
+        kept = [i for i in range(10) if cache.has_key(f'entry{i}')]
+        self.assertLess(len(kept), 10)
+        # The latest expiring entries survive
+        self.assertEqual(kept, list(range(10 - len(kept), 10)))
+
+    def test_namespace_invalidation_changes_keys(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'billSplitBackend.cache_backends.SQLiteCache', 'LOCATION': self.location,
+        }}):
+            first = namespaced_key('bill_1', 'paid')
+            self.assertEqual(namespaced_key('bill_1', 'paid'), first)
+            other = namespaced_key('bill_2', 'paid')
+
+            invalidate_namespace('bill_1')
+
+            self.assertNotEqual(namespaced_key('bill_1', 'paid'), first)
+            self.assertEqual(namespaced_key('bill_2', 'paid'), other)
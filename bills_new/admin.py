@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.db.models import Sum
-from .models import Person, Group, Bill, BillParticipant, BillItem, ItemShare, Payment
+from .models import Person, Group, Bill, BillParticipant, BillItem, ItemShare, Payment, PairBalance
 
 
 class ItemShareInline(admin.TabularInline):
@@ -23,6 +23,9 @@ class BillParticipantInline(admin.TabularInline):
     extra = 0
     fields = ['person', 'owed_amount', 'paid_amount', 'balance']
     readonly_fields = ['paid_amount', 'balance']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_paid_amounts()
 
 
 class PaymentInline(admin.TabularInline):
@@ -93,6 +96,9 @@ class BillParticipantAdmin(admin.ModelAdmin):
     list_filter = ['bill', 'person']
     search_fields = ['bill__title', 'person__user__username']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('bill', 'person__user').with_paid_amounts()
+    
     def status(self, obj):
         balance = obj.balance
         if balance > 0:
@@ -143,3 +149,11 @@ class PaymentAdmin(admin.ModelAdmin):
         if db_field.name == "bill" and not kwargs.get('request'):
             kwargs['queryset'] = Bill.objects.filter(payment_type='BILL')
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(PairBalance)
+class PairBalanceAdmin(admin.ModelAdmin):
+    list_display = ['person', 'other_person', 'balance', 'version']
+    list_filter = ['person']
+    search_fields = ['person__user__username', 'other_person__user__username']
+    readonly_fields = ['person', 'other_person', 'balance', 'version']
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+from bills_new.models import Bill, BillItem, ItemShare
+from bills_new.split_engine import split_item
+
+
+class Command(BaseCommand):
+    help = "Compute and store ItemShare.amount for shares that do not have one yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute every share, not just missing amounts")
+        parser.add_argument("--batch-size", type=int, default=500, help="Bills processed per transaction")
+
+    def handle(self, *args, **kwargs):
+        bills = Bill.objects.order_by('id')
+        if not kwargs["all"]:
+            bills = bills.filter(items__shares__amount__isnull=True).distinct()
+
+        batch_size = kwargs["batch_size"]
+        bill_ids = list(bills.values_list('id', flat=True))
+        updated = 0
+
+        for start in range(0, len(bill_ids), batch_size):
+            batch = Bill.objects.filter(id__in=bill_ids[start:start + batch_size]).prefetch_related(
+                Prefetch('items', queryset=BillItem.objects.order_by('id')),
+                Prefetch('items__shares', queryset=ItemShare.objects.order_by('id')),
+            )
+
+            changed = []
+            for bill in batch:
+                # Item position in the bill drives the engine's leftover-cent rotation
+                for offset, item in enumerate(bill.items.all()):
+                    shares = list(item.shares.all())
+                    amounts = split_item(item.price, [share.split_data() for share in shares], offset)
+                    for share, amount in zip(shares, amounts):
+                        if share.amount != amount:
+                            share.amount = amount
+                            changed.append(share)
+
+            with transaction.atomic():
+                ItemShare.objects.bulk_update(changed, ['amount'], batch_size=batch_size)
+            updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Stored amounts for {updated} item shares"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from bills_new.models import PairBalance
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized pairwise settlement balances from the payment history"
+
+    def handle(self, *args, **kwargs):
+        count = PairBalance.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} pair balance rows"))
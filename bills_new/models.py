@@ -79,6 +79,30 @@ class Bill(models.Model):
         return sum(item.price for item in self.items.all())
 
 
+class BillParticipantQuerySet(models.QuerySet):
+    def with_paid_amounts(self):
+        """
+        Annotate each participant with what they have paid toward the bill
+        (annotated_paid_amount), using a correlated subquery so a whole list
+        costs a single query. The paid_amount property, and so balance, use
+        the annotation when present.
+        """
+        from django.db.models import OuterRef, Subquery, Sum, Value, DecimalField
+        from django.db.models.functions import Coalesce
+        
+        paid = Payment.objects.filter(
+            payment_type='BILL',
+            person=OuterRef('person'),
+            bill=OuterRef('bill')
+        ).values('person').annotate(total=Sum('amount')).values('total')[:1]
+        
+        return self.annotate(
+            annotated_paid_amount=Coalesce(
+                Subquery(paid), Value(Decimal('0.00')), output_field=DecimalField(max_digits=10, decimal_places=2)
+            )
+        )
+
+
 class BillParticipant(models.Model):
     """
     Represents a person's participation in a bill, tracking their share obligation.
@@ -88,6 +112,8 @@ class BillParticipant(models.Model):
     owed_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     _cached_paid_amount = None
     
+    objects = BillParticipantQuerySet.as_manager()
+    
     # class Meta:
     #     unique_together = ('bill', 'person')
     
@@ -113,12 +139,17 @@ class BillParticipant(models.Model):
         from django.db.models import Sum
         from django.core.cache import cache
         
+        # Use the with_paid_amounts() annotation when the queryset provided one
+        annotated = getattr(self, 'annotated_paid_amount', None)
+        if annotated is not None:
+            return annotated
+        
         # Try to get from instance cache first
         if self._cached_paid_amount is not None:
             return self._cached_paid_amount
         
-        # Try to get from Redis/Memcached cache
-        cache_key = f'bill_participant_{self.pk}_paid_amount'
+        # Try to get from the shared cache
+        cache_key = self._paid_amount_cache_key()
         cached_value = cache.get(cache_key)
         if cached_value is not None:
             self._cached_paid_amount = cached_value
@@ -137,16 +168,21 @@ class BillParticipant(models.Model):
         
         return payments
     
+    def _paid_amount_cache_key(self):
+        from billSplitBackend.cache_backends import namespaced_key
+        return namespaced_key(f'bill_{self.bill_id}', f'bill_participant_{self.pk}_paid_amount')
+    
     def invalidate_paid_amount_cache(self):
         """Invalidate the paid amount cache when a new payment is made."""
         from django.core.cache import cache
-        cache_key = f'bill_participant_{self.pk}_paid_amount'
-        cache.delete(cache_key)
+        cache.delete(self._paid_amount_cache_key())
         self._cached_paid_amount = None
+        self.__dict__.pop('annotated_paid_amount', None)
     
     @property
     def balance(self):
         """Calculate balance (positive: person is owed, negative: person owes)."""
+        # Computed in Python so it follows owed_amount changes on this instance
         return self.paid_amount - self.owed_amount
 
 
@@ -163,6 +199,34 @@ class BillItem(models.Model):
     
     def __str__(self):
         return f"{self.name} (${self.price})"
+    
+    def save(self, *args, **kwargs):
+        """Override save to keep stored share amounts in step with the price."""
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_share_amounts()
+    
+    def refresh_share_amounts(self):
+        """
+        Recompute and store the amount of every share of this item with the
+        split engine. Called whenever the item's price or share set changes.
+        Returns a dict of share pk to amount.
+        """
+        from .split_engine import split_item
+        
+        shares = list(self.shares.order_by('id'))
+        if not shares:
+            return {}
+        
+        # The engine rotates leftover cents by the item's position in its bill
+        offset = BillItem.objects.filter(bill_id=self.bill_id, id__lt=self.id).count()
+        amounts = split_item(self.price, [share.split_data() for share in shares], offset)
+        for share, amount in zip(shares, amounts):
+            share.amount = amount
+        ItemShare.objects.bulk_update(shares, ['amount'])
+        
+        return {share.pk: share.amount for share in shares}
 
 
 class SplitType(models.TextChoices):
@@ -189,6 +253,9 @@ class ItemShare(models.Model):
     exact_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     share_units = models.IntegerField(null=True, blank=True)
     
+    # Computed amount this person owes for the item, maintained by BillItem.refresh_share_amounts
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    
     class Meta:
         indexes = [
             models.Index(fields=['item', 'person']),
@@ -244,8 +311,51 @@ class ItemShare(models.Model):
             if self.share_units <= 0:
                 raise ValidationError({'share_units': 'Share units must be positive'})
     
-    def save(self, *args, **kwargs):
-        """Override save to perform validation and handle concurrency."""
+    @classmethod
+    def clean_share_set(cls, item_price, shares_data):
+        """
+        Validate all shares of one item in memory, applying the same rules as
+        clean() without its per-share aggregate queries. Used by bulk writes.
+        """
+        from django.core.exceptions import ValidationError
+        
+        total_percentage = Decimal('0.00')
+        total_amount = Decimal('0.00')
+        
+        for share_data in shares_data:
+            split_type = share_data.get('split_type')
+            
+            if split_type == SplitType.PERCENTAGE:
+                if share_data.get('percentage') is None:
+                    raise ValidationError({'percentage': 'Percentage is required for percentage split type'})
+                total_percentage += Decimal(str(share_data.get('percentage')))
+                if total_percentage > 100:
+                    raise ValidationError({
+                        'percentage': f'Total percentage ({total_percentage}%) exceeds 100%'
+                    })
+                    
+            elif split_type == SplitType.EXACT:
+                if share_data.get('exact_amount') is None:
+                    raise ValidationError({'exact_amount': 'Exact amount is required for exact split type'})
+                total_amount += Decimal(str(share_data.get('exact_amount')))
+                if total_amount > item_price:
+                    raise ValidationError({
+                        'exact_amount': f'Total amount ({total_amount}) exceeds item price ({item_price})'
+                    })
+                    
+            elif split_type == SplitType.SHARES:
+                if share_data.get('share_units') is None:
+                    raise ValidationError({'share_units': 'Share units is required for shares split type'})
+                if share_data.get('share_units') <= 0:
+                    raise ValidationError({'share_units': 'Share units must be positive'})
+    
+    def save(self, *args, refresh_amounts=True, **kwargs):
+        """
+        Override save to perform validation and handle concurrency.
+        
+        Code writing several shares of one item passes refresh_amounts=False
+        and calls item.refresh_share_amounts() once after the last share.
+        """
         from django.db import transaction
         
         # Validate before saving
@@ -261,6 +371,10 @@ class ItemShare(models.Model):
             # Save the item share
             super().save(*args, **kwargs)
             
+            # Adding or changing a share can change every share amount of the item
+            if refresh_amounts:
+                self.amount = self.item.refresh_share_amounts().get(self.pk)
+            
             # Recalculate owed amount for the participant
             # participant = BillParticipant.objects.get(
             #     bill=self.item.bill,
@@ -268,9 +382,23 @@ class ItemShare(models.Model):
             # )
             # participant.calculate_owed_amount()
     
+    def split_data(self):
+        """Return this share's fields in the shape the split engine expects."""
+        return {
+            'person_id': self.person_id,
+            'split_type': self.split_type,
+            'percentage': self.percentage,
+            'exact_amount': self.exact_amount,
+            'share_units': self.share_units,
+        }
+    
     @property
     def share_amount(self):
         """Calculate the actual amount this person owes for this item based on split type."""
+        # Serve the stored amount; rows written before it existed fall back to computing
+        if self.amount is not None:
+            return self.amount
+        
         if self.split_type == SplitType.EXACT:
             return self.exact_amount or Decimal('0.00')
         
@@ -329,37 +457,72 @@ class Payment(models.Model):
             direction = "paid" if self.amount > 0 else "received"
             return f"{self.person} {direction} {abs(self.amount)} {'to' if self.amount > 0 else 'from'} {self.other_person}"
     
+    @staticmethod
+    def _ledger_entry(payment_type, person_id, other_person_id, amount):
+        """The (person_id, other_person_id, amount) a row adds to PairBalance, or None."""
+        if payment_type != 'SETTLEMENT' or other_person_id is None:
+            return None
+        return person_id, other_person_id, Decimal(amount)
+    
+    def save(self, *args, **kwargs):
+        """
+        Save the payment and move its contribution in the pairwise balance
+        ledger when a SETTLEMENT row is created or edited (e.g. in admin).
+        Deletes are handled by the post_delete signal.
+        """
+        from django.db import transaction
+        
+        with transaction.atomic():
+            before = None
+            if self.pk:
+                old = Payment.objects.filter(pk=self.pk).values_list(
+                    'payment_type', 'person_id', 'other_person_id', 'amount'
+                ).first()
+                before = self._ledger_entry(*old) if old else None
+            super().save(*args, **kwargs)
+            after = self._ledger_entry(self.payment_type, self.person_id, self.other_person_id, self.amount)
+            
+            if before != after:
+                if before:
+                    PairBalance.adjust(before[0], before[1], -before[2])
+                if after:
+                    PairBalance.adjust(*after)
+    
     @classmethod
     def create_settlement(cls, from_person, to_person, amount, date, description=""):
         """
         Creates a pair of settlement records - one positive (from payer) and one negative (to receiver).
+        Saving each record updates its direction of the pairwise balance ledger.
         Returns the primary payment record (from payer).
         """
-        # Create payer's record (positive amount - money going out)
-        payer_payment = cls.objects.create(
-            payment_type='SETTLEMENT',
-            person=from_person,
-            other_person=to_person,
-            amount=amount,  # Positive amount
-            date=date,
-            description=description
-        )
-        
-        # Create receiver's record (negative amount - money coming in)
-        receiver_payment = cls.objects.create(
-            payment_type='SETTLEMENT',
-            person=to_person,
-            other_person=from_person,
-            amount=-amount,  # Negative amount
-            date=date,
-            description=description
-        )
+        from django.db import transaction
         
-        # Link the two payments
-        payer_payment.paired_payment = receiver_payment
-        receiver_payment.paired_payment = payer_payment
-        payer_payment.save()
-        receiver_payment.save()
+        with transaction.atomic():
+            # Create payer's record (positive amount - money going out)
+            payer_payment = cls.objects.create(
+                payment_type='SETTLEMENT',
+                person=from_person,
+                other_person=to_person,
+                amount=amount,  # Positive amount
+                date=date,
+                description=description
+            )
+            
+            # Create receiver's record (negative amount - money coming in)
+            receiver_payment = cls.objects.create(
+                payment_type='SETTLEMENT',
+                person=to_person,
+                other_person=from_person,
+                amount=-amount,  # Negative amount
+                date=date,
+                description=description
+            )
+            
+            # Link the two payments
+            payer_payment.paired_payment = receiver_payment
+            receiver_payment.paired_payment = payer_payment
+            payer_payment.save()
+            receiver_payment.save()
         
         return payer_payment
     
@@ -403,11 +566,10 @@ class Payment(models.Model):
         Positive value means the person is owed money.
         Negative value means the person owes money.
         """
-        # Sum all settlement payment amounts for this person
-        settlements = cls.objects.filter(
-            person=person,
-            payment_type='SETTLEMENT'
-        ).aggregate(models.Sum('amount'))['amount__sum'] or Decimal('0.00')
+        # Sum the materialized per-counterparty balances instead of every settlement row
+        settlements = PairBalance.objects.filter(
+            person=person
+        ).aggregate(models.Sum('balance'))['balance__sum'] or Decimal('0.00')
         
         return settlements
     
@@ -417,17 +579,12 @@ class Payment(models.Model):
         Calculate the balance between two people.
         Returns how much person1 owes person2 (negative if person1 owes, positive if person1 is owed).
         """
-        from django.db.models import Sum
-        # Get relevant payments where these two people are involved
-        payments_to_consider = cls.objects.filter(
-            payment_type='SETTLEMENT',
+        # Point lookup on the materialized ledger
+        balance = PairBalance.objects.filter(
             person=person1,
             other_person=person2
-        )
-        
-        # Sum them up
-        balance = payments_to_consider.aggregate(Sum('amount'))['amount__sum'] or Decimal('0.00')
-        return balance
+        ).values_list('balance', flat=True).first()
+        return balance if balance is not None else Decimal('0.00')
     
     @classmethod
     def get_bill_contributions(cls, bill):
@@ -438,3 +595,74 @@ class Payment(models.Model):
             payment_type='BILL',
             bill=bill
         )
+
+
+class PairBalance(models.Model):
+    """
+    Materialized running total of SETTLEMENT payments between two people.
+    Mirrors Payment's sign convention: one row per direction, holding the sum of
+    the SETTLEMENT payments with that (person, other_person), so it is the
+    negated balance of its mirror while settlements stay paired.
+    Maintained by Payment.save and the Payment post_delete signal; rebuild with
+    `rebuild_pair_balances`.
+    """
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='pair_balances')
+    other_person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='counterparty_balances')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    version = models.PositiveIntegerField(default=0)  # Bumped on every change
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'other_person'], name='unique_pair_balance')
+        ]
+    
+    def __str__(self):
+        return f"{self.person} / {self.other_person}: {self.balance}"
+    
+    @classmethod
+    def adjust(cls, person_id, other_person_id, delta, create=True):
+        """
+        Add `delta` to the (person, other_person) balance. Must run inside the
+        payment's transaction. With create=False a missing row is left alone,
+        e.g. when the people themselves are being deleted.
+        """
+        from django.db.models import F
+        
+        rows = cls.objects.filter(person_id=person_id, other_person_id=other_person_id)
+        if create:
+            row, created = cls.objects.select_for_update().get_or_create(
+                person_id=person_id,
+                other_person_id=other_person_id
+            )
+            rows = cls.objects.filter(pk=row.pk)
+        rows.update(
+            balance=F('balance') + delta,
+            version=F('version') + 1
+        )
+    
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute every pair balance from the SETTLEMENT payment history.
+        Returns the number of ledger rows written.
+        """
+        from django.db import transaction
+        from django.db.models import Sum
+        
+        totals = Payment.objects.filter(
+            payment_type='SETTLEMENT',
+            other_person__isnull=False
+        ).values('person_id', 'other_person_id').annotate(total=Sum('amount'))
+        
+        with transaction.atomic():
+            cls.objects.all().delete()
+            rows = cls.objects.bulk_create([
+                cls(
+                    person_id=row['person_id'],
+                    other_person_id=row['other_person_id'],
+                    balance=row['total'] or Decimal('0.00')
+                )
+                for row in totals
+            ])
+        
+        return len(rows)
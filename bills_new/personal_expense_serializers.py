@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from decimal import Decimal
-from .models import SplitType
+from .split_engine import split_item
 
 class BillItemPersonalExpenseSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=200)
@@ -13,28 +13,9 @@ class BillItemPersonalExpenseSerializer(serializers.Serializer):
         price = data.get('price')
         if price <= 0:
             raise serializers.ValidationError("Item price must be positive")
-        total_provided = Decimal('0.00')
         shares_data = data.get('shares', [])
-        # For EQUAL splits the calculation uses the count provided.
-        equal_count = sum(1 for s in shares_data if s.get('split_type') == SplitType.EQUAL)
-        total_shares_units = sum(s.get('share_units', 0) for s in shares_data if s.get('split_type') == SplitType.SHARES)
-        for s in shares_data:
-            st = s.get('split_type')
-            if st == SplitType.EXACT:
-                amount = Decimal(str(s.get('exact_amount', '0')))
-            elif st == SplitType.PERCENTAGE:
-                amount = price * Decimal(str(s.get('percentage', '0'))) / Decimal('100')
-            elif st == SplitType.SHARES:
-                if total_shares_units > 0:
-                    amount = price * Decimal(s.get('share_units', 0)) / Decimal(total_shares_units)
-                else:
-                    amount = Decimal('0')
-            else:  # EQUAL split
-                if equal_count > 0:
-                    amount = price / Decimal(equal_count)
-                else:
-                    amount = Decimal('0')
-            total_provided += amount
+        # Use the shared split engine so validation matches what gets saved
+        total_provided = sum(split_item(price, shares_data), Decimal('0.00'))
         if total_provided > price:
             raise serializers.ValidationError("Total provided share amounts exceed item price")
         return data
@@ -1,6 +1,7 @@
 from django.db import transaction
 from decimal import Decimal
 from .models import Person, Bill, BillItem, ItemShare, BillParticipant, Payment, SplitType
+from .split_engine import split_bill
 
 class PersonalExpenseService:
     @staticmethod
@@ -15,11 +16,12 @@ class PersonalExpenseService:
             created_by=created_by,
             is_personal=True,
         )
-        # Dictionary to hold the calculated owed amounts per person
-        person_totals = {}
+        # Compute every provided share of the bill with the shared split engine
+        items_data = validated_data.get('items', [])
+        item_amounts, person_totals = split_bill(items_data)
 
         # Process each bill item
-        for item_data in validated_data.get('items', []):
+        for item_data, share_amounts in zip(items_data, item_amounts):
             bill_item = BillItem.objects.create(
                 bill=bill,
                 name=item_data.get('name'),
@@ -28,7 +30,7 @@ class PersonalExpenseService:
             shares_data = item_data.get('shares', [])
             owner_share_sum = Decimal('0.00')
             # Process provided shares (ideally for the owner only)
-            for share_data in shares_data:
+            for share_data, share_amount in zip(shares_data, share_amounts):
                 person_id = share_data.get('person_id')
                 person = Person.objects.get(id=person_id)
                 split_type = share_data.get('split_type')
@@ -55,11 +57,7 @@ class PersonalExpenseService:
                     exact_amount=exact_amount,
                     share_units=share_units
                 )
-                item_share.save()
-                share_amount = PersonalExpenseService._calculate_share_amount(item_share, bill_item.price, shares_data)
-                if person_id not in person_totals:
-                    person_totals[person_id] = Decimal('0.00')
-                person_totals[person_id] += share_amount
+                item_share.save(refresh_amounts=False)
                 if person == created_by:
                     owner_share_sum += share_amount
             # For any item where the owner's provided share is less than the item price,
@@ -73,12 +71,15 @@ class PersonalExpenseService:
                     split_type=SplitType.EXACT,
                     exact_amount=remainder
                 )
-                dummy_share.save()
+                dummy_share.save(refresh_amounts=False)
                 dummy_id = others_person.id
                 if dummy_id not in person_totals:
                     person_totals[dummy_id] = Decimal('0.00')
                 person_totals[dummy_id] += remainder
 
+            # Compute the item's share amounts once its share set is complete
+            bill_item.refresh_share_amounts()
+
         # Create BillParticipant records using the computed totals
         for person_id, amount in person_totals.items():
             person = Person.objects.get(id=person_id)
@@ -102,24 +103,3 @@ class PersonalExpenseService:
             )
 
         return bill
-
-    @staticmethod
-    def _calculate_share_amount(item_share, item_price, all_shares_data):
-        """
-        Calculate the amount for a given item share.
-        This uses the provided split type; if the share type is not provided,
-        the default equal split is used.
-        """
-        if item_share.split_type == SplitType.EXACT:
-            return item_share.exact_amount or Decimal('0.00')
-        elif item_share.split_type == SplitType.PERCENTAGE:
-            return item_price * (item_share.percentage or Decimal('0.00')) / Decimal('100.00')
-        elif item_share.split_type == SplitType.SHARES:
-            total_shares = sum(int(s.get('share_units', 0)) for s in all_shares_data if s.get('split_type') == SplitType.SHARES)
-            if total_shares > 0 and item_share.share_units:
-                return item_price * Decimal(item_share.share_units) / Decimal(total_shares)
-        else:  # Equal split
-            equal_count = sum(1 for s in all_shares_data if s.get('split_type') == SplitType.EQUAL)
-            if equal_count > 0:
-                return item_price / Decimal(equal_count)
-        return Decimal('0.00')
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from .models import Person, Group, Bill, BillParticipant, BillItem, ItemShare, Payment
 from decimal import Decimal
 from .models import SplitType
+from .split_engine import split_bill
 
 
 
@@ -128,29 +129,20 @@ class BillSerializer(serializers.Serializer):
     items = BillItemSerializer(many=True)
     bill_paid_by = PaymentSerializer(many=True, required=False)
     bill_participants_share = ParticipantShareSerializer(many=True)
+    # The receipt scan (llm.ReceiptScan) the bill was filled in from
+    receipt_scan_id = serializers.IntegerField(required=False, allow_null=True)
+    
+    def validate_receipt_scan_id(self, value):
+        from llm.models import ReceiptScan
+        if value is not None and not ReceiptScan.objects.filter(id=value).exists():
+            raise serializers.ValidationError(f"Receipt scan {value} does not exist")
+        return value
     
     def validate(self, data):
         # Existing validation...
         
-        # Calculate expected participant shares
-        calculated_shares = {}
-        for item_data in data.get('items', []):
-            item_price = Decimal(str(item_data.get('price', '0')))
-            shares_data = item_data.get('shares', [])
-            
-            # Calculate share for each person in this item
-            for share_data in shares_data:
-                person_id = share_data.get('person_id')
-                split_type = share_data.get('split_type')
-                
-                # Calculate share amount
-                share_amount = self._calculate_share_amount(
-                    share_data, item_price, shares_data
-                )
-                
-                if person_id not in calculated_shares:
-                    calculated_shares[person_id] = Decimal('0')
-                calculated_shares[person_id] += share_amount
+        # Calculate expected participant shares with the shared split engine
+        _, calculated_shares = split_bill(data.get('items', []))
         
         # Get frontend's calculated shares
         frontend_shares = {
@@ -179,31 +171,6 @@ class BillSerializer(serializers.Serializer):
         
         return data
     
-    def _calculate_share_amount(self, share_data, item_price, all_shares_data):
-        """Helper method to calculate share amount for validation"""
-        split_type = share_data.get('split_type')
-        
-        if split_type == SplitType.EXACT:
-            return Decimal(str(share_data.get('exact_amount', '0')))
-            
-        elif split_type == SplitType.PERCENTAGE:
-            percentage = Decimal(str(share_data.get('percentage', '0')))
-            return item_price * percentage / Decimal('100')
-            
-        elif split_type == SplitType.SHARES:
-            share_units = share_data.get('share_units', 0)
-            total_shares = sum(s.get('share_units', 0) for s in all_shares_data 
-                              if s.get('split_type') == SplitType.SHARES)
-            if total_shares > 0:
-                return item_price * Decimal(share_units) / Decimal(total_shares)
-                
-        else:  # Equal split
-            equal_shares = sum(1 for s in all_shares_data if s.get('split_type') == SplitType.EQUAL)
-            if equal_shares > 0:
-                return item_price / Decimal(equal_shares)
-                
-        return Decimal('0')
-    
 
 class SettlementPaymentSerializer(serializers.Serializer):
     from_person_id = serializers.IntegerField()
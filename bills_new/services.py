@@ -1,17 +1,28 @@
 from django.db import transaction
 from decimal import Decimal
 from .models import Person, Group, Bill, BillParticipant, BillItem, ItemShare, Payment
-from .models import SplitType
+from .split_engine import split_bill
 
 
 class BillService:
     @staticmethod
     @transaction.atomic
-    def create_bill(validated_data, created_by):
+    def create_bill(validated_data, created_by, bulk=False):
         """
         Creates a bill with all its related records (items, shares, participants)
         using the validated data from the serializer.
+        
+        With bulk=True the records are written with one query per table (more
+        only when a table's rows need several INSERT batches), regardless of
+        the number of people (see _create_bill_bulk).
+        
+        A bill saved from a receipt scan (receipt_scan_id) is linked to it.
         """
+        if bulk:
+            bill = BillService._create_bill_bulk(validated_data, created_by)
+            BillService._link_receipt_scan(bill, validated_data)
+            return bill
+        
         # Extract and create bill
         bill_data = validated_data.get('bill', {})
         group_id = validated_data.get('group_id')
@@ -25,11 +36,12 @@ class BillService:
             group=group
         )
         
-        # Track person totals for creating bill participants
-        person_totals = {}
+        # Compute every share of the bill up front with the shared split engine
+        items_data = validated_data.get('items', [])
+        _, person_totals = split_bill(items_data)
         
         # Process items and their shares
-        for item_data in validated_data.get('items', []):
+        for item_data in items_data:
             # Create bill item
             bill_item = BillItem.objects.create(
                 bill=bill,
@@ -40,7 +52,7 @@ class BillService:
             # Process item shares
             shares_data = item_data.get('shares', [])
             
-            # Calculate share amounts based on split type
+            # Create a share record per person
             for share_data in shares_data:
                 person_id = share_data.get('person_id')
                 person = Person.objects.get(id=person_id)
@@ -55,17 +67,10 @@ class BillService:
                     exact_amount=share_data.get('exact_amount'),
                     share_units=share_data.get('share_units')
                 )
-                item_share.save()
-                
-                # Calculate share amount manually since we can't rely on the property yet
-                share_amount = BillService._calculate_share_amount(
-                    item_share, bill_item.price, shares_data
-                )
-                
-                # Track person totals
-                if person_id not in person_totals:
-                    person_totals[person_id] = Decimal('0')
-                person_totals[person_id] += share_amount
+                item_share.save(refresh_amounts=False)
+            
+            # Compute the item's share amounts once its share set is complete
+            bill_item.refresh_share_amounts()
         
         # Create bill participants
         for person_id, amount in person_totals.items():
@@ -90,26 +95,96 @@ class BillService:
                 description=f"Payment for {bill.title}"
             )
             
+        BillService._link_receipt_scan(bill, validated_data)
         return bill
     
     @staticmethod
-    def _calculate_share_amount(item_share, item_price, all_shares_data):
-        """Helper method to calculate share amount before saving"""
-        if item_share.split_type == SplitType.EXACT:
-            return item_share.exact_amount or Decimal('0.00')
-            
-        elif item_share.split_type == SplitType.PERCENTAGE:
-            return item_price * (item_share.percentage or Decimal('0.00')) / Decimal('100.00')
-            
-        elif item_share.split_type == SplitType.SHARES:
-            total_shares = sum(s.get('share_units', 0) for s in all_shares_data 
-                              if s.get('split_type') == SplitType.SHARES)
-            if total_shares > 0 and item_share.share_units:
-                return item_price * Decimal(item_share.share_units) / Decimal(total_shares)
-                
-        else:  # Equal split
-            equal_split_count = sum(1 for s in all_shares_data if s.get('split_type') == SplitType.EQUAL)
-            if equal_split_count > 0:
-                return item_price / Decimal(equal_split_count)
-                
-        return Decimal('0.00')
+    def _link_receipt_scan(bill, validated_data):
+        """Link the receipt scan (llm.ReceiptScan) the bill was saved from, if any."""
+        scan_id = validated_data.get('receipt_scan_id')
+        if scan_id:
+            from llm.services import ReceiptScanService
+            ReceiptScanService.link_bill(scan_id, bill)
+    
+    @staticmethod
+    def _create_bill_bulk(validated_data, created_by):
+        """
+        Bulk persistence mode for create_bill.
+        Resolves every person with one in_bulk query, validates shares in memory
+        and writes items, shares, participants and payments with bulk_create.
+        Must run inside create_bill's transaction.
+        """
+        from billSplitBackend.cache_backends import invalidate_namespace
+        
+        bill_data = validated_data.get('bill', {})
+        items_data = validated_data.get('items', [])
+        payments_data = validated_data.get('bill_paid_by', [])
+        item_amounts, person_totals = split_bill(items_data)
+        
+        # Resolve every person referenced by the bill in a single query
+        person_ids = set(person_totals) | {p.get('person_id') for p in payments_data}
+        persons = Person.objects.in_bulk(person_ids)
+        missing = person_ids - set(persons)
+        if missing:
+            raise Person.DoesNotExist(f"Person matching query does not exist: {sorted(missing)}")
+        
+        group_id = validated_data.get('group_id')
+        group = Group.objects.get(id=group_id) if group_id else None
+        
+        bill = Bill.objects.create(
+            title=bill_data.get('title'),
+            description=bill_data.get('description', ''),
+            date=bill_data.get('date'),
+            created_by=created_by,
+            group=group
+        )
+        
+        # Validate every item's shares in memory before writing anything else
+        for item_data in items_data:
+            ItemShare.clean_share_set(item_data.get('price'), item_data.get('shares', []))
+        
+        bill_items = BillItem.objects.bulk_create([
+            BillItem(bill=bill, name=item_data.get('name'), price=item_data.get('price'))
+            for item_data in items_data
+        ])
+        
+        ItemShare.objects.bulk_create([
+            ItemShare(
+                item=bill_item,
+                person=persons[share_data.get('person_id')],
+                split_type=share_data.get('split_type'),
+                percentage=share_data.get('percentage'),
+                exact_amount=share_data.get('exact_amount'),
+                share_units=share_data.get('share_units'),
+                amount=amount
+            )
+            for bill_item, item_data, share_amounts in zip(bill_items, items_data, item_amounts)
+            for share_data, amount in zip(item_data.get('shares', []), share_amounts)
+        ])
+        
+        # Payers without any item shares still become participants, owing nothing
+        owed_amounts = dict(person_totals)
+        for payment_data in payments_data:
+            owed_amounts.setdefault(payment_data.get('person_id'), Decimal('0.00'))
+        
+        BillParticipant.objects.bulk_create([
+            BillParticipant(bill=bill, person=persons[person_id], owed_amount=amount)
+            for person_id, amount in owed_amounts.items()
+        ])
+        
+        Payment.objects.bulk_create([
+            Payment(
+                payment_type='BILL',
+                person=persons[payment_data.get('person_id')],
+                bill=bill,
+                amount=payment_data.get('amount'),
+                date=bill.date,
+                description=f"Payment for {bill.title}"
+            )
+            for payment_data in payments_data
+        ])
+        
+        # Drop any stale paid amounts cached under a recycled bill id, in every worker
+        invalidate_namespace(f'bill_{bill.pk}')
+        
+        return bill
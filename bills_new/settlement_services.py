@@ -0,0 +1,116 @@
+import heapq
+from decimal import Decimal
+from django.db.models import Sum, Q, OuterRef, Subquery, Value, DecimalField
+from django.db.models.functions import Coalesce
+from .models import Person, BillParticipant, Payment
+from .split_engine import from_cents, to_cents
+
+
+class SettlementPlanService:
+    @staticmethod
+    def get_net_positions(group):
+        """
+        Net position of everyone involved in a group, in integer cents.
+        Positive: the person is owed money. Negative: the person owes money.
+
+        Net position is bill payments minus owed amounts on the group's bills,
+        plus SETTLEMENT payments exchanged with other people in the group.
+        Everything is computed in a single query with one subquery per term.
+        """
+        people = Person.objects.filter(
+            Q(member_groups=group) | Q(bill_participations__bill__group=group)
+        ).distinct()
+        people_ids = people.values('pk')
+
+        def summed(queryset, field):
+            return Coalesce(
+                Subquery(
+                    queryset.values('person').annotate(total=Sum(field)).values('total')[:1]
+                ),
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            )
+
+        owed = BillParticipant.objects.filter(person=OuterRef('pk'), bill__group=group)
+        paid = Payment.objects.filter(person=OuterRef('pk'), payment_type='BILL', bill__group=group)
+        settled = Payment.objects.filter(
+            person=OuterRef('pk'),
+            payment_type='SETTLEMENT',
+            other_person__in=people_ids
+        )
+
+        rows = people.select_related('user').annotate(
+            owed_total=summed(owed, 'owed_amount'),
+            paid_total=summed(paid, 'amount'),
+            settled_total=summed(settled, 'amount'),
+        ).order_by('pk')
+
+        return [
+            (person, to_cents(
+                person.paid_total - person.owed_total + person.settled_total
+            ))
+            for person in rows
+        ]
+
+    @staticmethod
+    def plan_transfers(net_positions):
+        """
+        Greedy minimum cash-flow plan over (person_id, cents) pairs.
+
+        Repeatedly settles the largest debtor against the largest creditor,
+        which needs at most n - 1 transfers. Ties break on person id so the
+        plan is deterministic. Returns (transfers, unbalanced_cents) where
+        transfers are (from_id, to_id, cents) and unbalanced_cents is whatever
+        could not be matched (non-zero only if bills are not fully paid).
+        """
+        creditors = [(-cents, person_id) for person_id, cents in net_positions if cents > 0]
+        debtors = [(cents, person_id) for person_id, cents in net_positions if cents < 0]
+        heapq.heapify(creditors)
+        heapq.heapify(debtors)
+
+        transfers = []
+        while creditors and debtors:
+            credit, creditor_id = heapq.heappop(creditors)
+            debt, debtor_id = heapq.heappop(debtors)
+            amount = min(-credit, -debt)
+            transfers.append((debtor_id, creditor_id, amount))
+
+            if -credit > amount:
+                heapq.heappush(creditors, (credit + amount, creditor_id))
+            if -debt > amount:
+                heapq.heappush(debtors, (debt + amount, debtor_id))
+
+        unbalanced = -sum(credit for credit, _ in creditors) + sum(debt for debt, _ in debtors)
+        return transfers, unbalanced
+
+    @staticmethod
+    def build_plan(group):
+        """Compute the settlement plan for a group as a JSON-ready dict."""
+        positions = SettlementPlanService.get_net_positions(group)
+        people = {person.id: person for person, _ in positions}
+        transfers, unbalanced = SettlementPlanService.plan_transfers(
+            [(person.id, cents) for person, cents in positions]
+        )
+
+        return {
+            'group_id': group.id,
+            'net_positions': [
+                {
+                    'person_id': person.id,
+                    'username': person.user.username,
+                    'net_amount': from_cents(cents),
+                }
+                for person, cents in positions
+            ],
+            'transfers': [
+                {
+                    'from_person_id': from_id,
+                    'from_username': people[from_id].user.username,
+                    'to_person_id': to_id,
+                    'to_username': people[to_id].user.username,
+                    'amount': from_cents(cents),
+                }
+                for from_id, to_id, cents in transfers
+            ],
+            'unbalanced_amount': from_cents(unbalanced),
+        }
@@ -1,7 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Person
+from .models import Person, Bill, BillItem, ItemShare, Payment, PairBalance
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -16,4 +16,27 @@ def save_user_profile(sender, instance, **kwargs):
         instance.profile.save()
     except Person.DoesNotExist:
         # Create the profile if it doesn't exist
-        Person.objects.create(user=instance)
\ No newline at end of file
+        Person.objects.create(user=instance)
+
+@receiver(post_delete, sender=ItemShare)
+def refresh_item_share_amounts(sender, instance, origin=None, **kwargs):
+    """
+    Recompute the remaining share amounts when a share is removed from an
+    item, whether directly or by a cascade (e.g. deleting a Person)
+    """
+    # Skip cascades from deleting the item or bill itself
+    if isinstance(origin, (Bill, BillItem)) or getattr(origin, 'model', None) in (Bill, BillItem):
+        return
+    try:
+        item = BillItem.objects.get(pk=instance.item_id)
+    except BillItem.DoesNotExist:
+        return
+    item.refresh_share_amounts()
+
+@receiver(post_delete, sender=Payment)
+def remove_settlement_from_ledger(sender, instance, **kwargs):
+    """Take a deleted SETTLEMENT payment out of the pairwise balance ledger"""
+    entry = Payment._ledger_entry(instance.payment_type, instance.person_id, instance.other_person_id, instance.amount)
+    if entry:
+        PairBalance.adjust(entry[0], entry[1], -entry[2], create=False)
+
@@ -0,0 +1,156 @@
+"""
+Split engine shared by bill validation and persistence.
+
+Every share of a bill is computed in one pass over integer cents, so the
+serializer, BillService and PersonalExpenseService always agree on the
+amounts. Rounding remainders are handed out with the largest-remainder
+method; ties go to shares in list order, starting from a position that
+rotates with the item index so leftover cents spread across people instead
+of always landing on the first share.
+
+Split semantics per item:
+- EXACT: the share's exact_amount.
+- PERCENTAGE: item price times percentage / 100.
+- SHARES: item price in proportion to share_units among the SHARES shares.
+- EQUAL / ADJUSTED: the item price, less every ADJUSTED share's
+  exact_amount adjustment, divided equally among the EQUAL and ADJUSTED
+  shares; each ADJUSTED share then adds its own adjustment back.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from .models import SplitType
+
+
+def to_cents(amount):
+    """Convert a Decimal/str/float/int money amount to integer cents."""
+    if amount is None or amount == '':
+        return 0
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Convert integer cents back to a two-place Decimal."""
+    return (Decimal(cents) / Decimal(100)).quantize(Decimal('0.01'))
+
+
+def _apportion(total, weights, offset=0):
+    """
+    Split integer `total` proportionally to integer `weights` so the parts
+    sum exactly to `total` (largest-remainder method).
+    """
+    weight_sum = sum(weights)
+    count = len(weights)
+    if not count or weight_sum <= 0:
+        return [0] * count
+
+    quotas = [total * weight for weight in weights]
+    parts = [quota // weight_sum for quota in quotas]
+    leftover = total - sum(parts)
+    if leftover:
+        order = sorted(
+            range(count),
+            key=lambda i: (-(quotas[i] % weight_sum), (i - offset) % count)
+        )
+        for i in order[:leftover]:
+            parts[i] += 1
+    return parts
+
+
+def _units(value):
+    if value is None or value == '':
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def split_item_cents(price, shares, offset=0):
+    """
+    Compute every share of one item in integer cents.
+
+    Args:
+        price: Item price
+        shares: Sequence of share dicts with split_type and, depending on the
+            split type, percentage, exact_amount or share_units
+        offset: Rotation for tie-breaking leftover cents
+
+    Returns:
+        List of cents, one per share, in input order
+    """
+    price_cents = to_cents(price)
+    amounts = [0] * len(shares)
+
+    percentage_idx, percentage_weights = [], []
+    units_idx, units_weights = [], []
+    pool_idx, adjustments = [], []
+
+    for i, share in enumerate(shares):
+        split_type = share.get('split_type') or SplitType.EQUAL
+        if split_type == SplitType.EXACT:
+            amounts[i] = to_cents(share.get('exact_amount'))
+        elif split_type == SplitType.PERCENTAGE:
+            percentage_idx.append(i)
+            percentage_weights.append(to_cents(share.get('percentage')))  # hundredths of a percent
+        elif split_type == SplitType.SHARES:
+            units_idx.append(i)
+            units_weights.append(max(_units(share.get('share_units')), 0))
+        else:
+            pool_idx.append(i)
+            adjustments.append(
+                to_cents(share.get('exact_amount')) if split_type == SplitType.ADJUSTED else 0
+            )
+
+    if percentage_idx:
+        percentage_total = sum(percentage_weights)
+        group_total = int(
+            (Decimal(price_cents * percentage_total) / Decimal(10000)).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+        )
+        parts = _apportion(group_total, percentage_weights, offset)
+        for i, part in zip(percentage_idx, parts):
+            amounts[i] = part
+
+    if units_idx:
+        parts = _apportion(price_cents, units_weights, offset)
+        for i, part in zip(units_idx, parts):
+            amounts[i] = part
+
+    if pool_idx:
+        pool_total = price_cents - sum(adjustments)
+        parts = _apportion(pool_total, [1] * len(pool_idx), offset)
+        for i, part, adjustment in zip(pool_idx, parts, adjustments):
+            amounts[i] = part + adjustment
+
+    return amounts
+
+
+def split_item(price, shares, offset=0):
+    """Like split_item_cents, but returns two-place Decimals."""
+    return [from_cents(cents) for cents in split_item_cents(price, shares, offset)]
+
+
+def split_bill(items):
+    """
+    Compute every share of a whole bill.
+
+    Args:
+        items: Sequence of item dicts with 'price' and 'shares'; each share
+            dict also carries 'person_id'
+
+    Returns:
+        Tuple of (item_amounts, person_totals): a list per item of Decimal
+        share amounts in input order, and a dict of person_id to the total
+        Decimal owed across the bill
+    """
+    item_amounts = []
+    person_cents = {}
+
+    for offset, item in enumerate(items):
+        shares = item.get('shares', [])
+        cents = split_item_cents(item.get('price'), shares, offset)
+        item_amounts.append([from_cents(amount) for amount in cents])
+        for share, amount in zip(shares, cents):
+            person_id = share.get('person_id')
+            person_cents[person_id] = person_cents.get(person_id, 0) + amount
+
+    person_totals = {person_id: from_cents(cents) for person_id, cents in person_cents.items()}
+    return item_amounts, person_totals
@@ -1,3 +1,251 @@
+import math
+from datetime import date
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from .models import Bill, BillItem, BillParticipant, Group, ItemShare, Payment, PairBalance
+from .services import BillService
+from .settlement_services import SettlementPlanService
+from .split_engine import split_bill, split_item
+
+
+def make_person(username):
+    # The post_save signal on User creates the Person profile
+    return User.objects.create(username=username).profile
+
+
+class PairBalanceTests(TestCase):
+    def setUp(self):
+        self.alice = make_person('alice')
+        self.bob = make_person('bob')
+
+    def test_settlement_updates_both_directions(self):
+        Payment.create_settlement(self.alice, self.bob, Decimal('12.50'), date.today())
+        Payment.create_settlement(self.bob, self.alice, Decimal('2.50'), date.today())
+
+        self.assertEqual(Payment.get_balance_between(self.alice, self.bob), Decimal('10.00'))
+        self.assertEqual(Payment.get_balance_between(self.bob, self.alice), Decimal('-10.00'))
+        self.assertEqual(Payment.get_balance(self.alice), Decimal('10.00'))
+        self.assertEqual(PairBalance.objects.get(person=self.alice).version, 2)
+
+    def test_rebuild_matches_payment_history(self):
+        Payment.create_settlement(self.alice, self.bob, Decimal('7.25'), date.today())
+        PairBalance.objects.all().delete()
+
+        self.assertEqual(PairBalance.rebuild(), 2)
+        self.assertEqual(Payment.get_balance_between(self.alice, self.bob), Decimal('7.25'))
+        self.assertEqual(Payment.get_balance_between(self.bob, self.alice), Decimal('-7.25'))
+
+    def test_editing_and_deleting_settlements_updates_ledger(self):
+        payment = Payment.create_settlement(self.alice, self.bob, Decimal('10.00'), date.today())
+        Payment.create_settlement(self.alice, self.bob, Decimal('5.00'), date.today())
+
+        # Edited in admin: both rows of the pair
+        for row, amount in ((payment, Decimal('4.00')), (payment.paired_payment, Decimal('-4.00'))):
+            row.amount = amount
+            row.save()
+        self.assertEqual(Payment.get_balance_between(self.alice, self.bob), Decimal('9.00'))
+
+        # Deleting one row cascades to its mirror
+        Payment.objects.filter(pk=payment.pk).delete()
+        self.assertEqual(Payment.get_balance_between(self.alice, self.bob), Decimal('5.00'))
+        self.assertEqual(Payment.get_balance_between(self.bob, self.alice), Decimal('-5.00'))
+
+        ledger = sorted(PairBalance.objects.values_list('person_id', 'other_person_id', 'balance'))
+        PairBalance.rebuild()
+        self.assertEqual(sorted(PairBalance.objects.values_list('person_id', 'other_person_id', 'balance')), ledger)
+
+
+class SettlementPlanTests(TestCase):
+    def setUp(self):
+        self.alice = make_person('alice')
+        self.bob = make_person('bob')
+        self.carol = make_person('carol')
+        self.group = Group.objects.create(name='Trip', created_by=self.alice)
+        self.group.members.set([self.alice, self.bob, self.carol])
+
+        bill = Bill.objects.create(title='Dinner', date=date.today(), created_by=self.alice, group=self.group)
+        for person in (self.alice, self.bob, self.carol):
+            BillParticipant.objects.create(bill=bill, person=person, owed_amount=Decimal('10.00'))
+        Payment.create_bill_payment(self.alice, bill, Decimal('30.00'), date.today())
+
+    def test_plan_settles_debtors_against_creditor(self):
+        plan = SettlementPlanService.build_plan(self.group)
+
+        transfers = {(t['from_person_id'], t['to_person_id']): t['amount'] for t in plan['transfers']}
+        self.assertEqual(transfers, {
+            (self.bob.id, self.alice.id): Decimal('10.00'),
+            (self.carol.id, self.alice.id): Decimal('10.00'),
+        })
+        self.assertEqual(plan['unbalanced_amount'], Decimal('0.00'))
+
+    def test_plan_accounts_for_settlements(self):
+        Payment.create_settlement(self.bob, self.alice, Decimal('10.00'), date.today())
+
+        plan = SettlementPlanService.build_plan(self.group)
+
+        self.assertEqual(len(plan['transfers']), 1)
+        self.assertEqual(plan['transfers'][0]['from_person_id'], self.carol.id)
+
+    def test_greedy_needs_at_most_n_minus_one_transfers(self):
+        positions = [(i, cents) for i, cents in enumerate([500, -200, -300, 1000, -600, -400])]
+
+        transfers, unbalanced = SettlementPlanService.plan_transfers(positions)
+
+        self.assertLessEqual(len(transfers), len(positions) - 1)
+        self.assertEqual(unbalanced, 0)
+
+
+class SplitEngineTests(TestCase):
+    def test_equal_split_distributes_remainder_cents(self):
+        shares = [{'split_type': 'EQUAL'}] * 3
+
+        self.assertEqual(split_item(Decimal('10.00'), shares), [Decimal('3.34'), Decimal('3.33'), Decimal('3.33')])
+        self.assertEqual(split_item(Decimal('10.00'), shares, offset=1), [Decimal('3.33'), Decimal('3.34'), Decimal('3.33')])
+
+    def test_mixed_split_types(self):
+        shares = [
+            {'split_type': 'PERCENTAGE', 'percentage': Decimal('25')},
+            {'split_type': 'PERCENTAGE', 'percentage': Decimal('75')},
+            {'split_type': 'SHARES', 'share_units': 1},
+            {'split_type': 'SHARES', 'share_units': 3},
+            {'split_type': 'EXACT', 'exact_amount': Decimal('1.50')},
+        ]
+
+        self.assertEqual(
+            split_item(Decimal('20.00'), shares),
+            [Decimal('5.00'), Decimal('15.00'), Decimal('5.00'), Decimal('15.00'), Decimal('1.50')]
+        )
+
+    def test_adjusted_split_shifts_equal_pool(self):
+        shares = [
+            {'split_type': 'ADJUSTED', 'exact_amount': Decimal('2.00')},
+            {'split_type': 'EQUAL'},
+        ]
+
+        self.assertEqual(split_item(Decimal('12.00'), shares), [Decimal('7.00'), Decimal('5.00')])
+
+    def test_bill_totals_add_up_to_bill_total(self):
+        items = [
+            {'price': Decimal('10.00'), 'shares': [{'person_id': p, 'split_type': 'EQUAL'} for p in (1, 2, 3)]}
+            for _ in range(30)
+        ]
+
+        _, totals = split_bill(items)
+
+        self.assertEqual(sum(totals.values()), Decimal('300.00'))
+        self.assertEqual(set(totals.values()), {Decimal('100.00')})
+
+
+class BulkCreateBillTests(TestCase):
+    def setUp(self):
+        self.people = [make_person(f'diner{i}') for i in range(10)]
+
+    def bill_data(self, item_count):
+        return {
+            'bill': {'title': 'Banquet', 'date': date.today()},
+            'items': [
+                {
+                    'name': f'Dish {i}',
+                    'price': Decimal('10.00'),
+                    'shares': [{'person_id': p.id, 'split_type': 'EQUAL'} for p in self.people],
+                }
+                for i in range(item_count)
+            ],
+            'bill_paid_by': [{'person_id': self.people[0].id, 'amount': Decimal('10.00') * item_count}],
+        }
+
+    def test_query_count_grows_only_with_insert_batches(self):
+        with self.assertNumQueries(8):
+            BillService.create_bill(self.bill_data(1), self.people[0], bulk=True)
+
+        # 150 shares: more bound parameters than fit in one INSERT, so the
+        # shares take as many INSERTs as the backend needs, and nothing else grows
+        share_fields = [f for f in ItemShare._meta.concrete_fields if not f.primary_key]
+        share_batches = math.ceil(150 / connection.ops.bulk_batch_size(share_fields, [None] * 150))
+        self.assertGreater(share_batches, 1)
+        with self.assertNumQueries(7 + share_batches):
+            BillService.create_bill(self.bill_data(15), self.people[0], bulk=True)
+
+    def test_bulk_matches_row_by_row_path(self):
+        bulk_bill = BillService.create_bill(self.bill_data(3), self.people[0], bulk=True)
+        slow_bill = BillService.create_bill(self.bill_data(3), self.people[0])
+
+        def owed(bill):
+            return sorted(bill.bill_participants.values_list('person_id', 'owed_amount'))
+
+        self.assertEqual(owed(bulk_bill), owed(slow_bill))
+        self.assertEqual(ItemShare.objects.filter(item__bill=bulk_bill).count(), 30)
+        self.assertEqual(Payment.get_bill_contributions(bulk_bill).count(), 1)
+
+    def test_row_by_row_path_refreshes_amounts_once_per_item(self):
+        with patch.object(BillItem, 'refresh_share_amounts', autospec=True,
+                          side_effect=BillItem.refresh_share_amounts) as refresh:
+            bill = BillService.create_bill(self.bill_data(3), self.people[0])
+
+        self.assertEqual(refresh.call_count, 3)
+        self.assertEqual(sum(ItemShare.objects.filter(item__bill=bill).values_list('amount', flat=True)), Decimal('30.00'))
+
+
+class StoredShareAmountTests(TestCase):
+    def setUp(self):
+        self.alice = make_person('alice')
+        self.bob = make_person('bob')
+        bill = Bill.objects.create(title='Lunch', date=date.today(), created_by=self.alice)
+        self.item = bill.items.create(name='Pizza', price=Decimal('9.00'))
+
+    def test_amounts_follow_share_set_and_price(self):
+        first = ItemShare.objects.create(item=self.item, person=self.alice)
+        self.assertEqual(first.amount, Decimal('9.00'))
+
+        ItemShare.objects.create(item=self.item, person=self.bob)
+        first.refresh_from_db()
+        self.assertEqual(first.amount, Decimal('4.50'))
+
+        self.item.price = Decimal('10.00')
+        self.item.save()
+        self.assertEqual(sorted(self.item.shares.values_list('amount', flat=True)), [Decimal('5.00'), Decimal('5.00')])
+
+        self.item.shares.get(person=self.bob).delete()
+        first.refresh_from_db()
+        self.assertEqual(first.amount, Decimal('10.00'))
+
+    def test_deleting_a_person_refreshes_remaining_shares(self):
+        first = ItemShare.objects.create(item=self.item, person=self.alice)
+        ItemShare.objects.create(item=self.item, person=self.bob)
+
+        self.bob.delete()
+        first.refresh_from_db()
+        self.assertEqual(first.amount, Decimal('9.00'))
+
+    def test_share_amount_reads_without_queries(self):
+        ItemShare.objects.create(item=self.item, person=self.alice)
+        ItemShare.objects.create(item=self.item, person=self.bob)
+        shares = list(ItemShare.objects.filter(item=self.item))
+
+        with self.assertNumQueries(0):
+            self.assertEqual([s.share_amount for s in shares], [Decimal('4.50'), Decimal('4.50')])
+
+
+class ParticipantPaidAmountTests(TestCase):
+    def test_with_paid_amounts_lists_participants_in_one_query(self):
+        alice, bob = make_person('alice'), make_person('bob')
+        bill = Bill.objects.create(title='Cab', date=date.today(), created_by=alice)
+        BillParticipant.objects.create(bill=bill, person=alice, owed_amount=Decimal('6.00'))
+        BillParticipant.objects.create(bill=bill, person=bob, owed_amount=Decimal('6.00'))
+        Payment.create_bill_payment(alice, bill, Decimal('12.00'), date.today())
+
+        with self.assertNumQueries(1):
+            rows = [
+                (p.person_id, p.paid_amount, p.balance)
+                for p in BillParticipant.objects.filter(bill=bill).order_by('person_id').with_paid_amounts()
+            ]
+
+        self.assertEqual(rows, [
+            (alice.id, Decimal('12.00'), Decimal('6.00')),
+            (bob.id, Decimal('0.00'), Decimal('-6.00')),
+        ])
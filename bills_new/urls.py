@@ -19,6 +19,7 @@ urlpatterns = [
     path('groups/', views.get_groups, name='get_groups'),
     path('groups/<int:group_id>/', views.get_group_detail, name='get_group_detail'),
     path('groups/<int:group_id>/participants/', views.get_group_participants, name='get_group_participants'),
+    path('groups/<int:group_id>/settle-plan/', views.get_group_settle_plan, name='get_group_settle_plan'),
 
     path('dashboard/', views.person_balance_dashboard, name='balance_dashboard'),
     path('dashboard/<int:person_id>/', views.person_balance_dashboard, name='person_balance_dashboard'),
@@ -4,7 +4,8 @@ from rest_framework.response import Response
 from django.shortcuts import render, get_object_or_404
 from .serializers import BillSerializer, GroupSerializer, PersonSerializer, SettlementPaymentSerializer
 from .services import BillService
-from .models import Bill, BillParticipant, BillItem, ItemShare, Payment, Group, Person
+from .settlement_services import SettlementPlanService
+from .models import Bill, BillParticipant, BillItem, ItemShare, Payment, Group, Person, PairBalance
 from django.db.models import Sum, Q
 from decimal import Decimal
 from django.db import transaction
@@ -32,7 +33,7 @@ def save_bill(request):
             created_by = Person.objects.first()
 
             # Create bill using service
-            bill = BillService.create_bill(serializer.validated_data, created_by)
+            bill = BillService.create_bill(serializer.validated_data, created_by, bulk=True)
             
             return Response({
                 'success': True,
@@ -59,7 +60,7 @@ def bill_list(request):
 def bill_detail(request, bill_id):
     """View to display detailed information about a specific bill"""
     bill = Bill.objects.get(id=bill_id)
-    participants = BillParticipant.objects.filter(bill=bill)
+    participants = BillParticipant.objects.filter(bill=bill).select_related('person__user').with_paid_amounts()
     items = BillItem.objects.select_related('bill').prefetch_related('shares__person').filter(bill=bill)
     payments = Payment.objects.filter(bill=bill)
     
@@ -166,6 +167,20 @@ def get_group_participants(request, group_id):
     })
 
 
+@api_view(['GET'])
+# @permission_classes([IsAuthenticated])
+def get_group_settle_plan(request, group_id):
+    """
+    API endpoint to compute the smallest set of transfers that settles a group.
+    """
+    group = get_object_or_404(Group, id=group_id)
+    plan = SettlementPlanService.build_plan(group)
+    
+    return Response({
+        'success': True,
+        **plan
+    })
+
 
 def person_balance_dashboard(request, person_id=None):
     """
@@ -185,7 +200,7 @@ def person_balance_dashboard(request, person_id=None):
         person = request.user.profile
     
     # Get all bill participations
-    bill_participations = BillParticipant.objects.filter(person=person)
+    bill_participations = BillParticipant.objects.filter(person=person).select_related('bill').with_paid_amounts()
     
     # For each participation, get the items and payments
     for participation in bill_participations:
@@ -227,10 +242,15 @@ def person_balance_dashboard(request, person_id=None):
         Q(payments__other_person=person) | Q(involved_payments__person=person)
     ).distinct().exclude(id=person.id)
     
+    # Load every materialized counterparty balance in one query
+    pair_balances = dict(
+        PairBalance.objects.filter(person=person).values_list('other_person_id', 'balance')
+    )
+    
     person_balances = []
     for other_person in related_people:
         # Get balance between current person and other person
-        balance = Payment.get_balance_between(person, other_person)
+        balance = pair_balances.get(other_person.id, Decimal('0.00'))
         
         # Get all settlements between these two people
         settlements = Payment.objects.filter(
@@ -1,3 +1,33 @@
 from django.contrib import admin
+from .models import ReceiptJob, ReceiptJobImage, ReceiptScan, CachedResult
 
-# Register your models here.
+
+class ReceiptJobImageInline(admin.TabularInline):
+    model = ReceiptJobImage
+    extra = 0
+    fields = ['position', 'image', 'content_type']
+    readonly_fields = ['position', 'image', 'content_type']
+
+
+@admin.register(ReceiptJob)
+class ReceiptJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'mode', 'provider', 'status', 'attempts', 'worker', 'created_at', 'finished_at']
+    list_filter = ['status', 'mode', 'provider']
+    readonly_fields = ['attempts', 'worker', 'created_at', 'started_at', 'finished_at']
+    inlines = [ReceiptJobImageInline]
+
+
+@admin.register(ReceiptScan)
+class ReceiptScanAdmin(admin.ModelAdmin):
+    list_display = ['id', 'provider', 'image_hash', 'bill', 'created_at']
+    list_filter = ['provider']
+    search_fields = ['image_hash']
+    readonly_fields = ['image_hash', 'provider', 'ocr_text', 'result', 'timings', 'created_at']
+
+
+@admin.register(CachedResult)
+class CachedResultAdmin(admin.ModelAdmin):
+    list_display = ['namespace', 'key', 'hit_count', 'created_at', 'last_used_at']
+    list_filter = ['namespace']
+    search_fields = ['key']
+    readonly_fields = ['namespace', 'key', 'value', 'hit_count', 'created_at', 'last_used_at']
@@ -0,0 +1,229 @@
+"""
+Offline benchmark of the receipt pipeline (see the benchmark_receipts command).
+
+Every image in a directory goes through process_images_bytes (preprocessing
+and OCR), stitch_ocr_texts and process_ocr_text_with_llm, and each stage is
+timed. Providers are pluggable. Real providers can be used. Stubs can also
+be installed in the provider registry: they answer from a responses file,
+or with a sample receipt, after an optional simulated latency. Stub runs
+need no network or API keys, so they can be repeated to compare commits.
+
+Everything runs inside a transaction that is rolled back, so benchmark
+runs leave nothing in the OCR and LLM caches.
+"""
+import os
+import glob
+import json
+import time
+import resource
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from .receipt_parser import parse_receipt_text
+from .router import LatencyStats
+from .stitching import stitch_ocr_texts
+from .utils import (
+    GEMINI_MODEL,
+    OCR_TEXT_GENERATION_CONFIG,
+    OCRProvider,
+    gemini_model_key,
+    process_images_bytes,
+    process_ocr_text_with_llm,
+    providers
+)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# OCR text the stub Vision client returns for images without a recorded response
+SAMPLE_RECEIPT = """CORNER MARKET
+12 Main St, Springfield, IL 62701
+03/14/2025 18:42
+MILK 4.99
+BREAD 2.50
+EGGS 3.19
+SUBTOTAL 10.68
+TAX 0.74
+TOTAL 11.42
+VISA 11.42"""
+
+
+class StubResponses:
+    """
+    Canned provider answers for the image being benchmarked.
+
+    Args:
+        responses: {'ocr': {image file name: text}, 'llm': {image file name: response}}.
+            Images without an OCR entry get SAMPLE_RECEIPT, and images without
+            an LLM entry get the rule-based parse of their OCR text.
+        ocr_latency: Seconds every stubbed Vision request takes
+        llm_latency: Seconds every stubbed Gemini request takes
+    """
+    def __init__(self, responses: Optional[Dict[str, Dict[str, str]]] = None,
+                 ocr_latency: float = 0.0, llm_latency: float = 0.0):
+        self.responses = responses or {}
+        self.ocr_latency = ocr_latency
+        self.llm_latency = llm_latency
+        self.current = None
+
+    def ocr_text(self) -> str:
+        return self.responses.get('ocr', {}).get(self.current, SAMPLE_RECEIPT)
+
+    def llm_text(self) -> str:
+        recorded = self.responses.get('llm', {}).get(self.current)
+        if recorded is not None:
+            return recorded
+        return json.dumps(parse_receipt_text(self.ocr_text())['bill'])
+
+
+class StubVisionClient:
+    def __init__(self, stubs: StubResponses):
+        self.stubs = stubs
+
+    def batch_annotate_images(self, requests):
+        time.sleep(self.stubs.ocr_latency)
+        text = self.stubs.ocr_text()
+        return SimpleNamespace(responses=[
+            SimpleNamespace(error=SimpleNamespace(message=''), text_annotations=[SimpleNamespace(description=text)])
+            for _ in requests
+        ])
+
+
+class StubGeminiModel:
+    def __init__(self, stubs: StubResponses):
+        self.stubs = stubs
+
+    def generate_content(self, contents, stream=False):
+        time.sleep(self.stubs.llm_latency)
+        text = self.stubs.llm_text()
+        if stream:
+            return iter([SimpleNamespace(text=text)])
+        return SimpleNamespace(text=text)
+
+
+def install_stubs(stubs: StubResponses, ocr: bool = True, llm: bool = True) -> None:
+    """Register stub Vision and/or Gemini clients in this process's provider registry."""
+    if ocr:
+        providers.register('google_vision', StubVisionClient(stubs))
+    if llm:
+        api_key = os.environ.setdefault('GEMINI_API_KEY', 'offline-benchmark')
+        # Marks the SDK as configured, so the stub run never calls genai.configure
+        providers.register('gemini_api_key', api_key)
+        providers.register(gemini_model_key(api_key, GEMINI_MODEL, OCR_TEXT_GENERATION_CONFIG), StubGeminiModel(stubs))
+
+
+def find_images(directory: str, pattern: str = '*') -> List[str]:
+    return sorted(
+        path for path in glob.glob(os.path.join(directory, pattern))
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _stage_summary(stats: LatencyStats) -> Dict[str, Any]:
+    summary = stats.summary()
+    return {
+        'count': summary['count'],
+        'p50_ms': round(summary['p50'] * 1000, 2) if summary['p50'] is not None else None,
+        'p95_ms': round(summary['p95'] * 1000, 2) if summary['p95'] is not None else None,
+    }
+
+
+def run_benchmark(image_paths: List[str], provider: OCRProvider = OCRProvider.GOOGLE_CLOUD, runs: int = 1,
+                  use_cache: bool = False, stubs: Optional[StubResponses] = None) -> Dict[str, Any]:
+    """
+    Run every image through the pipeline `runs` times.
+
+    Args:
+        image_paths: Receipt images, each processed as its own upload
+        provider: OCR provider
+        runs: Times every image is processed
+        use_cache: Whether the OCR and LLM caches are used (within the run)
+        stubs: Stub responses, if stub clients are installed
+
+    Returns:
+        Report with per-stage latency percentiles, bytes processed, the
+        Python memory peak (tracemalloc) and the process's max RSS
+    """
+    stages = {stage: LatencyStats(window=None) for stage in ('ocr', 'stitch', 'llm', 'total')}
+    totals = {'images': 0, 'original_bytes': 0, 'processed_bytes': 0, 'ocr_text_chars': 0, 'llm_response_chars': 0}
+    errors = []
+
+    tracemalloc.start()
+    try:
+        with transaction.atomic():
+            for _ in range(runs):
+                for path in image_paths:
+                    name = os.path.basename(path)
+                    if stubs is not None:
+                        stubs.current = name
+                    with open(path, 'rb') as f:
+                        image_bytes = f.read()
+
+                    stage = 'ocr'
+                    start = time.perf_counter()
+                    try:
+                        ocr_results = process_images_bytes([image_bytes], provider, use_cache=use_cache)
+                        stages['ocr'].record(time.perf_counter() - start)
+                        failed = [result['error'] for result in ocr_results['results'] if 'error' in result]
+                        if failed:
+                            raise RuntimeError(failed[0])
+
+                        stage = 'stitch'
+                        started = time.perf_counter()
+                        ocr_text = stitch_ocr_texts([result['text'] for result in ocr_results['results']])
+                        stages['stitch'].record(time.perf_counter() - started)
+
+                        stage = 'llm'
+                        started = time.perf_counter()
+                        response = process_ocr_text_with_llm(ocr_text, use_cache=use_cache)
+                        stages['llm'].record(time.perf_counter() - started)
+                    except Exception as e:
+                        errors.append({'image': name, 'stage': stage, 'error': str(e)})
+                        continue
+                    stages['total'].record(time.perf_counter() - start)
+
+                    totals['images'] += 1
+                    totals['original_bytes'] += len(image_bytes)
+                    totals['processed_bytes'] += sum(
+                        report['processed_bytes'] for report in ocr_results['preprocessing']
+                    ) or len(image_bytes)
+                    totals['ocr_text_chars'] += len(ocr_text)
+                    totals['llm_response_chars'] += len(response)
+
+            transaction.set_rollback(True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'commit': _git_commit(),
+        'created_at': timezone.now().isoformat(),
+        'images': [os.path.basename(path) for path in image_paths],
+        'runs': runs,
+        'use_cache': use_cache,
+        'stages': {stage: _stage_summary(stats) for stage, stats in stages.items()},
+        'bytes': totals,
+        'memory': {
+            'tracemalloc_peak_bytes': peak,
+            # Kilobytes on Linux; includes memory allocated outside Python (e.g. by Pillow)
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        'errors': errors,
+    }
+
+
+def stub_limits() -> override_settings:
+    """Settings override that lifts the rate limits of stubbed providers."""
+    return override_settings(PROVIDER_LIMITS={'google_vision': None, 'gemini': None})
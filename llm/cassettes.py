@@ -0,0 +1,198 @@
+"""
+Record/replay of provider calls (Gemini, OpenAI, Google Cloud Vision).
+
+settings.PROVIDER_CASSETTE_MODE selects how the calls in llm.utils behave:
+
+- 'off': providers are called normally.
+- 'record': providers are called, and each response is saved, with its
+  latency, under a fingerprint of the request (model, settings, prompt,
+  image bytes).
+- 'replay': providers are never called. Responses are served from the saved
+  recordings, after the recorded latency scaled by
+  settings.PROVIDER_CASSETTE_LATENCY_SCALE (0 answers immediately). A
+  request without a recording fails with CassetteMiss.
+
+Replay lets the API (e.g. process_bill_images) be load tested on a machine
+without network access, at realistic provider speeds. The API keys still
+have to be set, but any value will do.
+
+Recordings are stored in settings.PROVIDER_CASSETTE_DIR, one JSON file per
+request, so several workers can record at once. Vision batches are saved
+per image, so a replayed upload may be batched differently than it was
+recorded.
+"""
+import os
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from django.conf import settings
+from .result_cache import make_key
+
+
+class CassetteMiss(RuntimeError):
+    """Replay mode found no recording for a request."""
+
+
+def mode() -> str:
+    return getattr(settings, 'PROVIDER_CASSETTE_MODE', 'off')
+
+
+def replaying() -> bool:
+    return mode() == 'replay'
+
+
+def _path(provider: str, key: str) -> Path:
+    directory = getattr(settings, 'PROVIDER_CASSETTE_DIR', None) or Path(settings.BASE_DIR) / 'cassettes'
+    return Path(directory) / provider / f'{key}.json'
+
+
+def _save(provider: str, key: str, response: Any, latency: float, **extra) -> None:
+    path = _path(provider, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so a concurrent replay never reads half a file
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'provider': provider, 'response': response, 'latency': latency, **extra}, f)
+    os.replace(tmp_path, path)
+
+
+def _load(provider: str, key: str) -> Dict[str, Any]:
+    try:
+        with open(_path(provider, key), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise CassetteMiss(f"No recorded {provider} response for request {key[:12]}; record it first.") from None
+
+
+def _sleep(latency: float) -> None:
+    scale = getattr(settings, 'PROVIDER_CASSETTE_LATENCY_SCALE', 1.0)
+    if latency and scale:
+        time.sleep(latency * scale)
+
+
+def replayable(provider: str, parts: tuple, call: Callable[[], Any],
+               encode: Callable[[Any], Any], decode: Callable[[Any], Any]) -> Any:
+    """
+    Make one provider call, recording or replaying it depending on the mode.
+
+    Args:
+        provider: Provider name, e.g. 'gemini'
+        parts: Everything that determines the response; hashed into the fingerprint
+        call: Makes the real call
+        encode: Turns the provider's response into JSON-serializable data
+        decode: Turns recorded data back into an object the caller can use like the response
+
+    Raises:
+        CassetteMiss: In replay mode, if the request was never recorded
+    """
+    current = mode()
+    if current == 'off':
+        return call()
+
+    key = make_key(provider, *parts)
+    if current == 'replay':
+        recording = _load(provider, key)
+        _sleep(recording['latency'])
+        return decode(recording['response'])
+
+    start = time.perf_counter()
+    response = call()
+    _save(provider, key, encode(response), time.perf_counter() - start)
+    return response
+
+
+def replayable_stream(provider: str, parts: tuple, call: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+    """
+    Like replayable, for a streamed response made of chunks with a .text.
+    The delay before every chunk is recorded and replayed.
+    """
+    current = mode()
+    if current == 'off':
+        yield from call()
+        return
+
+    key = make_key(provider, 'stream', *parts)
+    if current == 'replay':
+        recording = _load(provider, key)
+        for text, delay in zip(recording['response'], recording['delays']):
+            _sleep(delay)
+            yield SimpleNamespace(text=text)
+        return
+
+    texts, delays = [], []
+    last = time.perf_counter()
+    for chunk in call():
+        now = time.perf_counter()
+        texts.append(chunk.text)
+        delays.append(now - last)
+        last = now
+        yield chunk
+    _save(provider, key, texts, sum(delays), delays=delays)
+
+
+def replayable_batch(provider: str, parts: tuple, items: List[bytes], call: Callable[[], Any],
+                     split: Callable[[Any], List[Any]], join: Callable[[List[Any]], Any]) -> Any:
+    """
+    Like replayable, for a batch request over several images. Each image's
+    response is recorded on its own, keyed by `parts` and the image bytes.
+
+    Args:
+        items: Image bytes in request order
+        split: Turns the batch response into JSON-serializable data per image
+        join: Turns recorded data per image back into a batch response
+    """
+    current = mode()
+    if current == 'off':
+        return call()
+
+    keys = [make_key(provider, *parts, item) for item in items]
+    if current == 'replay':
+        recordings = [_load(provider, key) for key in keys]
+        # The images were sent together, so the batch takes as long as the slowest one did
+        _sleep(max(recording['latency'] for recording in recordings))
+        return join([recording['response'] for recording in recordings])
+
+    start = time.perf_counter()
+    response = call()
+    latency = time.perf_counter() - start
+    for key, data in zip(keys, split(response)):
+        _save(provider, key, data, latency)
+    return response
+
+
+def encode_gemini(response: Any) -> Dict[str, Optional[str]]:
+    return {'text': response.text if response else None}
+
+
+def decode_gemini(data: Dict[str, Optional[str]]) -> Any:
+    return SimpleNamespace(text=data['text'])
+
+
+def encode_openai(response: Any) -> Dict[str, Optional[str]]:
+    return {'content': response.choices[0].message.content}
+
+
+def decode_openai(data: Dict[str, Optional[str]]) -> Any:
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=data['content']))])
+
+
+def split_vision(batch_response: Any) -> List[Dict[str, Optional[str]]]:
+    return [
+        {
+            'error': response.error.message,
+            'text': response.text_annotations[0].description if response.text_annotations else None,
+        }
+        for response in batch_response.responses
+    ]
+
+
+def join_vision(items: List[Dict[str, Optional[str]]]) -> Any:
+    return SimpleNamespace(responses=[
+        SimpleNamespace(
+            error=SimpleNamespace(message=item['error']),
+            text_annotations=[SimpleNamespace(description=item['text'])] if item['text'] is not None else []
+        )
+        for item in items
+    ])
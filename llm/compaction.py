@@ -0,0 +1,134 @@
+"""
+Compaction of OCR text before it is sent to the LLM.
+
+Raw OCR output is padded with blank lines, runs of spaces from column
+alignment, separator rows, barcodes, and header/footer boilerplate
+(greetings, return policies, survey links). None of it helps the LLM build
+the bill, but every token of it adds to the latency and cost of each
+request.
+
+compact_ocr_text keeps what the prompt asks for:
+- the receipt body, from after the header to the last line with an amount,
+  minus lines with neither letters nor an amount (separators, barcodes).
+  The body does not start at the first amount: when Tesseract reads a
+  column layout, every item name comes before the first price.
+- the first HEADER_LINES lines (store name and address) and any footer
+  line with a date, an address or a payment method
+- summary lines (subtotal, tax, total) wherever they are
+
+Whitespace is collapsed and repeated footer lines are kept once. If the
+result is still over the token budget, header and footer lines are dropped
+from the end; body lines never are, since a missing item would silently
+change the bill.
+
+Text without a single amount is only whitespace-compacted, since there is
+no body to anchor on.
+
+Token counts are estimates (see estimate_tokens): the providers' tokenizers
+differ, and counting exactly would cost an API call.
+"""
+import re
+import math
+import logging
+from typing import Any, Dict, List, Tuple
+from .receipt_parser import (
+    ADDRESS_RE,
+    DATE_PATTERNS,
+    PAYMENT_METHODS,
+    SUBTOTAL_RE,
+    TAX_RE,
+    TOTAL_RE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lines at the top of the receipt kept as store information
+HEADER_LINES = 3
+# Characters per token assumed for a word or number
+CHARS_PER_TOKEN = 4
+
+AMOUNT_RE = re.compile(r'\d[.,]\d{2}\b')
+LETTER_RE = re.compile(r'[^\W\d_]')
+TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in a text: one per punctuation mark,
+    and one per CHARS_PER_TOKEN characters of each word or number.
+    """
+    return sum(max(1, math.ceil(len(piece) / CHARS_PER_TOKEN)) for piece in TOKEN_RE.findall(text))
+
+
+def _is_context(line: str) -> bool:
+    return bool(
+        ADDRESS_RE.search(line)
+        or any(pattern.search(line) for pattern, _ in DATE_PATTERNS)
+        or any(pattern.search(line) for _, pattern in PAYMENT_METHODS)
+    )
+
+
+def _is_summary(line: str) -> bool:
+    return bool(SUBTOTAL_RE.search(line) or TAX_RE.search(line) or TOTAL_RE.search(line))
+
+
+def _select_lines(lines: List[str]) -> List[Tuple[str, bool]]:
+    """Pick the lines worth sending, each flagged if it may be trimmed."""
+    amounts = [idx for idx, line in enumerate(lines) if AMOUNT_RE.search(line)]
+    if not amounts:
+        return [(line, False) for line in lines]
+
+    # A price within the header (e.g. a one-line receipt) starts the body early
+    first, last = min(amounts[0], HEADER_LINES), amounts[-1]
+    selected = []
+    seen = set()
+    for idx, line in enumerate(lines):
+        if idx == 0 or _is_summary(line):
+            selected.append((line, False))
+        elif first <= idx <= last:
+            if LETTER_RE.search(line) or AMOUNT_RE.search(line):
+                selected.append((line, False))
+        elif (idx < HEADER_LINES or _is_context(line)) and line.lower() not in seen:
+            selected.append((line, True))
+        seen.add(line.lower())
+    return selected
+
+
+def compact_ocr_text(text: str, token_budget: int = 0) -> Tuple[str, Dict[str, Any]]:
+    """
+    Shrink OCR text to the lines the LLM needs to build the bill.
+
+    Args:
+        text: OCR text, e.g. stitched from several photos
+        token_budget: Maximum estimated tokens of the result; 0 for no limit
+
+    Returns:
+        Tuple of (compacted text, stats with 'tokens_before', 'tokens_after',
+        'lines_before' and 'lines_after')
+    """
+    lines = [re.sub(r'\s+', ' ', line).strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    selected = _select_lines(lines)
+
+    costs = [estimate_tokens(line) for line, _ in selected]
+    total = sum(costs)
+    dropped = set()
+    if token_budget and total > token_budget:
+        for idx in reversed(range(len(selected))):
+            if total <= token_budget:
+                break
+            if selected[idx][1]:
+                dropped.add(idx)
+                total -= costs[idx]
+        if total > token_budget:
+            logger.warning(f"OCR text is {total} tokens after compaction, over the {token_budget} token budget")
+
+    compacted = '\n'.join(line for idx, (line, _) in enumerate(selected) if idx not in dropped)
+    stats = {
+        'tokens_before': estimate_tokens(text),
+        'tokens_after': estimate_tokens(compacted),
+        'lines_before': len(text.splitlines()),
+        'lines_after': len(selected) - len(dropped),
+    }
+    return compacted, stats
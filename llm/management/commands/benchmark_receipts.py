@@ -0,0 +1,60 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from llm.benchmark import StubResponses, find_images, install_stubs, run_benchmark, stub_limits
+from llm.utils import OCRProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the receipt pipeline (OCR, stitching, LLM) over a directory of images "
+        "and write per-stage latency, bytes and memory to a JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", nargs="?", default="test_images", help="Directory of receipt images")
+        parser.add_argument("--pattern", default="*", help="Glob pattern of the images to use, e.g. '[0-9]*.jpeg'")
+        parser.add_argument("--ocr", choices=["stub", "google_cloud", "tesseract"], default="stub",
+                            help="OCR provider; 'stub' answers from --responses without calling Vision")
+        parser.add_argument("--llm", choices=["stub", "gemini"], default="stub",
+                            help="LLM provider; 'stub' answers from --responses without calling Gemini")
+        parser.add_argument("--responses", help="JSON file of recorded answers: {\"ocr\": {image: text}, \"llm\": {image: response}}")
+        parser.add_argument("--ocr-latency", type=float, default=0.0, help="Seconds every stubbed OCR request takes")
+        parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds every stubbed LLM request takes")
+        parser.add_argument("--runs", type=int, default=3, help="Times every image is processed")
+        parser.add_argument("--use-cache", action="store_true", help="Use the OCR and LLM caches within the benchmark")
+        parser.add_argument("--output", default="benchmark.json", help="Path of the JSON report")
+
+    def handle(self, *args, **kwargs):
+        images = find_images(kwargs["directory"], kwargs["pattern"])
+        if not images:
+            raise CommandError(f"No images found in {kwargs['directory']}")
+
+        responses = None
+        if kwargs["responses"]:
+            with open(kwargs["responses"], encoding="utf-8") as f:
+                responses = json.load(f)
+
+        stub_ocr = kwargs["ocr"] == "stub"
+        stub_llm = kwargs["llm"] == "stub"
+        stubs = None
+        if stub_ocr or stub_llm:
+            stubs = StubResponses(responses, kwargs["ocr_latency"], kwargs["llm_latency"])
+            install_stubs(stubs, ocr=stub_ocr, llm=stub_llm)
+
+        provider = OCRProvider.GOOGLE_CLOUD if stub_ocr else OCRProvider(kwargs["ocr"])
+        self.stdout.write(f"Benchmarking {len(images)} images x {kwargs['runs']} runs (OCR: {kwargs['ocr']}, LLM: {kwargs['llm']})")
+
+        with stub_limits():
+            report = run_benchmark(images, provider, kwargs["runs"], kwargs["use_cache"], stubs)
+        report["ocr"] = kwargs["ocr"]
+        report["llm"] = kwargs["llm"]
+
+        with open(kwargs["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+        for stage, summary in report["stages"].items():
+            self.stdout.write(f"{stage:>6}: p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms ({summary['count']} samples)")
+        self.stdout.write(f"Python memory peak: {report['memory']['tracemalloc_peak_bytes']} bytes")
+        for error in report["errors"]:
+            self.stdout.write(self.style.ERROR(f"{error['image']} failed at {error['stage']}: {error['error']}"))
+        self.stdout.write(self.style.SUCCESS(f"Report written to {kwargs['output']}"))
@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from llm.models import ReceiptJobStatus
+from llm.services import ReceiptJobService
+
+
+class Command(BaseCommand):
+    help = "Run a receipt worker that processes queued receipt jobs; start as many as OCR throughput needs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Process the jobs that can be claimed now, then exit; jobs waiting for busy providers are left queued"
+        )
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--max-jobs", type=int, default=0, help="Exit after this many jobs (0 means no limit)")
+
+    def handle(self, *args, **kwargs):
+        worker = ReceiptJobService.worker_name()
+        processed = 0
+        self.stdout.write(f"Receipt worker {worker} started")
+
+        while True:
+            close_old_connections()
+            requeued = ReceiptJobService.requeue_stale()
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Requeued or failed {requeued} stale jobs"))
+
+            job = ReceiptJobService.claim_next(worker)
+            if job is None:
+                if kwargs["once"]:
+                    break
+                time.sleep(kwargs["poll_interval"])
+                continue
+
+            status = ReceiptJobService.run(job)
+            if status == ReceiptJobStatus.SUCCEEDED:
+                self.stdout.write(self.style.SUCCESS(f"Receipt job {job.id} succeeded"))
+            elif status == ReceiptJobStatus.PENDING:
+                self.stdout.write(self.style.WARNING(f"Receipt job {job.id} requeued, providers are busy"))
+            elif status == ReceiptJobStatus.FAILED:
+                self.stdout.write(self.style.ERROR(f"Receipt job {job.id} failed"))
+            else:
+                self.stdout.write(self.style.WARNING(f"Receipt job {job.id} was requeued while it ran"))
+
+            processed += 1
+            if kwargs["max_jobs"] and processed >= kwargs["max_jobs"]:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f"Receipt worker {worker} processed {processed} jobs"))
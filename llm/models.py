@@ -1,3 +1,111 @@
 from django.db import models
 
-# Create your models here.
+
+class ReceiptJobStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending'
+    RUNNING = 'running', 'Running'
+    SUCCEEDED = 'succeeded', 'Succeeded'
+    FAILED = 'failed', 'Failed'
+
+
+class ReceiptJobMode(models.TextChoices):
+    OCR_LLM = 'ocr_llm', 'OCR, then LLM over the extracted text'
+    GEMINI_IMAGE = 'gemini_image', 'Image sent straight to Gemini'
+
+
+class ReceiptJob(models.Model):
+    """
+    A receipt upload waiting for, or processed by, a receipt worker
+    (`python manage.py process_receipt_jobs`).
+    """
+    mode = models.CharField(max_length=20, choices=ReceiptJobMode.choices, default=ReceiptJobMode.OCR_LLM)
+    provider = models.CharField(max_length=20, default='google_cloud')
+    custom_prompt = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=10, choices=ReceiptJobStatus.choices, default=ReceiptJobStatus.PENDING)
+    result = models.TextField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # A job requeued because the providers were busy is not claimed before this
+    not_before = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='receipt_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Receipt job {self.id} ({self.status})"
+
+
+class ReceiptJobImage(models.Model):
+    job = models.ForeignKey(ReceiptJob, on_delete=models.CASCADE, related_name='images')
+    position = models.PositiveIntegerField()
+    image = models.FileField(upload_to='receipt_jobs/%Y/%m/%d/')
+    content_type = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ['position']
+
+    def __str__(self):
+        return f"Image {self.position} of receipt job {self.job_id}"
+
+
+class CachedResult(models.Model):
+    """
+    A cached result of an expensive call (OCR, LLM), addressed by a hash of
+    everything that determines it. See llm.result_cache.
+    """
+    namespace = models.CharField(max_length=20)
+    key = models.CharField(max_length=64)
+    value = models.JSONField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['namespace', 'key'], name='unique_cached_result'),
+        ]
+        indexes = [
+            models.Index(fields=['namespace', 'last_used_at'], name='cached_result_lru_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.namespace}:{self.key}"
+
+
+class ReceiptScan(models.Model):
+    """
+    A processed receipt upload: what OCR read and what the LLM made of it,
+    kept so the result can be fetched again without calling the providers,
+    and linked to the bill saved from it. A re-upload of the same images
+    with the same provider and prompt reuses the scan.
+    """
+    image_hash = models.CharField(max_length=64)
+    # OCR provider, or IMAGE_PROVIDER when the image went straight to the LLM
+    provider = models.CharField(max_length=20)
+    # SHA-256 of the custom prompt; '' for the default prompt
+    prompt_hash = models.CharField(max_length=64, blank=True)
+    ocr_text = models.TextField(blank=True)
+    result = models.TextField()
+    timings = models.JSONField(default=dict)
+    bill = models.ForeignKey(
+        'bills_new.Bill', on_delete=models.SET_NULL, null=True, blank=True, related_name='receipt_scans'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    IMAGE_PROVIDER = 'llm_image'
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['image_hash', 'provider', 'prompt_hash'], name='receipt_scan_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"Receipt scan {self.id} ({self.provider})"
@@ -0,0 +1,131 @@
+"""
+Image preprocessing applied before receipt images are sent to OCR or an LLM.
+
+Phone photos arrive at full camera resolution, far more than OCR needs.
+A profile rotates the image upright according to its EXIF orientation,
+optionally converts it to grayscale, downscales it to a target DPI and
+recompresses it as JPEG, which shrinks provider uploads, speeds up
+Tesseract and lowers memory per request.
+
+Profiles are named in settings.OCR_PREPROCESSING_PROFILE and
+settings.LLM_PREPROCESSING_PROFILE; extra profiles can be added with
+settings.IMAGE_PREPROCESSING_PROFILES. The 'none' profile leaves images
+untouched.
+"""
+import io
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Receipt paper is about 3 inches (80 mm) wide, and phone photos of a
+# receipt frame it with some margin: the short side of the photo is taken
+# to span this many inches when converting a target DPI to pixels
+FRAME_WIDTH_INCHES = 4
+
+PREPROCESSING_PROFILES = {
+    'none': None,
+    'ocr': {
+        'grayscale': True,
+        'target_dpi': 300,
+        'jpeg_quality': 85,
+    },
+    'llm': {
+        'grayscale': True,
+        'target_dpi': 200,
+        'jpeg_quality': 80,
+    },
+}
+
+
+def get_profile(name: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a preprocessing profile by name.
+
+    Raises:
+        ValueError: If the profile does not exist
+    """
+    profiles = {**PREPROCESSING_PROFILES, **getattr(settings, 'IMAGE_PREPROCESSING_PROFILES', {})}
+    if name not in profiles:
+        raise ValueError(f"Unknown preprocessing profile: {name}. Choose from: {list(profiles)}")
+    return profiles[name]
+
+
+def preprocess_image(image_bytes: bytes, profile_name: str) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Apply a preprocessing profile to one image.
+
+    Args:
+        image_bytes: Raw image bytes as uploaded
+        profile_name: Name of the preprocessing profile
+
+    Returns:
+        Tuple of (processed image bytes, report) where the report has the
+        profile name and the before/after byte counts and pixel sizes.
+        Images that cannot be decoded are passed through unchanged.
+    """
+    profile = get_profile(profile_name)
+    report = {
+        'profile': profile_name,
+        'original_bytes': len(image_bytes),
+        'processed_bytes': len(image_bytes),
+    }
+    if profile is None:
+        return image_bytes, report
+
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        report['original_size'] = img.size
+        rotated = img.getexif().get(0x0112, 1) not in (1, None)  # EXIF Orientation tag
+
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('L') if profile.get('grayscale') else img.convert('RGB')
+
+        max_short_side = int(profile['target_dpi'] * FRAME_WIDTH_INCHES)
+        short_side = min(img.size)
+        if short_side > max_short_side:
+            scale = max_short_side / short_side
+            img = img.resize(
+                (max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                Image.LANCZOS
+            )
+        report['processed_size'] = img.size
+
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=profile.get('jpeg_quality', 85), optimize=True)
+        processed = output.getvalue()
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, using the original image: {str(e)}")
+        return image_bytes, report
+
+    # Recompressing an already small upright image can make it bigger
+    if len(processed) >= len(image_bytes) and not rotated and report['processed_size'] == report['original_size']:
+        return image_bytes, report
+
+    report['processed_bytes'] = len(processed)
+    logger.info(
+        f"Preprocessed image with profile '{profile_name}': "
+        f"{report['original_bytes']} -> {report['processed_bytes']} bytes, "
+        f"{report['original_size']} -> {report['processed_size']} px"
+    )
+    return processed, report
+
+
+def preprocess_images(image_bytes_list: List[bytes], profile_name: str) -> Tuple[List[bytes], List[Dict[str, Any]]]:
+    """
+    Apply a preprocessing profile to several images at once. Pillow releases
+    the GIL while decoding, resizing and encoding, so a thread pool helps.
+
+    Returns:
+        Tuple of (processed image bytes, reports), both in input order
+    """
+    if get_profile(profile_name) is None or len(image_bytes_list) < 2:
+        processed = [preprocess_image(image_bytes, profile_name) for image_bytes in image_bytes_list]
+    else:
+        max_workers = min(len(image_bytes_list), getattr(settings, 'OCR_MAX_WORKERS', 4))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            processed = list(executor.map(lambda image_bytes: preprocess_image(image_bytes, profile_name), image_bytes_list))
+    return [image for image, _ in processed], [report for _, report in processed]
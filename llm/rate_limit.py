@@ -0,0 +1,222 @@
+"""
+Limits on outbound calls to OCR and LLM providers, shared by all workers.
+
+Each provider has a token bucket: `rate` calls per second, with bursts of up
+to `burst` calls after an idle period. Each provider also has a cap of
+`concurrency` calls in flight. A call that cannot start right away waits for
+a slot. At most `max_waiters` calls per provider may wait, and none of them
+longer than settings.PROVIDER_WAIT_TIMEOUT. Any other call is rejected with
+ProviderBusy, which the views turn into 429 Too Many Requests with a
+Retry-After header. A burst of uploads is therefore spread out or turned
+away early, instead of every request hitting the provider quota and failing
+together.
+
+The state lives in the shared Django cache (settings.CACHES), so the limits
+hold across gunicorn workers. It is built only on cache.add(), which is
+atomic on every backend the project configures:
+
+- Token bucket: time is cut into slots of 1/rate seconds, and each slot is
+  one token. A call takes a token by add()ing the key of an unclaimed slot
+  among the last `burst` slots. Tokens nobody takes within burst/rate
+  seconds are lost, which caps the bucket at `burst`.
+- Concurrency and waiting: each provider has `concurrency` lease keys, and
+  a running call holds one of them. The leases expire after `lease`
+  seconds, so a crashed worker cannot keep a slot forever. Waiting calls
+  hold one of `max_waiters` keys in the same way.
+- Releasing: the cache API has no atomic compare-and-delete, so a lease is
+  only deleted while it is certainly still ours, i.e. well before its
+  timeout. A lease held longer is left to expire, since by then another
+  call may have claimed the key.
+
+Waiting calls poll with exponential back-off (POLL_INTERVAL up to
+MAX_POLL_INTERVAL, with jitter), so a queue of waiters does not keep the
+cache's write lock busy.
+
+Limits default to PROVIDER_LIMITS, and single values can be overridden per
+provider with settings.PROVIDER_LIMITS.
+"""
+import math
+import time
+import uuid
+import random
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from django.conf import settings
+from django.core.cache import cache
+from .timing import stage
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_LIMITS = {
+    'google_vision': {'rate': 20, 'burst': 40, 'concurrency': 16, 'max_waiters': 64, 'lease': 60},
+    'gemini': {'rate': 5, 'burst': 10, 'concurrency': 8, 'max_waiters': 32, 'lease': 180},
+    'openai': {'rate': 5, 'burst': 10, 'concurrency': 8, 'max_waiters': 32, 'lease': 180},
+}
+
+# A waiting call checks for a free slot after POLL_INTERVAL seconds, then
+# backs off exponentially up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+# A lease is only deleted if it has at least this many seconds left
+RELEASE_MARGIN = 1.0
+
+
+class ProviderBusy(Exception):
+    """A provider call could not get a slot in time; retry after `retry_after` seconds."""
+    def __init__(self, provider: str, retry_after: float):
+        self.provider = provider
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{provider} is busy, retry in {self.retry_after} seconds.")
+
+
+def get_limits(provider: str) -> Optional[Dict[str, Any]]:
+    """Limits for a provider, or None if its calls are not limited."""
+    overrides = getattr(settings, 'PROVIDER_LIMITS', {})
+    if provider in overrides and overrides[provider] is None:
+        return None
+    limits = {**PROVIDER_LIMITS.get(provider, {}), **overrides.get(provider, {})}
+    return limits or None
+
+
+class ProviderLimiter:
+    def __init__(self, provider: str, limits: Dict[str, Any]):
+        self.provider = provider
+        self.rate = float(limits['rate'])
+        self.burst = int(limits['burst'])
+        self.concurrency = int(limits['concurrency'])
+        self.max_waiters = int(limits['max_waiters'])
+        self.lease = int(limits['lease'])
+        self.owner = uuid.uuid4().hex
+        # Claimed key -> (monotonic time claimed, timeout)
+        self._claimed: Dict[str, tuple] = {}
+
+    def _key(self, kind: str, index: int) -> str:
+        return f'provider_limit:{self.provider}:{kind}:{index}'
+
+    def _claim(self, kind: str, count: int, timeout: int) -> Optional[str]:
+        """Claim a free key among `count` lease keys of `kind`."""
+        keys = [self._key(kind, i) for i in range(count)]
+        taken = cache.get_many(keys)
+        for key in keys:
+            claimed_at = time.monotonic()
+            if key not in taken and cache.add(key, self.owner, timeout=timeout):
+                self._claimed[key] = (claimed_at, timeout)
+                return key
+        return None
+
+    def _release(self, key: str) -> None:
+        claimed_at, timeout = self._claimed.pop(key)
+        # Until its timeout no other call can add() the key, so it is still
+        # ours; past that it may belong to another call and must expire alone
+        if time.monotonic() - claimed_at < timeout - RELEASE_MARGIN:
+            cache.delete(key)
+
+    def take_token(self) -> Optional[float]:
+        """
+        Take a token from the bucket.
+
+        Returns:
+            None if a token was taken, otherwise seconds until the next one
+        """
+        now = time.time()
+        current = int(now * self.rate)
+        slots = range(current - self.burst + 1, current + 1)
+        keys = [self._key('token', slot) for slot in slots]
+        taken = cache.get_many(keys)
+        timeout = math.ceil(self.burst / self.rate) + 1
+        for key in keys:
+            if key not in taken and cache.add(key, self.owner, timeout=timeout):
+                return None
+        return (current + 1) / self.rate - now
+
+    def acquire(self, wait_timeout: float) -> str:
+        """
+        Wait for a concurrency slot and a token.
+
+        Returns:
+            The key of the claimed concurrency slot, for release()
+
+        Raises:
+            ProviderBusy: If the wait queue is full or no slot is free in time
+        """
+        deadline = time.monotonic() + wait_timeout
+        waiter = slot = None
+        retry_after = wait_timeout
+        poll_interval = POLL_INTERVAL
+        try:
+            while True:
+                if slot is None:
+                    slot = self._claim('slot', self.concurrency, self.lease)
+                if slot is not None:
+                    token_wait = self.take_token()
+                    if token_wait is None:
+                        return slot
+                    retry_after = token_wait
+
+                if waiter is None:
+                    waiter = self._claim('waiter', self.max_waiters, math.ceil(wait_timeout) + 1)
+                    if waiter is None:
+                        raise ProviderBusy(self.provider, retry_after)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ProviderBusy(self.provider, retry_after)
+                if slot is None:
+                    # Jitter keeps waiters from polling in lockstep
+                    delay = poll_interval * random.uniform(0.5, 1.0)
+                    poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
+                else:
+                    delay = retry_after
+                time.sleep(min(delay, remaining))
+        except ProviderBusy:
+            if slot is not None:
+                self._release(slot)
+            logger.warning(f"Rejected {self.provider} call: no slot within {wait_timeout} seconds")
+            raise
+        finally:
+            if waiter is not None:
+                self._release(waiter)
+
+    def release(self, slot: str) -> None:
+        self._release(slot)
+
+
+@contextmanager
+def provider_slot(provider: str, wait_timeout: Optional[float] = None) -> Iterator[None]:
+    """
+    Hold a rate-limited slot for one outbound call to `provider`. The wait
+    for the slot and the call are timed as the request's 'rate_limit' and
+    `provider` stages.
+
+    Raises:
+        ProviderBusy: If no slot became free within the wait timeout
+    """
+    limits = get_limits(provider)
+    if limits is None:
+        with stage(provider):
+            yield
+        return
+
+    if wait_timeout is None:
+        wait_timeout = getattr(settings, 'PROVIDER_WAIT_TIMEOUT', 10)
+    limiter = ProviderLimiter(provider, limits)
+    try:
+        with stage('rate_limit'):
+            slot = limiter.acquire(wait_timeout)
+    except ProviderBusy:
+        raise
+    except Exception as e:
+        # The limiter protects quotas; a cache outage should not stop all calls
+        logger.warning(f"Rate limiter unavailable for {provider}, calling without it: {str(e)}")
+        slot = None
+
+    try:
+        with stage(provider):
+            yield
+    finally:
+        if slot is not None:
+            try:
+                limiter.release(slot)
+            except Exception as e:
+                logger.warning(f"Could not release {provider} slot: {str(e)}")
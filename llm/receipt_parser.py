@@ -0,0 +1,235 @@
+"""
+Rule-based receipt parser for OCR text.
+
+Most receipts OCR into one "ITEM NAME ... 12.99" line per item followed by
+subtotal, tax and total lines. This parser reads those lines directly and
+builds the same JSON shape the LLM prompt (llm/prompts/prompt.txt) asks for,
+plus a confidence score. It only trusts its own result when the items
+reconcile with the detected totals; otherwise the caller falls back to the
+LLM.
+"""
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional
+
+# An amount at the end of a line, optionally followed by a tax flag (e.g. "12.99 F")
+PRICE_RE = re.compile(r'(?P<sign>-)?\$?\s?(?P<amount>\d{1,6}[.,]\d{2})(?P<trailing_sign>-)?(?:\s+[A-Z]{1,2})?\s*$')
+# "2 @ 1.99" or "2 x 1.99" unit price lines, and "2 x ITEM" / "2 ITEM" quantity prefixes
+UNIT_PRICE_RE = re.compile(r'^(?P<qty>\d{1,3})\s*(?:@|x|X)\s*\$?\d+[.,]\d{2}')
+QTY_PREFIX_RE = re.compile(r'^(?P<qty>\d{1,3})\s*(?:x|X|@)?\s+(?=[A-Za-z])')
+
+SUBTOTAL_RE = re.compile(r'\bsub\s*-?\s*total\b', re.I)
+TAX_RE = re.compile(r'\b(tax|hst|gst|pst|vat)\b', re.I)
+TOTAL_RE = re.compile(r'\b(grand\s+total|total|amount\s+due|balance\s+due)\b', re.I)
+DISCOUNT_RE = re.compile(r'\b(discount|coupon|savings|promo|off)\b', re.I)
+EXTRA_CHARGE_RE = re.compile(r'\b(service|delivery|tip|gratuity|fee|surcharge)\b', re.I)
+# Payment, change and loyalty lines carry amounts that are not items
+IGNORED_RE = re.compile(
+    r'\b(cash|change|tend(er|ered)?|visa|master\s*card|mastercard|amex|debit|credit|card|'
+    r'payment|paid|auth|approval|items?\s+sold|you\s+saved|points|rewards?)\b', re.I
+)
+PAYMENT_METHODS = [
+    ('Credit Card', re.compile(r'\b(visa|master\s*card|mastercard|amex|american\s+express|discover|credit)\b', re.I)),
+    ('Debit Card', re.compile(r'\bdebit\b', re.I)),
+    ('Cash', re.compile(r'\bcash\b', re.I)),
+]
+DATE_PATTERNS = [
+    (re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b'), '%Y-%m-%d'),
+    (re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b'), '%m/%d/%Y'),
+    (re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{2})\b'), '%m/%d/%y'),
+]
+ADDRESS_RE = re.compile(r'^\d+\s+\w+|,\s*[A-Z]{2}\s+\d{5}', re.I)
+
+CENT = Decimal('0.01')
+
+
+def _amount(match) -> Optional[Decimal]:
+    try:
+        value = Decimal(match.group('amount').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    if match.group('sign') or match.group('trailing_sign'):
+        value = -value
+    return value
+
+
+def _parse_date(text: str) -> str:
+    for pattern, fmt in DATE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            try:
+                return datetime.strptime(match.group(0), fmt).strftime('%Y-%m-%d')
+            except ValueError:
+                continue
+    return ''
+
+
+def _clean_name(name: str) -> str:
+    return re.sub(r'[\s.:$*#-]+$', '', re.sub(r'\s{2,}', ' ', name)).strip()
+
+
+def _apportion_cents(total: Decimal, weights: List[Decimal]) -> List[Decimal]:
+    """Split `total` over `weights` so the parts add up to it exactly."""
+    total_cents = int((total / CENT).to_integral_value())
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        return [Decimal('0.00')] * len(weights)
+
+    exact = [Decimal(total_cents) * weight / weight_sum for weight in weights]
+    parts = [int(value) for value in exact]
+    for i in sorted(range(len(weights)), key=lambda i: parts[i] - exact[i])[:total_cents - sum(parts)]:
+        parts[i] += 1
+    return [Decimal(part) * CENT for part in parts]
+
+
+def parse_receipt_text(ocr_text: str) -> Dict[str, Any]:
+    """
+    Parse OCR text of a receipt without an LLM.
+
+    Args:
+        ocr_text: Text extracted from the receipt by OCR
+
+    Returns:
+        Dictionary with 'bill' (the prompt's JSON shape, plus 'confidence'),
+        'confidence' (0 to 1) and 'reconciled' (whether the items add up to
+        the detected subtotal and total)
+    """
+    lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
+
+    items = []
+    subtotal = tax = total = None
+    extra_charges = Decimal('0.00')
+    priced_lines = understood_lines = 0
+    pending_quantity = None
+    # The last line without an amount; item names are sometimes printed on
+    # their own line above the quantity/amount line
+    unpriced_line = None
+    header = []
+
+    for line in lines:
+        match = PRICE_RE.search(line)
+        unit_price = UNIT_PRICE_RE.match(line)
+
+        if match is None or (unit_price and match.start() < unit_price.end()):
+            if unit_price:
+                # "2 @ 1.99" with no line total: the quantity of the next item
+                pending_quantity = int(unit_price.group('qty'))
+                continue
+            if not items and subtotal is None and total is None:
+                header.append(line)
+            unpriced_line = line
+            continue
+
+        amount = _amount(match)
+        if amount is None:
+            continue
+        priced_lines += 1
+        label = line[:match.start()].strip()
+        quantity = None
+        if unit_price:
+            # "2 @ 1.99   3.98": the item name is on the line above
+            quantity = int(unit_price.group('qty'))
+            label = ''
+        if not re.search(r'[A-Za-z]{2,}', label) and unpriced_line:
+            label = unpriced_line
+            if header and header[-1] == unpriced_line:
+                header.pop()
+        unpriced_line = None
+
+        if SUBTOTAL_RE.search(label):
+            subtotal = amount
+        elif TAX_RE.search(label) and total is None:
+            tax = (tax or Decimal('0.00')) + amount
+        elif TOTAL_RE.search(label) and not IGNORED_RE.search(label):
+            # The first total wins; later "total" lines are usually payment summaries
+            if total is None:
+                total = amount
+        elif total is not None or IGNORED_RE.search(label):
+            # Everything after the total is payment, change and loyalty information
+            pass
+        elif amount < 0 or DISCOUNT_RE.search(label):
+            if not items:
+                continue
+            items[-1]['totalPrice'] -= abs(amount)
+        elif EXTRA_CHARGE_RE.search(label) and items:
+            extra_charges += amount
+        elif re.search(r'[A-Za-z]{2,}', label):
+            qty_prefix = QTY_PREFIX_RE.match(label)
+            if qty_prefix:
+                quantity = quantity or int(qty_prefix.group('qty'))
+                label = label[qty_prefix.end():]
+            if pending_quantity:
+                quantity, pending_quantity = quantity or pending_quantity, None
+            items.append({'name': _clean_name(label), 'quantity': quantity or 1, 'totalPrice': amount})
+        else:
+            continue
+        understood_lines += 1
+
+    items_sum = sum((item['totalPrice'] for item in items), Decimal('0.00'))
+    tax_total = tax or Decimal('0.00')
+
+    # Reconcile: items add up to the subtotal, and subtotal + charges + tax to the total
+    checks = []
+    if subtotal is not None:
+        checks.append(abs(items_sum - subtotal) <= CENT)
+    if total is not None:
+        base = subtotal if subtotal is not None else items_sum
+        checks.append(abs(base + extra_charges + tax_total - total) <= CENT)
+    reconciled = bool(items) and total is not None and all(checks)
+
+    if reconciled:
+        confidence = Decimal('0.7')
+        if subtotal is not None:
+            confidence += Decimal('0.1')
+        if tax is not None or (subtotal is not None and subtotal == total):
+            confidence += Decimal('0.1')
+        confidence += Decimal('0.1') * understood_lines / max(priced_lines, 1)
+    else:
+        confidence = Decimal('0')
+    confidence = float(confidence.quantize(CENT))
+
+    subtotal_value = subtotal if subtotal is not None else items_sum
+    tax_shares = _apportion_cents(tax_total, [item['totalPrice'] for item in items])
+    charge_shares = _apportion_cents(extra_charges, [Decimal(1)] * len(items))
+    tax_rate = (tax_total / subtotal_value * 100).quantize(CENT) if subtotal_value else Decimal('0.00')
+
+    title = next((line for line in header if re.search(r'[A-Za-z]{2,}', line)), '')
+    address = ', '.join(line for line in header if line != title and ADDRESS_RE.search(line))
+    payment_method = next(
+        (name for name, pattern in PAYMENT_METHODS if pattern.search(ocr_text)), ''
+    )
+
+    bill = {
+        'storeInformation': {
+            'title': title,
+            'storeAddress': address,
+            'dateTimeOfPurchase': _parse_date(ocr_text),
+        },
+        'items': [
+            {
+                'name': item['name'],
+                'quantity': item['quantity'],
+                'totalPrice': float(item['totalPrice']),
+                'itemType': '',
+                'tax': float(tax_rate),
+                'taxAmount': float(tax_share),
+                'itemTotalAfterTax': float(item['totalPrice'] + tax_share + charge_share),
+            }
+            for item, tax_share, charge_share in zip(items, tax_shares, charge_shares)
+        ],
+        'subtotalBeforeChargesAndTaxes': float(subtotal_value),
+        'totalExtraChargesDistributed': float(extra_charges),
+        'taxOnFood': float(tax_total),
+        'grandTotal': float(total if total is not None else subtotal_value + extra_charges + tax_total),
+        'paymentDetails': {
+            'paymentMethod': payment_method,
+        },
+        'confidence': confidence,
+    }
+
+    return {
+        'bill': bill,
+        'confidence': confidence,
+        'reconciled': reconciled,
+    }
@@ -0,0 +1,155 @@
+"""
+Content-addressed cache for expensive receipt processing results.
+
+Entries live in the CachedResult table, keyed by a SHA-256 over everything
+that determines the result (e.g. the image bytes, provider and OCR settings),
+so any worker process can reuse a result another one computed. Entries
+expire TTL seconds after they were created, and once a namespace holds more
+than MAX_ENTRIES the least recently used ones are evicted.
+
+Hit and miss counters are kept in the shared Django cache, so they add up
+across worker processes.
+"""
+import json
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Any, Dict, Iterable, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Build a cache key from key parts; bytes are hashed, everything else is
+    serialized as JSON with sorted keys.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            part = sha256_hex(part)
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, namespace: str, ttl: int, max_entries: int):
+        self.namespace = namespace
+        self.default_ttl = ttl
+        self.default_max_entries = max_entries
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, f'{self.namespace.upper()}_CACHE_TTL', self.default_ttl)
+
+    @property
+    def max_entries(self) -> int:
+        return getattr(settings, f'{self.namespace.upper()}_CACHE_MAX_ENTRIES', self.default_max_entries)
+
+    def _entries(self):
+        from .models import CachedResult
+        return CachedResult.objects.filter(
+            namespace=self.namespace,
+            created_at__gte=timezone.now() - timedelta(seconds=self.ttl)
+        )
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Look up several keys at once.
+
+        Returns:
+            Dictionary of key to cached value for the keys that were found
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        found = dict(self._entries().filter(key__in=keys).values_list('key', 'value'))
+        if found:
+            self._entries().filter(key__in=found.keys()).update(
+                last_used_at=timezone.now(), hit_count=F('hit_count') + 1
+            )
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        return found
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, values: Dict[str, Any]) -> None:
+        """Store several results, then evict expired and least recently used entries."""
+        from .models import CachedResult
+        if not values:
+            return
+
+        now = timezone.now()
+        for key, value in values.items():
+            try:
+                CachedResult.objects.update_or_create(
+                    namespace=self.namespace,
+                    key=key,
+                    defaults={'value': value, 'created_at': now, 'last_used_at': now}
+                )
+            except IntegrityError:
+                # Another worker stored the same result first
+                pass
+        self.evict()
+
+    def set(self, key: str, value: Any) -> None:
+        self.set_many({key: value})
+
+    def evict(self) -> int:
+        """
+        Delete expired entries and trim the namespace to max_entries.
+
+        Returns:
+            Number of entries deleted
+        """
+        from .models import CachedResult
+        entries = CachedResult.objects.filter(namespace=self.namespace)
+        deleted, _ = entries.filter(created_at__lt=timezone.now() - timedelta(seconds=self.ttl)).delete()
+
+        overflow = entries.count() - self.max_entries
+        if overflow > 0:
+            oldest = entries.order_by('last_used_at').values_list('pk', flat=True)[:overflow]
+            trimmed, _ = CachedResult.objects.filter(pk__in=list(oldest)).delete()
+            deleted += trimmed
+        return deleted
+
+    def _counter_key(self, name: str) -> str:
+        return f'result_cache:{self.namespace}:{name}'
+
+    def _count(self, name: str, amount: int) -> None:
+        if not amount:
+            return
+        try:
+            cache.add(self._counter_key(name), 0, timeout=None)
+            cache.incr(self._counter_key(name), amount)
+        except Exception as e:
+            # Counters are best effort; never fail a lookup over them
+            logger.warning(f"Could not update {self.namespace} cache {name}: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counts across all processes, and the live entry count."""
+        return {
+            'hits': cache.get(self._counter_key('hits'), 0),
+            'misses': cache.get(self._counter_key('misses'), 0),
+            'entries': self._entries().count(),
+        }
+
+
+# OCR results per image: 30 days, 5000 images
+ocr_cache = ResultCache('ocr', ttl=30 * 24 * 3600, max_entries=5000)
+
+# LLM responses per (model, generation config, prompt, input): 7 days, 2000 responses
+llm_cache = ResultCache('llm', ttl=7 * 24 * 3600, max_entries=2000)
@@ -0,0 +1,239 @@
+"""
+Routes LLM requests across providers (Gemini, OpenAI).
+
+A request goes to the first available provider in the configured order.
+If it has not answered within the hedge threshold, the same request is
+also sent to the next provider and whichever answers first wins; the
+slower request is abandoned and its answer discarded. A failing provider
+is replaced by the next one straight away.
+
+Every successful call's latency is recorded per provider. Once a provider
+has enough samples, its observed p95 latency becomes its hedge threshold,
+and providers are ordered by their median latency, so a provider that
+becomes slow is moved back automatically. Failed calls are only counted:
+a provider that fails fast (bad key, quota) must not look fast. After
+FAILURES_TO_DEMOTE failures in a row a provider goes to the back of the
+order until it answers again. Latency stats are kept per process.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from .rate_limit import ProviderBusy
+from .utils import (
+    process_ocr_text_with_llm,
+    process_ocr_text_with_openai,
+    process_receipt_with_gemini,
+    process_receipt_with_openai
+)
+
+logger = logging.getLogger(__name__)
+
+# Samples needed before a provider's own latency drives ordering and hedging
+MIN_SAMPLES = 20
+# Consecutive failures that move a provider to the back of the order
+FAILURES_TO_DEMOTE = 3
+
+
+class LatencyStats:
+    """Rolling window of one provider's successful latencies, in seconds, and its failure counts."""
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.failures = 0
+        self.consecutive_failures = 0
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            if ok:
+                self._samples.append(seconds)
+                self.consecutive_failures = 0
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+
+    def failing(self) -> bool:
+        return self.consecutive_failures >= FAILURES_TO_DEMOTE
+
+    def percentile(self, percent: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, round(percent / 100 * len(samples)) - 1))
+        return samples[index]
+
+    def count(self) -> int:
+        return len(self._samples)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count(),
+            'failures': self.failures,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class LLMRouter:
+    """
+    Args:
+        name: Router name, used in logs
+        providers: Provider name to (callable, name of the API key environment variable)
+    """
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, name: str, providers: Dict[str, tuple]):
+        self.name = name
+        self.providers = providers
+        self.stats = {provider: LatencyStats() for provider in providers}
+
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        # Shared by all routers; abandoned hedged requests keep a thread busy until they return
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'LLM_ROUTER_MAX_THREADS', 16),
+                    thread_name_prefix='llm-router'
+                )
+            return cls._executor
+
+    def order(self) -> List[str]:
+        """
+        Available providers, fastest median first once the healthy ones have
+        enough samples; failing providers go last.
+        """
+        configured = [
+            provider for provider in getattr(settings, 'LLM_PROVIDER_ORDER', list(self.providers))
+            if provider in self.providers and os.environ.get(self.providers[provider][1])
+        ]
+
+        def median(provider):
+            stats = self.stats[provider]
+            return stats.percentile(50) if stats.count() >= MIN_SAMPLES else None
+
+        failing = {provider for provider in configured if self.stats[provider].failing()}
+        by_latency = all(median(provider) is not None for provider in configured if provider not in failing)
+
+        def key(provider):
+            latency = median(provider) if by_latency and provider not in failing else 0
+            return provider in failing, latency, configured.index(provider)
+
+        return sorted(configured, key=key)
+
+    def hedge_after(self, provider: str) -> float:
+        """Seconds to wait for `provider` before also asking the next one."""
+        configured = getattr(settings, 'LLM_HEDGE_AFTER_SECONDS', 8.0)
+        stats = self.stats[provider]
+        if stats.count() >= MIN_SAMPLES:
+            return max(1.0, min(configured, stats.percentile(95)))
+        return configured
+
+    def _timed(self, provider: str, call: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            self.stats[provider].record(time.perf_counter() - start, ok=False)
+            raise
+        finally:
+            # Providers use the database for their response cache; don't leak the thread's connection
+            close_old_connections()
+        self.stats[provider].record(time.perf_counter() - start)
+        return result
+
+    def call(self, *args, **kwargs) -> Any:
+        """
+        Send the request to the providers and return the first successful answer.
+
+        Raises:
+            ValueError: If no provider has an API key configured
+            ProviderBusy: If every provider was at its rate limit
+            RuntimeError: If every provider failed
+        """
+        order = self.order()
+        if not order:
+            raise ValueError(f"No {self.name} provider is configured; set one of their API keys.")
+
+        pending = {}
+        errors = []
+        busy = []
+        remaining = list(order)
+
+        def launch():
+            provider = remaining.pop(0)
+            fn = self.providers[provider][0]
+            # Run in a copy of the request's context, so its stage timer sees the call
+            context = contextvars.copy_context()
+            future = self.executor().submit(context.run, self._timed, provider, lambda: fn(*args, **kwargs))
+            pending[future] = provider
+            return provider
+
+        primary = launch()
+        timeout = self.hedge_after(primary)
+
+        while pending:
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The current requests are slow: hedge with the next provider
+                if remaining:
+                    logger.info(f"{self.name}: {primary} is slow, hedging with {remaining[0]}")
+                    launch()
+                timeout = None
+                continue
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if isinstance(e, ProviderBusy):
+                        busy.append(e)
+                    else:
+                        logger.warning(f"{self.name}: {provider} failed: {str(e)}")
+                    errors.append(f"{provider}: {str(e)}")
+                    if remaining and not pending:
+                        launch()
+                    continue
+
+                for slower in pending:
+                    # Not started yet: drop it. Already running: its answer is ignored
+                    slower.cancel()
+                return result
+
+        if len(busy) == len(errors):
+            raise min(busy, key=lambda e: e.retry_after)
+        raise RuntimeError(f"All {self.name} providers failed: {'; '.join(errors)}")
+
+    def latency_summary(self) -> Dict[str, Dict[str, Any]]:
+        return {provider: stats.summary() for provider, stats in self.stats.items()}
+
+
+ocr_text_router = LLMRouter('OCR text', {
+    'gemini': (process_ocr_text_with_llm, 'GEMINI_API_KEY'),
+    'openai': (process_ocr_text_with_openai, 'OPENAI_API_KEY'),
+})
+
+receipt_image_router = LLMRouter('receipt image', {
+    'gemini': (process_receipt_with_gemini, 'GEMINI_API_KEY'),
+    'openai': (lambda image_bytes, use_cache=True: process_receipt_with_openai(image_bytes), 'OPENAI_API_KEY'),
+})
+
+
+def route_ocr_text_to_llm(ocr_text: str, custom_prompt: Optional[str] = None, use_cache: bool = True) -> str:
+    """Turn OCR text into a bill with the fastest available LLM provider."""
+    return ocr_text_router.call(ocr_text, custom_prompt, use_cache)
+
+
+def route_receipt_image_to_llm(image_bytes: bytes, use_cache: bool = True) -> str:
+    """Turn a receipt image into a bill with the fastest available LLM provider."""
+    return receipt_image_router.call(image_bytes, use_cache=use_cache)
@@ -0,0 +1,414 @@
+"""
+Receipt processing pipeline shared by the synchronous views and the
+receipt worker (`python manage.py process_receipt_jobs`).
+"""
+import os
+import json
+import socket
+import logging
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .rate_limit import ProviderBusy
+from .receipt_parser import parse_receipt_text
+from .result_cache import make_key, sha256_hex
+from .router import route_ocr_text_to_llm, route_receipt_image_to_llm
+from .stitching import stitch_ocr_texts
+from .streaming import sse_event, stream_items
+from .timing import current_durations, stage
+from .models import ReceiptJob, ReceiptJobImage, ReceiptJobMode, ReceiptJobStatus, ReceiptScan
+from .utils import (
+    process_images_bytes,
+    stream_ocr_text_with_llm,
+    OCRProvider
+)
+
+logger = logging.getLogger(__name__)
+
+
+def extract_ocr_text(image_bytes_list: List[bytes], provider: OCRProvider = OCRProvider.GOOGLE_CLOUD,
+                     use_cache: bool = True) -> str:
+    """
+    Run OCR over the images in order and combine their text. Lines repeated
+    where consecutive photos of a long receipt overlap are kept once.
+
+    Raises:
+        RuntimeError: If OCR fails for any image
+    """
+    ocr_results = process_images_bytes(image_bytes_list, provider, use_cache=use_cache)
+
+    texts = []
+    for result in ocr_results['results']:
+        if 'text' in result:
+            texts.append(result['text'])
+        elif 'error' in result:
+            raise RuntimeError(f"OCR Error: {result['error']}")
+
+    with stage('stitch'):
+        return stitch_ocr_texts(texts)
+
+
+def extract_bill_from_images(image_bytes_list: List[bytes], provider: OCRProvider = OCRProvider.GOOGLE_CLOUD,
+                             custom_prompt: Optional[str] = None, use_cache: bool = True) -> str:
+    """
+    Run OCR over the images in order and have the LLM turn the combined text into a bill.
+
+    Args:
+        image_bytes_list: Raw image bytes, one entry per image
+        provider: OCRProvider enum specifying which OCR service to use
+        custom_prompt: Optional custom prompt for LLM processing
+        use_cache: Whether to reuse cached OCR results and LLM responses
+
+    Returns:
+        The LLM's bill response
+
+    Raises:
+        RuntimeError: If OCR fails for any image or the LLM call fails
+    """
+    combined_ocr_text = extract_ocr_text(image_bytes_list, provider, use_cache)
+    return extract_bill_from_text(combined_ocr_text, custom_prompt, use_cache)
+
+
+def parse_bill_without_llm(ocr_text: str, custom_prompt: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Parse OCR text with the rule-based parser if its result can be trusted.
+
+    The parser's result is used only when its items reconcile with the
+    receipt's subtotal and total and its confidence reaches
+    settings.RECEIPT_PARSER_MIN_CONFIDENCE. A custom prompt always goes to
+    the LLM, since it may ask for a different output.
+
+    Returns:
+        The bill dictionary in the prompt's shape, or None if the LLM is needed
+    """
+    if custom_prompt is not None or not getattr(settings, 'RECEIPT_PARSER_ENABLED', True):
+        return None
+
+    parsed = parse_receipt_text(ocr_text)
+    if parsed['reconciled'] and parsed['confidence'] >= getattr(settings, 'RECEIPT_PARSER_MIN_CONFIDENCE', 0.8):
+        logger.info(f"Receipt parsed without the LLM (confidence {parsed['confidence']})")
+        return parsed['bill']
+    return None
+
+
+def extract_bill_from_text(ocr_text: str, custom_prompt: Optional[str] = None, use_cache: bool = True) -> str:
+    """
+    Turn OCR text into a bill, with the rule-based parser when it can
+    (see parse_bill_without_llm) and the LLM otherwise.
+
+    Args:
+        ocr_text: Text extracted from the receipt by OCR
+        custom_prompt: Optional custom prompt for LLM processing
+        use_cache: Whether to reuse a cached LLM response
+
+    Returns:
+        The bill as a JSON string in the prompt's shape
+
+    Raises:
+        ProviderBusy: If every LLM provider is at its rate limit
+        RuntimeError: If the LLM call fails
+    """
+    with stage('parse'):
+        bill = parse_bill_without_llm(ocr_text, custom_prompt)
+    if bill is not None:
+        return json.dumps(bill)
+
+    try:
+        return route_ocr_text_to_llm(ocr_text, custom_prompt, use_cache)
+    except ProviderBusy:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"LLM Processing Error: {str(e)}")
+
+
+def stream_bill_from_images(image_bytes_list: List[bytes], provider: OCRProvider = OCRProvider.GOOGLE_CLOUD,
+                            custom_prompt: Optional[str] = None, use_cache: bool = True) -> Iterator[str]:
+    """
+    Like extract_bill_from_images, but as server-sent events: 'item' for
+    every bill item as soon as it is parsed, then 'bill' with the complete
+    response, or 'error' if processing fails.
+    """
+    try:
+        combined_ocr_text = extract_ocr_text(image_bytes_list, provider, use_cache)
+
+        bill = parse_bill_without_llm(combined_ocr_text, custom_prompt)
+        if bill is not None:
+            for item in bill['items']:
+                yield sse_event('item', item)
+            yield sse_event('bill', {'bill': json.dumps(bill)})
+            return
+
+        chunks = stream_ocr_text_with_llm(combined_ocr_text, custom_prompt, use_cache)
+        for event in stream_items(chunks):
+            if 'item' in event:
+                yield sse_event('item', event['item'])
+            else:
+                yield sse_event('bill', {'bill': event['bill']})
+    except ProviderBusy as e:
+        yield sse_event('error', {'error': str(e), 'retry_after': e.retry_after})
+    except Exception as e:
+        logger.error(f"Streaming bill processing failed: {str(e)}")
+        yield sse_event('error', {'error': str(e)})
+
+
+class ReceiptScanService:
+    @staticmethod
+    def _lookup_fields(image_bytes_list, provider, custom_prompt):
+        return {
+            'image_hash': make_key(*image_bytes_list),
+            'provider': provider,
+            'prompt_hash': sha256_hex(custom_prompt.encode('utf-8')) if custom_prompt else '',
+        }
+
+    @staticmethod
+    def find(image_bytes_list, provider, custom_prompt=None):
+        """
+        Find the latest scan of the same images with the same provider and
+        prompt, unless it is older than RECEIPT_SCAN_TTL.
+
+        Returns:
+            The ReceiptScan, or None
+        """
+        ttl = getattr(settings, 'RECEIPT_SCAN_TTL', 30 * 24 * 3600)
+        return ReceiptScan.objects.filter(
+            created_at__gte=timezone.now() - timedelta(seconds=ttl),
+            **ReceiptScanService._lookup_fields(image_bytes_list, provider, custom_prompt)
+        ).first()
+
+    @staticmethod
+    def record(image_bytes_list, provider, ocr_text, result, custom_prompt=None):
+        """
+        Save a processed upload with the current request's stage durations,
+        then trim old scans (see evict).
+
+        Args:
+            image_bytes_list: Raw image bytes as uploaded, in order
+            provider: OCR provider name, or ReceiptScan.IMAGE_PROVIDER
+            ocr_text: Combined OCR text ('' when the image went straight to the LLM)
+            result: The bill response returned to the client
+            custom_prompt: Custom prompt the bill was extracted with, if any
+
+        Returns:
+            The new ReceiptScan
+        """
+        scan = ReceiptScan.objects.create(
+            ocr_text=ocr_text,
+            result=result,
+            timings=current_durations(),
+            **ReceiptScanService._lookup_fields(image_bytes_list, provider, custom_prompt)
+        )
+        ReceiptScanService.evict()
+        return scan
+
+    @staticmethod
+    def evict():
+        """
+        Delete scans older than RECEIPT_SCAN_TTL and trim the table to
+        RECEIPT_SCAN_MAX_ENTRIES, oldest first. Scans linked to a bill are
+        kept.
+
+        Returns:
+            Number of scans deleted
+        """
+        ttl = getattr(settings, 'RECEIPT_SCAN_TTL', 30 * 24 * 3600)
+        max_entries = getattr(settings, 'RECEIPT_SCAN_MAX_ENTRIES', 5000)
+        scans = ReceiptScan.objects.filter(bill__isnull=True)
+        deleted, _ = scans.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+
+        overflow = scans.count() - max_entries
+        if overflow > 0:
+            oldest = scans.order_by('created_at', 'pk').values_list('pk', flat=True)[:overflow]
+            trimmed, _ = ReceiptScan.objects.filter(pk__in=list(oldest)).delete()
+            deleted += trimmed
+        return deleted
+
+    @staticmethod
+    def scan_images(image_bytes_list, provider=OCRProvider.GOOGLE_CLOUD, custom_prompt=None, use_cache=True):
+        """
+        Like extract_bill_from_images, but the OCR text and bill are saved as a ReceiptScan.
+        With use_cache, a scan of the same images, provider and prompt is
+        returned as is, without calling the providers.
+
+        Raises:
+            ProviderBusy: If every LLM provider is at its rate limit
+            RuntimeError: If OCR fails for any image or the LLM call fails
+        """
+        provider_name = OCRProvider(provider).value
+        if use_cache:
+            scan = ReceiptScanService.find(image_bytes_list, provider_name, custom_prompt)
+            if scan is not None:
+                return scan
+
+        ocr_text = extract_ocr_text(image_bytes_list, provider, use_cache)
+        result = extract_bill_from_text(ocr_text, custom_prompt, use_cache)
+        return ReceiptScanService.record(image_bytes_list, provider_name, ocr_text, result, custom_prompt)
+
+    @staticmethod
+    def scan_image_with_llm(image_bytes, use_cache=True):
+        """
+        Send an image straight to the fastest LLM provider and save the bill as a ReceiptScan.
+        With use_cache, an earlier scan of the same image is returned instead.
+        """
+        if use_cache:
+            scan = ReceiptScanService.find([image_bytes], ReceiptScan.IMAGE_PROVIDER)
+            if scan is not None:
+                return scan
+
+        result = route_receipt_image_to_llm(image_bytes, use_cache=use_cache)
+        return ReceiptScanService.record([image_bytes], ReceiptScan.IMAGE_PROVIDER, '', result)
+
+    @staticmethod
+    def link_bill(scan_id, bill):
+        """
+        Link a scan to the bill saved from it. A scan already linked to
+        another bill keeps its link.
+
+        Returns:
+            True if the scan was linked
+        """
+        return bool(ReceiptScan.objects.filter(id=scan_id, bill__isnull=True).update(bill=bill))
+
+
+class ReceiptJobService:
+    @staticmethod
+    def enqueue(files, mode=ReceiptJobMode.OCR_LLM, provider=OCRProvider.GOOGLE_CLOUD, custom_prompt=None):
+        """
+        Store the uploaded images and queue a job for the receipt workers.
+
+        Args:
+            files: Uploaded image files, in page order
+            mode: ReceiptJobMode to process the images with
+            provider: OCRProvider used in OCR_LLM mode
+            custom_prompt: Optional custom prompt for LLM processing
+
+        Returns:
+            The new pending ReceiptJob
+        """
+        with transaction.atomic():
+            job = ReceiptJob.objects.create(
+                mode=mode,
+                provider=OCRProvider(provider).value,
+                custom_prompt=custom_prompt
+            )
+            for position, file in enumerate(files):
+                ReceiptJobImage.objects.create(
+                    job=job,
+                    position=position,
+                    image=ContentFile(file.read(), name=file.name or f"receipt_{position}"),
+                    content_type=file.content_type or ''
+                )
+        return job
+
+    @staticmethod
+    def worker_name():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def claim_next(worker):
+        """
+        Claim the oldest pending job for `worker`, skipping jobs whose
+        not_before time has not come yet.
+
+        The claim is a conditional UPDATE on the job's status, so when several
+        workers race for the same job exactly one of them gets it.
+
+        Returns:
+            The claimed ReceiptJob, or None if no job can be claimed now
+        """
+        ready = Q(not_before__isnull=True) | Q(not_before__lte=timezone.now())
+        candidates = ReceiptJob.objects.filter(
+            ready, status=ReceiptJobStatus.PENDING
+        ).order_by('created_at', 'id').values_list('id', flat=True)[:10]
+
+        for job_id in candidates:
+            claimed = ReceiptJob.objects.filter(ready, id=job_id, status=ReceiptJobStatus.PENDING).update(
+                status=ReceiptJobStatus.RUNNING,
+                worker=worker,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1
+            )
+            if claimed:
+                return ReceiptJob.objects.get(id=job_id)
+        return None
+
+    @staticmethod
+    def requeue_stale():
+        """
+        Put jobs whose worker died mid-run back in the queue, or fail them
+        once they have used up RECEIPT_JOB_MAX_ATTEMPTS.
+
+        Returns:
+            Number of jobs requeued or failed
+        """
+        timeout = getattr(settings, 'RECEIPT_JOB_TIMEOUT', 600)
+        max_attempts = getattr(settings, 'RECEIPT_JOB_MAX_ATTEMPTS', 3)
+        stale = ReceiptJob.objects.filter(
+            status=ReceiptJobStatus.RUNNING,
+            started_at__lt=timezone.now() - timedelta(seconds=timeout)
+        )
+
+        requeued = stale.filter(attempts__lt=max_attempts).update(
+            status=ReceiptJobStatus.PENDING, worker='', started_at=None
+        )
+        failed = stale.filter(attempts__gte=max_attempts).update(
+            status=ReceiptJobStatus.FAILED,
+            error="Receipt processing timed out",
+            finished_at=timezone.now()
+        )
+        return requeued + failed
+
+    @staticmethod
+    def run(job):
+        """
+        Process a claimed job and record its outcome.
+
+        Returns:
+            The job's new ReceiptJobStatus: PENDING if it was put back in the
+            queue because the providers were at their rate limits. None if
+            the job was requeued by requeue_stale while it ran, so its outcome
+            was not recorded.
+        """
+        images = list(job.images.all())
+        try:
+            image_bytes_list = []
+            for job_image in images:
+                with job_image.image.open('rb') as f:
+                    image_bytes_list.append(f.read())
+
+            if job.mode == ReceiptJobMode.GEMINI_IMAGE:
+                result = route_receipt_image_to_llm(image_bytes_list[0])
+            else:
+                result = extract_bill_from_images(
+                    image_bytes_list, OCRProvider(job.provider), job.custom_prompt
+                )
+            outcome = {'status': ReceiptJobStatus.SUCCEEDED, 'result': result, 'error': None}
+        except ProviderBusy as e:
+            # Providers are saturated: put the job back, not to be claimed until
+            # they are expected to have room. The job did not fail, so the
+            # attempt claim_next counted is given back
+            logger.warning(f"Receipt job {job.id} requeued: {str(e)}")
+            outcome = {
+                'status': ReceiptJobStatus.PENDING, 'worker': '', 'started_at': None, 'finished_at': None,
+                'error': str(e), 'attempts': F('attempts') - 1,
+                'not_before': timezone.now() + timedelta(seconds=e.retry_after)
+            }
+        except Exception as e:
+            logger.error(f"Receipt job {job.id} failed: {str(e)}")
+            outcome = {'status': ReceiptJobStatus.FAILED, 'error': str(e)}
+
+        # Only the worker that still owns the job may finish it; a requeued
+        # job may already be running elsewhere
+        finished = ReceiptJob.objects.filter(
+            id=job.id, status=ReceiptJobStatus.RUNNING, worker=job.worker
+        ).update(**{'finished_at': timezone.now(), **outcome})
+
+        if not finished:
+            return None
+        if outcome['status'] != ReceiptJobStatus.PENDING:
+            for job_image in images:
+                job_image.image.delete(save=False)
+        return outcome['status']
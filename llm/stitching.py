@@ -0,0 +1,110 @@
+"""
+Stitching of OCR text from several photos of one long receipt.
+
+People photograph a long receipt in overlapping sections, so the last lines
+of one photo usually reappear as the first lines of the next. If the texts
+were just concatenated, the LLM would read those lines twice, which costs
+tokens and double-counts items.
+
+For each pair of consecutive photos, stitch_ocr_texts finds the longest run
+of identical lines between the end of the first text and the start of the
+second, and keeps that run only once. Lines are compared by a hash of their
+normalized form, ignoring case, spacing and punctuation OCR tends to get
+wrong. The lines cut off at a photo's edge (after the run in the first
+photo, before it in the second) are usually garbled. They are taken from
+the photo that shows them whole: the second photo's copy is kept for lines
+after the run, and lines before the run in the second photo are dropped.
+"""
+import re
+import hashlib
+import logging
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Only this many lines at the end/start of consecutive texts are searched for an overlap
+MAX_OVERLAP_LINES = 60
+# An overlap needs at least this many matching lines ...
+MIN_OVERLAP_LINES = 2
+# ... and this much matching text, so short generic lines don't stitch on their own
+MIN_OVERLAP_CHARS = 12
+# Lines allowed between the overlap and the edge of a photo (partly cut off lines)
+EDGE_SLACK_LINES = 3
+
+
+def _line_hash(line: str) -> Tuple[str, int]:
+    normalized = re.sub(r'[^a-z0-9]', '', line.lower())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest(), len(normalized)
+
+
+def find_overlap(first: List[str], second: List[str]) -> Optional[Tuple[int, int, int]]:
+    """
+    Find the overlapping line run between the end of `first` and the start of `second`.
+
+    Args:
+        first: Non-empty lines of the earlier photo
+        second: Non-empty lines of the later photo
+
+    Returns:
+        (start in first, start in second, length) of the overlap, or None
+    """
+    tail_start = max(0, len(first) - MAX_OVERLAP_LINES)
+    tail = [_line_hash(line) for line in first[tail_start:]]
+    head = [_line_hash(line) for line in second[:MAX_OVERLAP_LINES]]
+
+    best = None
+    # runs[j] is the length of the matching run ending at tail[i], head[j]
+    runs = [0] * (len(head) + 1)
+    for i, (tail_hash, tail_chars) in enumerate(tail):
+        previous = 0
+        for j, (head_hash, _) in enumerate(head):
+            current = runs[j + 1]
+            runs[j + 1] = previous + 1 if tail_hash == head_hash and tail_chars else 0
+            previous = current
+
+            length = runs[j + 1]
+            if length < MIN_OVERLAP_LINES:
+                continue
+            # The overlap must reach (nearly) the end of the first photo and the start of the second
+            if len(tail) - 1 - i > EDGE_SLACK_LINES or j + 1 - length > EDGE_SLACK_LINES:
+                continue
+            if best is None or length > best[2]:
+                best = (tail_start + i + 1 - length, j + 1 - length, length)
+
+    if best is None:
+        return None
+    start, _, length = best
+    if sum(_line_hash(line)[1] for line in first[start:start + length]) < MIN_OVERLAP_CHARS:
+        return None
+    return best
+
+
+def stitch_ocr_texts(texts: List[str]) -> str:
+    """
+    Combine the OCR texts of consecutive photos, keeping overlapping lines once.
+    Texts without a detectable overlap are separated by a blank line.
+    """
+    stitched = []
+    removed = 0
+    for text in texts:
+        lines = [line for line in text.splitlines() if line.strip()]
+        if not lines:
+            continue
+        if not stitched:
+            stitched.append(lines)
+            continue
+
+        previous = stitched[-1]
+        overlap = find_overlap(previous, lines)
+        if overlap is None:
+            stitched.append(lines)
+            continue
+
+        start, second_start, length = overlap
+        kept = previous[:start + length] + lines[second_start + length:]
+        removed += len(previous) + len(lines) - len(kept)
+        stitched[-1] = kept
+
+    if removed:
+        logger.info(f"Stitched {len(texts)} OCR texts, removing {removed} overlapping lines")
+    return "\n\n".join("\n".join(lines) for lines in stitched)
@@ -0,0 +1,124 @@
+"""
+Helpers for streaming a bill to the client over server-sent events (SSE).
+
+ItemStreamParser picks the complete objects out of the bill's "items" array
+while the LLM's JSON is still being generated, so each item can be sent as
+soon as its closing brace arrives.
+"""
+import re
+import json
+from typing import Any, Dict, Iterator, List
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _loads_lenient(text: str) -> Any:
+    """json.loads that tolerates the // comments and trailing commas LLMs sometimes emit."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        cleaned = re.sub(r'(?<!:)//[^\n]*', '', text)
+        cleaned = re.sub(r',\s*([}\]])', r'\1', cleaned)
+        return json.loads(cleaned)
+
+
+def parse_llm_json(text: str) -> Any:
+    """
+    Parse an LLM's JSON answer, ignoring markdown fences and any text around
+    the outermost object.
+
+    Raises:
+        ValueError: If no valid JSON object is found
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError("No JSON object in the response")
+    return _loads_lenient(text[start:end + 1])
+
+
+def is_bill(data: Any) -> bool:
+    """True if parsed JSON has the bill shape the prompt asks for: an "items" list of objects."""
+    return (
+        isinstance(data, dict)
+        and isinstance(data.get('items'), list)
+        and all(isinstance(item, dict) for item in data['items'])
+    )
+
+
+class ItemStreamParser:
+    """
+    Incrementally scan streamed JSON text for the elements of its "items" array.
+
+    feed() takes the next chunk of text and returns the items completed by
+    it. Text outside the array (markdown fences, other fields) is ignored.
+    """
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.in_items = False
+        self.in_string = False
+        self.escaped = False
+        self.depth = 0
+        self.item_start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.buffer += chunk
+        items = []
+
+        if not self.in_items and not self.done:
+            match = re.search(r'"items"\s*:\s*\[', self.buffer[self.position:])
+            if match is None:
+                # Keep enough of the tail to match a key split across chunks
+                self.position = max(self.position, len(self.buffer) - 16)
+                return items
+            self.in_items = True
+            self.position += match.end()
+
+        while self.in_items and self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            self.position += 1
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.item_start = self.position - 1
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0 and self.item_start is not None:
+                    try:
+                        items.append(_loads_lenient(self.buffer[self.item_start:self.position]))
+                    except ValueError:
+                        pass
+                    self.item_start = None
+            elif char == ']' and self.depth == 0:
+                self.in_items = False
+                self.done = True
+
+        return items
+
+
+def stream_items(chunks: Iterator[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Turn streamed LLM text into events: {'item': ...} for every parsed item
+    as it completes, then {'bill': full_text} at the end.
+    """
+    parser = ItemStreamParser()
+    text = []
+    for chunk in chunks:
+        text.append(chunk)
+        for item in parser.feed(chunk):
+            yield {'item': item}
+    yield {'bill': ''.join(text)}
@@ -0,0 +1,130 @@
+"""
+Long-lived Tesseract worker processes for the self-hosted OCR path.
+
+pytesseract.image_to_string writes every image to a temp file and starts a
+new tesseract process for it, which loads the language data from disk on
+each call. Instead, a pool of worker processes is started once per web
+worker and reused by every request. Images reach the workers as bytes over
+the pool's pipes.
+
+With tesserocr (in requirements.txt; it builds against the system's
+libtesseract), each worker keeps a Tesseract engine loaded in memory: its
+language data is read once, and OCR needs no temp files or subprocesses.
+If tesserocr cannot be imported or its engine fails to load, the workers
+fall back to pytesseract, which still starts a tesseract process and
+writes a temp file per image; only the pool start-up is saved then. The
+fallback is logged as a warning when the pool starts.
+
+The pool has settings.OCR_MAX_WORKERS processes (settings.TESSERACT_LANG
+selects the language). It lives in the provider registry, so a forked web
+worker starts its own pool. The web worker runs threads, so the pool's
+processes are started with 'forkserver' (or 'spawn' where that is not
+available) rather than forked from it.
+"""
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+TESSERACT_CMD = '/usr/bin/tesseract'
+
+# The worker process's Tesseract engine, when tesserocr is available
+_engine = None
+
+
+def _start_worker(lang: str) -> None:
+    """Pool initializer: load the Tesseract engine once per worker process."""
+    global _engine
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    if tesserocr is None:
+        return
+    try:
+        _engine = tesserocr.PyTessBaseAPI(lang=lang)
+    except Exception as e:
+        logger.warning(f"Could not load the Tesseract engine, using the tesseract command: {str(e)}")
+
+
+def ocr_image(idx: int, image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Run Tesseract on one image, in a worker process.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if _engine is not None:
+            _engine.SetImage(img)
+            text = _engine.GetUTF8Text()
+        else:
+            text = pytesseract.image_to_string(img)
+        return {
+            'image_index': idx,
+            'text': text.strip()
+        }
+    except Exception as e:
+        return {
+            'image_index': idx,
+            'error': str(e)
+        }
+
+
+def _create_pool() -> ProcessPoolExecutor:
+    from django.conf import settings
+    if tesserocr is None:
+        logger.warning("tesserocr is not installed: Tesseract workers will start a tesseract process per image")
+    # Forking a multithreaded process can copy locks held by other threads
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        max_workers=getattr(settings, 'OCR_MAX_WORKERS', 4),
+        mp_context=multiprocessing.get_context(start_method),
+        initializer=_start_worker,
+        initargs=(getattr(settings, 'TESSERACT_LANG', 'eng'),)
+    )
+
+
+def get_tesseract_pool() -> ProcessPoolExecutor:
+    """Return this process's Tesseract worker pool, starting it on first use."""
+    from .utils import providers
+    return providers.get('tesseract_pool', _create_pool)
+
+
+def shutdown_tesseract_pool() -> None:
+    """Stop the worker processes; the next OCR request starts a new pool."""
+    from .utils import providers
+    pool = providers.get('tesseract_pool', lambda: None)
+    providers.discard('tesseract_pool')
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def ocr_images(image_bytes_list: List[bytes], max_workers: int) -> List[Dict[str, Any]]:
+    """
+    OCR images in the worker pool, at most `max_workers` at a time.
+
+    Returns:
+        One result per image, in image_index order
+    """
+    indexes = list(range(len(image_bytes_list)))
+    for attempt in range(2):
+        pool = get_tesseract_pool()
+        try:
+            results = []
+            for start in range(0, len(indexes), max_workers):
+                window = slice(start, start + max_workers)
+                results.extend(pool.map(ocr_image, indexes[window], image_bytes_list[window]))
+            return results
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool and retry once
+            logger.warning("Tesseract worker pool broke, restarting it")
+            shutdown_tesseract_pool()
+            if attempt:
+                raise
@@ -1,3 +1,810 @@
-from django.test import TestCase
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import MagicMock, patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from .compaction import compact_ocr_text
+from .models import ReceiptJob, ReceiptJobStatus, ReceiptScan
+from .receipt_parser import parse_receipt_text
+from .rate_limit import ProviderBusy, ProviderLimiter, provider_slot
+from .router import LLMRouter
+from .services import ReceiptJobService, ReceiptScanService, extract_bill_from_text
+from .stitching import stitch_ocr_texts
+from .streaming import ItemStreamParser
+from .tesseract_pool import get_tesseract_pool, shutdown_tesseract_pool
+from .preprocessing import preprocess_image
+from .result_cache import ResultCache
+from .utils import (
+    OCRProvider,
+    providers,
+    process_images_bytes,
+    process_images_with_google_vision_bytes,
+    process_images_with_tesseract_bytes,
+    process_ocr_text_with_llm,
+    read_prompt_file
+)
 
-# Create your tests here.
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ReceiptJobTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def upload(self, **data):
+        image = SimpleUploadedFile('receipt.jpg', b'fake image bytes', content_type='image/jpeg')
+        return self.client.post('/api/receipt-jobs/', {'files[]': [image], **data}, format='multipart')
+
+    def test_upload_returns_job_id_without_processing(self):
+        with patch('llm.services.process_images_bytes') as mock_ocr:
+            response = self.upload(provider='tesseract')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], ReceiptJobStatus.PENDING)
+        mock_ocr.assert_not_called()
+        job = ReceiptJob.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.provider, 'tesseract')
+        self.assertEqual(job.images.count(), 1)
+
+    def test_worker_processes_job_and_detail_reports_bill(self):
+        job_id = self.upload().data['job_id']
+
+        with patch('llm.services.process_images_bytes') as mock_ocr, \
+                patch('llm.services.route_ocr_text_to_llm') as mock_llm:
+            mock_ocr.return_value = {'results': [{'image_index': 0, 'text': 'TOTAL 4.20'}]}
+            mock_llm.return_value = '{"bill": {}}'
+            call_command('process_receipt_jobs', '--once', stdout=StringIO())
+
+        mock_ocr.assert_called_once()
+        self.assertEqual(mock_ocr.call_args[0][0], [b'fake image bytes'])
+        response = self.client.get(f'/api/receipt-jobs/{job_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], ReceiptJobStatus.SUCCEEDED)
+        self.assertEqual(response.data['bill'], '{"bill": {}}')
+
+    def test_failed_job_reports_error(self):
+        job_id = self.upload().data['job_id']
+
+        with patch('llm.services.process_images_bytes') as mock_ocr:
+            mock_ocr.return_value = {'results': [{'image_index': 0, 'error': 'unreadable'}]}
+            call_command('process_receipt_jobs', '--once', stdout=StringIO())
+
+        response = self.client.get(f'/api/receipt-jobs/{job_id}/')
+        self.assertEqual(response.data['status'], ReceiptJobStatus.FAILED)
+        self.assertEqual(response.data['error'], 'OCR Error: unreadable')
+
+    def test_job_is_claimed_once(self):
+        job_id = self.upload().data['job_id']
+
+        self.assertEqual(ReceiptJobService.claim_next('worker-a').id, job_id)
+        self.assertIsNone(ReceiptJobService.claim_next('worker-b'))
+
+    def test_stale_job_is_requeued(self):
+        job_id = self.upload().data['job_id']
+        ReceiptJobService.claim_next('worker-a')
+        ReceiptJob.objects.filter(id=job_id).update(started_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(ReceiptJobService.requeue_stale(), 1)
+        self.assertEqual(ReceiptJob.objects.get(id=job_id).status, ReceiptJobStatus.PENDING)
+
+    def test_busy_job_waits_retry_after_without_using_up_attempts(self):
+        job_id = self.upload().data['job_id']
+
+        with patch('llm.services.extract_bill_from_images', side_effect=ProviderBusy('gemini', 30)):
+            for _ in range(3):
+                job = ReceiptJobService.claim_next('worker-a')
+                self.assertEqual(ReceiptJobService.run(job), ReceiptJobStatus.PENDING)
+                # Not claimable until the providers are expected to have room
+                self.assertIsNone(ReceiptJobService.claim_next('worker-a'))
+                ReceiptJob.objects.filter(id=job_id).update(not_before=timezone.now())
+
+        job = ReceiptJob.objects.get(id=job_id)
+        self.assertEqual(job.status, ReceiptJobStatus.PENDING)
+        self.assertEqual(job.attempts, 0)
+
+    def test_worker_once_leaves_busy_job_queued(self):
+        job_id = self.upload().data['job_id']
+        out = StringIO()
+
+        with patch('llm.services.extract_bill_from_images', side_effect=ProviderBusy('gemini', 30)) as mock_extract:
+            call_command('process_receipt_jobs', '--once', stdout=out)
+
+        mock_extract.assert_called_once()
+        self.assertIn(f"Receipt job {job_id} requeued", out.getvalue())
+        self.assertNotIn("failed", out.getvalue())
+
+    def test_unknown_job_returns_404(self):
+        self.assertEqual(self.client.get('/api/receipt-jobs/999/').status_code, 404)
+
+
+class ParallelOCRTests(TestCase):
+    def setUp(self):
+        # Mocked clients must not outlive the test in the process-wide registry
+        providers.reset()
+        self.addCleanup(providers.reset)
+
+    def vision_response(self, text):
+        response = MagicMock()
+        response.error.message = ''
+        response.text_annotations = [MagicMock(description=text)]
+        return response
+
+    @patch('llm.utils.VISION_BATCH_SIZE', 2)
+    @patch('llm.utils.os.path.exists', return_value=True)
+    @patch('llm.utils.vision')
+    def test_vision_batches_run_concurrently_and_keep_order(self, mock_vision, _):
+        # Every batch waits for both, so this only passes if they overlap
+        barrier = threading.Barrier(2, timeout=5)
+
+        def batch_annotate_images(requests):
+            barrier.wait()
+            return MagicMock(responses=[self.vision_response(request.image.content.decode()) for request in requests])
+
+        mock_vision.Image.side_effect = lambda content: MagicMock(content=content)
+        mock_vision.AnnotateImageRequest.side_effect = lambda image, features: MagicMock(image=image)
+        mock_vision.ImageAnnotatorClient.return_value.batch_annotate_images.side_effect = batch_annotate_images
+
+        result = process_images_with_google_vision_bytes([b'a', b'b', b'c', b'd'], max_workers=4)
+
+        self.assertEqual(
+            result['results'],
+            [{'image_index': i, 'text': text} for i, text in enumerate('abcd')]
+        )
+        self.assertEqual(mock_vision.ImageAnnotatorClient.return_value.batch_annotate_images.call_count, 2)
+
+    @patch('llm.utils.os.path.exists', return_value=True)
+    @patch('llm.utils.vision')
+    def test_failed_vision_request_fails_every_image_in_it(self, mock_vision, _):
+        mock_vision.ImageAnnotatorClient.return_value.batch_annotate_images.side_effect = Exception('deadline exceeded')
+
+        result = process_images_with_google_vision_bytes([b'a', b'b'])
+
+        self.assertEqual(result['results'], [
+            {'image_index': 0, 'error': 'deadline exceeded'},
+            {'image_index': 1, 'error': 'deadline exceeded'},
+        ])
+
+
+class OCRCacheTests(TestCase):
+    def vision_results(self, image_bytes_list, max_workers=None):
+        return {
+            'provider': 'google_cloud_vision',
+            'results': [
+                {'image_index': idx, 'text': image_bytes.decode().upper()}
+                for idx, image_bytes in enumerate(image_bytes_list)
+            ]
+        }
+
+    @patch('llm.utils.process_images_with_google_vision_bytes')
+    def test_repeat_upload_skips_provider(self, mock_vision):
+        mock_vision.side_effect = self.vision_results
+        process_images_bytes([b'first'])
+
+        result = process_images_bytes([b'second', b'first'])
+
+        self.assertEqual(mock_vision.call_args[0][0], [b'second'])
+        self.assertEqual(result['cache_hits'], 1)
+        self.assertEqual(result['results'], [
+            {'image_index': 0, 'text': 'SECOND'},
+            {'image_index': 1, 'text': 'FIRST'},
+        ])
+
+    @patch('llm.utils.process_images_with_tesseract_bytes')
+    @patch('llm.utils.process_images_with_google_vision_bytes')
+    def test_key_includes_provider_and_errors_are_not_cached(self, mock_vision, mock_tesseract):
+        mock_vision.side_effect = self.vision_results
+        mock_tesseract.return_value = {
+            'provider': 'tesseract',
+            'results': [{'image_index': 0, 'error': 'tesseract failed'}]
+        }
+        process_images_bytes([b'receipt'])
+
+        process_images_bytes([b'receipt'], OCRProvider.TESSERACT)
+        process_images_bytes([b'receipt'], OCRProvider.TESSERACT)
+
+        self.assertEqual(mock_vision.call_count, 1)
+        self.assertEqual(mock_tesseract.call_count, 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        result_cache = ResultCache('test', ttl=3600, max_entries=2)
+        result_cache.set('a', 1)
+        result_cache.set('b', 2)
+        result_cache.get('a')
+        result_cache.set('c', 3)
+
+        self.assertEqual(result_cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+
+@patch.dict(os.environ, {'GEMINI_API_KEY': 'test-gemini-key'})
+@patch('llm.utils.read_prompt_file', return_value='Parse this receipt')
+@patch('llm.utils.genai')
+class LLMCacheTests(TestCase):
+    def setUp(self):
+        providers.reset()
+        self.addCleanup(providers.reset)
+        self.generate = MagicMock(return_value=MagicMock(text='```json\n{"items": [{"name": "Coffee"}]}\n```'))
+
+    def test_identical_request_is_served_from_cache(self, mock_genai, _):
+        mock_genai.GenerativeModel.return_value.generate_content = self.generate
+
+        first = process_ocr_text_with_llm('TOTAL 4.20')
+        second = process_ocr_text_with_llm('TOTAL 4.20')
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.generate.call_count, 1)
+
+    def test_prompt_text_and_bypass_change_the_outcome(self, mock_genai, _):
+        mock_genai.GenerativeModel.return_value.generate_content = self.generate
+        process_ocr_text_with_llm('TOTAL 4.20')
+
+        process_ocr_text_with_llm('TOTAL 4.20', custom_prompt='Other prompt')
+        process_ocr_text_with_llm('TOTAL 9.99')
+        process_ocr_text_with_llm('TOTAL 4.20', use_cache=False)
+
+        self.assertEqual(self.generate.call_count, 4)
+
+    def test_malformed_response_is_not_cached(self, mock_genai, _):
+        mock_genai.GenerativeModel.return_value.generate_content = self.generate
+        for text in ('{"items": [{"name": "Coffee"', '{"bill": {}}', 'Sorry, I cannot read this receipt'):
+            self.generate.reset_mock(return_value=True)
+            self.generate.return_value = MagicMock(text=text)
+
+            process_ocr_text_with_llm('TOTAL 4.20')
+            process_ocr_text_with_llm('TOTAL 4.20')
+
+            self.assertEqual(self.generate.call_count, 2)
+
+
+@patch.dict(os.environ, {'GEMINI_API_KEY': 'test-gemini-key'})
+@patch('llm.utils.genai')
+class ProviderRegistryTests(TestCase):
+    def setUp(self):
+        providers.reset()
+        self.addCleanup(providers.reset)
+
+    def test_gemini_is_configured_once_per_process(self, mock_genai):
+        mock_genai.GenerativeModel.return_value.generate_content.return_value = MagicMock(text='{}')
+
+        process_ocr_text_with_llm('TOTAL 4.20', use_cache=False)
+        process_ocr_text_with_llm('TOTAL 9.99', use_cache=False)
+
+        mock_genai.configure.assert_called_once_with(api_key='test-gemini-key')
+        mock_genai.GenerativeModel.assert_called_once()
+
+    @override_settings(BASE_DIR=tempfile.mkdtemp())
+    def test_prompt_is_reloaded_when_file_changes(self, _):
+        from django.conf import settings
+        prompt_dir = os.path.join(settings.BASE_DIR, 'llm', 'prompts')
+        os.makedirs(prompt_dir)
+        prompt_path = os.path.join(prompt_dir, 'prompt.txt')
+        self.addCleanup(shutil.rmtree, settings.BASE_DIR, True)
+
+        with open(prompt_path, 'w') as f:
+            f.write('first prompt')
+        self.assertEqual(read_prompt_file(), 'first prompt')
+
+        with patch('llm.utils.open') as mock_open:
+            self.assertEqual(read_prompt_file(), 'first prompt')
+            mock_open.assert_not_called()
+
+        with open(prompt_path, 'w') as f:
+            f.write('second prompt')
+        os.utime(prompt_path, ns=(0, os.stat(prompt_path).st_mtime_ns + 1000))
+        self.assertEqual(read_prompt_file(), 'second prompt')
+
+
+class PreprocessingTests(TestCase):
+    def phone_photo(self, orientation):
+        img = Image.new('RGB', (4000, 3000), color='white')
+        exif = img.getexif()
+        exif[0x0112] = orientation
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=95, exif=exif)
+        return output.getvalue()
+
+    def test_photo_is_rotated_shrunk_and_grayscaled(self):
+        # Orientation 6: the camera was held upright, pixels are stored sideways
+        photo = self.phone_photo(orientation=6)
+
+        processed, report = preprocess_image(photo, 'ocr')
+
+        img = Image.open(BytesIO(processed))
+        self.assertEqual(img.size, (1200, 1600))
+        self.assertEqual(img.mode, 'L')
+        self.assertEqual(report['original_size'], (4000, 3000))
+        self.assertEqual(report['processed_size'], (1200, 1600))
+        self.assertEqual(report['processed_bytes'], len(processed))
+        self.assertLess(report['processed_bytes'], report['original_bytes'])
+
+    def test_none_profile_leaves_image_untouched(self):
+        photo = self.phone_photo(orientation=1)
+        self.assertEqual(preprocess_image(photo, 'none')[0], photo)
+
+    @patch('llm.utils.process_images_with_google_vision_bytes')
+    def test_ocr_receives_preprocessed_images(self, mock_vision):
+        mock_vision.return_value = {'provider': 'google_cloud_vision', 'results': [{'image_index': 0, 'text': ''}]}
+        photo = self.phone_photo(orientation=1)
+
+        result = process_images_bytes([photo], use_cache=False, preprocessing='ocr')
+
+        sent = mock_vision.call_args[0][0][0]
+        self.assertEqual(Image.open(BytesIO(sent)).size, (1600, 1200))
+        self.assertEqual(result['preprocessing'][0]['processed_bytes'], len(sent))
+
+
+CLEAN_RECEIPT = """TRADER JOE'S
+1234 Main Street
+Springfield, IL 62701
+03/14/2025 12:31
+BANANAS
+2 @ 0.29   0.58
+ORGANIC MILK      4.99
+2 x BREAD          5.98
+COUPON           -1.00
+SUBTOTAL          10.55
+TAX 8.25%          0.87
+TOTAL             11.42
+VISA              11.42
+CHANGE DUE         0.00
+"""
+
+
+class ReceiptParserTests(TestCase):
+    def test_clean_receipt_is_parsed_and_reconciled(self):
+        parsed = parse_receipt_text(CLEAN_RECEIPT)
+        bill = parsed['bill']
+
+        self.assertTrue(parsed['reconciled'])
+        self.assertGreaterEqual(parsed['confidence'], 0.8)
+        self.assertEqual(
+            [(item['name'], item['quantity'], item['totalPrice']) for item in bill['items']],
+            [('BANANAS', 2, 0.58), ('ORGANIC MILK', 1, 4.99), ('BREAD', 2, 4.98)]
+        )
+        self.assertAlmostEqual(sum(item['taxAmount'] for item in bill['items']), 0.87)
+        self.assertEqual(bill['grandTotal'], 11.42)
+        self.assertEqual(bill['storeInformation']['dateTimeOfPurchase'], '2025-03-14')
+        self.assertEqual(bill['paymentDetails']['paymentMethod'], 'Credit Card')
+
+    def test_items_that_do_not_add_up_are_not_reconciled(self):
+        parsed = parse_receipt_text(CLEAN_RECEIPT.replace('ORGANIC MILK      4.99', 'ORGANIC MILK      4.89'))
+
+        self.assertFalse(parsed['reconciled'])
+        self.assertEqual(parsed['confidence'], 0)
+
+    @patch('llm.services.route_ocr_text_to_llm', return_value='{"from": "llm"}')
+    def test_llm_is_only_called_when_parser_cannot_reconcile(self, mock_llm):
+        self.assertEqual(json.loads(extract_bill_from_text(CLEAN_RECEIPT))['grandTotal'], 11.42)
+        mock_llm.assert_not_called()
+
+        self.assertEqual(extract_bill_from_text('SOMETHING 1.00\nTOTAL 3.00'), '{"from": "llm"}')
+        self.assertEqual(extract_bill_from_text(CLEAN_RECEIPT, custom_prompt='Custom'), '{"from": "llm"}')
+        self.assertEqual(mock_llm.call_count, 2)
+
+
+class StreamingTests(TestCase):
+    LLM_OUTPUT = (
+        '```json\n{"storeInformation": {"title": "Shop {1}"},\n'
+        '"items": [{"name": "Milk \\"2%\\"", "totalPrice": 4.99}, // dairy\n'
+        '{"name": "Bread", "totalPrice": 2.50,}],\n"grandTotal": 7.49}\n```'
+    )
+
+    def test_items_are_parsed_across_arbitrary_chunks(self):
+        parser = ItemStreamParser()
+        items = []
+        for i in range(0, len(self.LLM_OUTPUT), 7):
+            items.extend(parser.feed(self.LLM_OUTPUT[i:i + 7]))
+
+        self.assertEqual(items, [
+            {'name': 'Milk "2%"', 'totalPrice': 4.99},
+            {'name': 'Bread', 'totalPrice': 2.50},
+        ])
+
+    @patch('llm.services.stream_ocr_text_with_llm')
+    @patch('llm.services.process_images_bytes')
+    def test_stream_endpoint_sends_items_then_bill(self, mock_ocr, mock_stream):
+        mock_ocr.return_value = {'results': [{'image_index': 0, 'text': 'MILK 4.99'}]}
+        mock_stream.return_value = iter([self.LLM_OUTPUT[:60], self.LLM_OUTPUT[60:]])
+        image = SimpleUploadedFile('receipt.jpg', b'fake image bytes', content_type='image/jpeg')
+
+        response = APIClient().post('/api/process-bill-images/stream/', {'files[]': [image]}, format='multipart')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        events = [
+            (block.split('\n')[0][len('event: '):], json.loads(block.split('\n')[1][len('data: '):]))
+            for block in b''.join(response.streaming_content).decode().strip().split('\n\n')
+        ]
+        self.assertEqual([name for name, _ in events], ['item', 'item', 'bill'])
+        self.assertEqual(events[0][1]['name'], 'Milk "2%"')
+        self.assertEqual(events[2][1]['bill'], self.LLM_OUTPUT)
+
+
+@patch.dict(os.environ, {'FAST_KEY': 'x', 'SLOW_KEY': 'x'})
+@override_settings(LLM_PROVIDER_ORDER=['slow', 'fast'], LLM_HEDGE_AFTER_SECONDS=0.05)
+class LLMRouterTests(TestCase):
+    def make_router(self, slow, fast):
+        return LLMRouter('test', {'slow': (slow, 'SLOW_KEY'), 'fast': (fast, 'FAST_KEY')})
+
+    def test_slow_provider_is_hedged_and_faster_answer_wins(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow(text):
+            release.wait(5)
+            return 'slow'
+
+        router = self.make_router(slow, lambda text: 'fast')
+        self.assertEqual(router.call('receipt'), 'fast')
+
+    def test_failure_falls_through_to_next_provider(self):
+        def broken(text):
+            raise RuntimeError('quota exceeded')
+
+        router = self.make_router(broken, lambda text: 'fast')
+        self.assertEqual(router.call('receipt'), 'fast')
+        self.assertEqual(router.latency_summary()['slow']['failures'], 1)
+
+        router = self.make_router(broken, broken)
+        with self.assertRaisesRegex(RuntimeError, 'quota exceeded'):
+            router.call('receipt')
+
+    def test_fast_failing_provider_is_demoted_and_not_sampled(self):
+        def broken(text):
+            raise RuntimeError('invalid API key')
+
+        def working(text):
+            time.sleep(0.01)
+            return 'fast'
+
+        router = self.make_router(broken, working)
+        for _ in range(3):
+            self.assertEqual(router.call('receipt'), 'fast')
+
+        self.assertEqual(router.order(), ['fast', 'slow'])
+        summary = router.latency_summary()['slow']
+        self.assertEqual((summary['count'], summary['failures'], summary['p50']), (0, 3, None))
+        self.assertEqual(router.hedge_after('slow'), 0.05)
+
+        # One success puts it back in its configured place
+        router.stats['slow'].record(0.5)
+        self.assertEqual(router.order(), ['slow', 'fast'])
+
+    def test_providers_without_api_key_are_skipped(self):
+        router = self.make_router(lambda text: 'slow', lambda text: 'fast')
+        with patch.dict(os.environ, {'SLOW_KEY': ''}):
+            self.assertEqual(router.order(), ['fast'])
+
+    def test_order_follows_recorded_latency(self):
+        router = self.make_router(lambda text: 'slow', lambda text: 'fast')
+        for _ in range(20):
+            router.stats['slow'].record(3.0)
+            router.stats['fast'].record(1.0)
+
+        self.assertEqual(router.order(), ['fast', 'slow'])
+        self.assertEqual(router.latency_summary()['fast']['p95'], 1.0)
+
+
+class ProviderRateLimitTests(TestCase):
+    def limited(self, **limits):
+        # A fresh provider name per test, since limiter state lives in the shared cache
+        provider = f'test-{uuid.uuid4().hex[:8]}'
+        limits = {'rate': 1, 'burst': 2, 'concurrency': 5, 'max_waiters': 0, 'lease': 10, **limits}
+        return provider, override_settings(PROVIDER_LIMITS={provider: limits})
+
+    def test_burst_beyond_bucket_is_rejected_with_retry_after(self):
+        provider, limits = self.limited()
+        with limits:
+            for _ in range(2):
+                with provider_slot(provider, wait_timeout=0):
+                    pass
+            with self.assertRaises(ProviderBusy) as busy:
+                with provider_slot(provider, wait_timeout=0):
+                    pass
+        self.assertGreaterEqual(busy.exception.retry_after, 1)
+
+    def test_concurrent_calls_wait_for_a_free_slot(self):
+        provider, limits = self.limited(rate=100, burst=100, concurrency=1, max_waiters=1)
+        with limits:
+            with provider_slot(provider):
+                with self.assertRaises(ProviderBusy):
+                    with provider_slot(provider, wait_timeout=0.1):
+                        pass
+            with provider_slot(provider, wait_timeout=0.1):
+                pass
+
+    def test_lease_held_past_its_timeout_is_not_deleted(self):
+        limiter = ProviderLimiter(f'test-{uuid.uuid4().hex[:8]}', {
+            'rate': 100, 'burst': 100, 'concurrency': 1, 'max_waiters': 0, 'lease': 10
+        })
+        slot = limiter.acquire(wait_timeout=0)
+        # The lease expired mid-call and another call claimed the key
+        cache.set(slot, 'other-owner')
+        with patch('llm.rate_limit.time.monotonic', return_value=time.monotonic() + 10):
+            limiter.release(slot)
+        self.assertEqual(cache.get(slot), 'other-owner')
+
+        # Released in time, the lease is freed at once
+        cache.delete(slot)
+        slot = limiter.acquire(wait_timeout=0)
+        limiter.release(slot)
+        self.assertIsNone(cache.get(slot))
+
+    @patch('llm.services.extract_ocr_text', side_effect=ProviderBusy('gemini', 2.3))
+    def test_saturated_provider_returns_429(self, mock_extract):
+        image = SimpleUploadedFile('receipt.jpg', b'fake image bytes', content_type='image/jpeg')
+        response = APIClient().post('/api/process-bill-images/', {'files[]': [image]}, format='multipart')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    @patch('llm.views.extract_bill_from_text', side_effect=ProviderBusy('gemini', 2))
+    @patch('llm.views.process_images_bytes', return_value={'results': [{'image_index': 0, 'text': 'TOTAL 4.20'}]})
+    def test_ocr_llm_helper_lets_provider_busy_through(self, mock_ocr, mock_extract):
+        from .views import process_receipt_with_OCR_LLM
+
+        with self.assertRaises(ProviderBusy):
+            process_receipt_with_OCR_LLM(b'fake image bytes')
+
+
+class StageTimingTests(TestCase):
+    @patch('llm.services.route_ocr_text_to_llm', return_value='{"bill": {}}')
+    @patch('llm.services.process_images_bytes')
+    def test_stages_returned_in_header_and_logged(self, mock_ocr, mock_llm):
+        mock_ocr.return_value = {'results': [{'image_index': 0, 'text': 'no totals here'}]}
+        image = SimpleUploadedFile('receipt.jpg', b'fake image bytes', content_type='image/jpeg')
+
+        with self.assertLogs('llm.timing', level='INFO') as logs:
+            response = APIClient().post('/api/process-bill-images/', {'files[]': [image]}, format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages[-1], 'total')
+        self.assertTrue({'read', 'stitch', 'parse'} <= set(stages))
+        record = logs.records[0].stage_timings
+        self.assertEqual(record['request'], 'process_bill_images')
+        self.assertEqual(record['status'], 200)
+        self.assertIn('stitch', record['stages_ms'])
+
+
+class CompactionTests(TestCase):
+    RECEIPT = (
+        "CORNER MARKET\n\n   Welcome   to our store\n12 Main St, Springfield, IL 62704\n\n"
+        "BANANAS        0.99\nORGANIC MILK\n        4.49\n------------------\n012345678901\n"
+        "SUBTOTAL   5.48\nTAX  0.10\nTOTAL    5.58\nVISA ****1234   5.58\n\n"
+        "THANK YOU FOR SHOPPING\nwww.cornermarket.com/survey\nCORNER MARKET\n"
+    )
+
+    def test_keeps_items_and_drops_noise(self):
+        text, stats = compact_ocr_text(self.RECEIPT)
+
+        self.assertEqual(text.splitlines(), [
+            'CORNER MARKET', 'Welcome to our store', '12 Main St, Springfield, IL 62704',
+            'BANANAS 0.99', 'ORGANIC MILK', '4.49', 'SUBTOTAL 5.48', 'TAX 0.10', 'TOTAL 5.58', 'VISA ****1234 5.58',
+        ])
+        self.assertLess(stats['tokens_after'], stats['tokens_before'])
+        self.assertEqual(stats['lines_after'], 10)
+
+    def test_budget_trims_header_but_never_items(self):
+        with self.assertLogs('llm.compaction', 'WARNING'):
+            text, stats = compact_ocr_text(self.RECEIPT, token_budget=20)
+
+        self.assertEqual(text.splitlines(), [
+            'CORNER MARKET', 'BANANAS 0.99', 'ORGANIC MILK', '4.49',
+            'SUBTOTAL 5.48', 'TAX 0.10', 'TOTAL 5.58', 'VISA ****1234 5.58',
+        ])
+        self.assertGreater(stats['tokens_after'], 20)
+
+    def test_column_layout_keeps_names_before_first_price(self):
+        # Tesseract reads a two-column receipt as all names, then all prices
+        receipt = (
+            "TRADER JOE'S\n123 Main St\nSpringfield, IL 62704\n\nBANANAS\nORGANIC MILK\nSOURDOUGH\n\n"
+            "0.29\n4.99\n3.49\nSUBTOTAL 8.77\nTOTAL 8.77\nTHANK YOU\n"
+        )
+        text, _ = compact_ocr_text(receipt)
+
+        self.assertEqual(text.splitlines()[3:], [
+            'BANANAS', 'ORGANIC MILK', 'SOURDOUGH', '0.29', '4.99', '3.49', 'SUBTOTAL 8.77', 'TOTAL 8.77',
+        ])
+
+
+class ReceiptScanTests(TestCase):
+    @patch('llm.services.route_ocr_text_to_llm', return_value='{"grandTotal": 4.2}')
+    @patch('llm.services.process_images_bytes')
+    def test_scan_is_saved_served_and_linked_to_bill(self, mock_ocr, mock_llm):
+        from bills_new.services import BillService
+
+        mock_ocr.return_value = {'results': [{'image_index': 0, 'text': 'COFFEE 4.20'}]}
+        image = SimpleUploadedFile('receipt.jpg', b'fake image bytes', content_type='image/jpeg')
+        scan_id = APIClient().post('/api/process-bill-images/', {'files[]': [image]}, format='multipart').data['scan_id']
+
+        response = APIClient().get(f'/api/receipt-scans/{scan_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['bill'], '{"grandTotal": 4.2}')
+        self.assertEqual(response.data['ocr_text'], 'COFFEE 4.20')
+        self.assertEqual(response.data['provider'], 'google_cloud')
+        self.assertIn('total', response.data['timings'])
+        mock_ocr.assert_called_once()
+        mock_llm.assert_called_once()
+
+        alice = User.objects.create(username='alice').profile
+        bill = BillService.create_bill({
+            'bill': {'title': 'Coffee', 'date': timezone.now().date()},
+            'items': [{'name': 'Coffee', 'price': 4.2, 'shares': [{'person_id': alice.id, 'split_type': 'EQUAL'}]}],
+            'receipt_scan_id': scan_id,
+        }, alice, bulk=True)
+        self.assertEqual(ReceiptScan.objects.get(id=scan_id).bill, bill)
+        # A scan stays with the first bill saved from it
+        self.assertFalse(ReceiptScanService.link_bill(scan_id, bill))
+
+    @patch('llm.services.route_ocr_text_to_llm', return_value='{"grandTotal": 4.2}')
+    @patch('llm.services.process_images_bytes')
+    def test_reupload_reuses_scan_unless_prompt_differs(self, mock_ocr, mock_llm):
+        mock_ocr.return_value = {'results': [{'image_index': 0, 'text': 'COFFEE 4.20'}]}
+
+        def upload(**data):
+            image = SimpleUploadedFile('receipt.jpg', b'fake image bytes', content_type='image/jpeg')
+            return APIClient().post(
+                '/api/process-bill-images/', {'files[]': [image], **data}, format='multipart'
+            ).data['scan_id']
+
+        first = upload()
+        self.assertEqual(upload(), first)
+        mock_ocr.assert_called_once()
+        mock_llm.assert_called_once()
+
+        self.assertNotEqual(upload(custom_prompt='Only list drinks'), first)
+        self.assertEqual(mock_llm.call_count, 2)
+
+    @override_settings(RECEIPT_SCAN_MAX_ENTRIES=2)
+    def test_evict_trims_oldest_unlinked_scans(self):
+        from bills_new.models import Bill
+
+        alice = User.objects.create(username='alice').profile
+        bill = Bill.objects.create(title='Coffee', date=timezone.now().date(), created_by=alice)
+        linked = ReceiptScanService.record([b'linked'], 'google_cloud', '', '{}')
+        ReceiptScanService.link_bill(linked.id, bill)
+        scans = [ReceiptScanService.record([bytes([i])], 'google_cloud', '', '{}') for i in range(3)]
+
+        self.assertEqual(
+            set(ReceiptScan.objects.values_list('id', flat=True)),
+            {linked.id, scans[1].id, scans[2].id}
+        )
+
+    def test_unknown_scan_is_404(self):
+        self.assertEqual(APIClient().get('/api/receipt-scans/999/').status_code, 404)
+
+
+class StitchingTests(TestCase):
+    def test_overlapping_photos_keep_shared_lines_once(self):
+        first = "CORNER MARKET\nMILK 4.99\nBREAD 2.50\nEGGS 3.19\nAPPLES 1.2"
+        # The second photo's top line is cut off; its copy of the last item is the whole one
+        second = "~~ .50\nBREAD 2.50\nEGGS  3.19\nAPPLES 1.29\nSUBTOTAL 11.97"
+
+        self.assertEqual(
+            stitch_ocr_texts([first, second]),
+            "CORNER MARKET\nMILK 4.99\nBREAD 2.50\nEGGS 3.19\nAPPLES 1.29\nSUBTOTAL 11.97"
+        )
+
+    def test_photos_without_overlap_are_joined(self):
+        first = "MILK 4.99\nBREAD 2.50"
+        second = "EGGS 3.19\nTOTAL 10.68"
+
+        self.assertEqual(stitch_ocr_texts([first, '', second]), f"{first}\n\n{second}")
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        providers.reset()
+        self.addCleanup(providers.reset)
+
+    @patch.dict(os.environ, {})
+    def test_stub_run_reports_stage_latencies(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        output = os.path.join(directory, 'benchmark.json')
+        call_command(
+            'benchmark_receipts', 'test_images', '--pattern', 'receipt.jpg', '--runs', '2',
+            '--output', output, stdout=StringIO()
+        )
+
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(report['stages']['llm']['count'], 2)
+        self.assertEqual(report['bytes']['images'], 2)
+        self.assertLess(report['bytes']['processed_bytes'], report['bytes']['original_bytes'])
+        self.assertGreater(report['memory']['tracemalloc_peak_bytes'], 0)
+
+
+CASSETTE_DIR = tempfile.mkdtemp()
+
+
+@patch.dict(os.environ, {'GEMINI_API_KEY': 'test-gemini-key'})
+@patch('llm.utils.genai')
+@override_settings(PROVIDER_CASSETTE_DIR=CASSETTE_DIR, PROVIDER_CASSETTE_LATENCY_SCALE=0)
+class CassetteTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(CASSETTE_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        providers.reset()
+        self.addCleanup(providers.reset)
+
+    def test_recorded_llm_response_is_replayed_without_the_provider(self, mock_genai):
+        generate = mock_genai.GenerativeModel.return_value.generate_content
+        generate.return_value = MagicMock(text='{"grandTotal": 4.2}')
+        with override_settings(PROVIDER_CASSETTE_MODE='record'):
+            process_ocr_text_with_llm('TOTAL 4.20', use_cache=False)
+
+        generate.side_effect = AssertionError('provider called during replay')
+        with override_settings(PROVIDER_CASSETTE_MODE='replay'):
+            self.assertEqual(process_ocr_text_with_llm('TOTAL 4.20', use_cache=False), '{"grandTotal": 4.2}')
+            with self.assertRaisesRegex(RuntimeError, 'No recorded gemini response'):
+                process_ocr_text_with_llm('TOTAL 9.99', use_cache=False)
+
+    @patch('llm.utils.os.path.exists', return_value=True)
+    @patch('llm.utils.vision')
+    def test_vision_images_replay_in_any_batch(self, mock_vision, _, mock_genai):
+        mock_vision.Image.side_effect = lambda content: MagicMock(content=content)
+        mock_vision.AnnotateImageRequest.side_effect = lambda image, features: MagicMock(image=image)
+        mock_vision.ImageAnnotatorClient.return_value.batch_annotate_images.side_effect = lambda requests: MagicMock(
+            responses=[
+                MagicMock(error=MagicMock(message=''), text_annotations=[MagicMock(description=request.image.content.decode())])
+                for request in requests
+            ]
+        )
+        with override_settings(PROVIDER_CASSETTE_MODE='record'):
+            process_images_with_google_vision_bytes([b'a', b'b'])
+
+        providers.reset()
+        mock_vision.ImageAnnotatorClient.side_effect = AssertionError('client created during replay')
+        with override_settings(PROVIDER_CASSETTE_MODE='replay'):
+            result = process_images_with_google_vision_bytes([b'b'])
+        self.assertEqual(result['results'], [{'image_index': 0, 'text': 'b'}])
+
+
+class TesseractPoolTests(TestCase):
+    def setUp(self):
+        shutdown_tesseract_pool()
+        self.addCleanup(shutdown_tesseract_pool)
+
+    def test_workers_are_reused_and_results_keep_order(self):
+        images = []
+        for color in ('white', 'black', 'gray'):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 20), color).save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+
+        first = process_images_with_tesseract_bytes(images, max_workers=2)
+        pool = get_tesseract_pool()
+        second = process_images_with_tesseract_bytes(images[:1])
+
+        self.assertIs(get_tesseract_pool(), pool)
+        # Workers are not forked from the multithreaded web worker
+        self.assertIn(pool._mp_context.get_start_method(), ('forkserver', 'spawn'))
+        self.assertEqual([result['image_index'] for result in first['results']], [0, 1, 2])
+        self.assertEqual(second['results'][0]['image_index'], 0)
+        # Either the text or the error (e.g. no tesseract installed) comes back per image
+        self.assertTrue(all('text' in result or 'error' in result for result in first['results']))
@@ -0,0 +1,108 @@
+"""
+Lightweight per-request stage timers for the receipt pipeline.
+
+A view is wrapped with @timed(name), or code opens request_timer(name).
+Anything below it in the call stack can then mark a stage with
+`with stage('ocr'):`. This includes provider calls that the LLM router runs
+in its threads, since the router copies the request's context into them.
+Outside a request timer, stage() only reads a context variable, so library
+code can be instrumented unconditionally.
+
+Stages with the same name are added up. When the request finishes:
+- its durations are logged as one structured record through the 'llm' logger,
+  as JSON in the message and as the record's `stage_timings` attribute
+- @timed views also return them in a Server-Timing header, which browser
+  dev tools and most APM tools display
+"""
+import json
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional['RequestTimer']] = ContextVar('llm_request_timer', default=None)
+
+
+class RequestTimer:
+    def __init__(self, name: str):
+        self.name = name
+        self.fields: Dict[str, Any] = {}
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.total: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def durations_ms(self) -> Dict[str, float]:
+        """Stage durations in milliseconds, in the order the stages started, then 'total'."""
+        with self._lock:
+            durations = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        durations['total'] = round(total * 1000, 1)
+        return durations
+
+    def server_timing(self) -> str:
+        return ', '.join(f'{name};dur={ms}' for name, ms in self.durations_ms().items())
+
+
+@contextmanager
+def request_timer(name: str) -> Iterator[RequestTimer]:
+    """Time one request's stages, and log them when it finishes."""
+    timer = RequestTimer(name)
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        timer.total = time.perf_counter() - timer.started
+        record = {'event': 'stage_timings', 'request': name, **timer.fields, 'stages_ms': timer.durations_ms()}
+        logger.info(json.dumps(record), extra={'stage_timings': record})
+
+
+def current_durations() -> Dict[str, float]:
+    """The current request's stage durations so far, in milliseconds; empty outside a request."""
+    timer = _current.get()
+    return timer.durations_ms() if timer is not None else {}
+
+
+def annotate(**fields: Any) -> None:
+    """Add fields (e.g. token counts) to the current request's log record."""
+    timer = _current.get()
+    if timer is not None:
+        timer.fields.update(fields)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Add the time spent in the block to the current request's `name` stage."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def timed(name: str):
+    """View decorator: time the request and return its stages in a Server-Timing header."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with request_timer(name) as timer:
+                response = view(*args, **kwargs)
+                timer.fields['status'] = getattr(response, 'status_code', None)
+            response['Server-Timing'] = timer.server_timing()
+            return response
+        return wrapper
+    return decorator
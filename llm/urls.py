@@ -5,4 +5,8 @@ from . import views
 urlpatterns = [
     path('process-receipt/', ProcessReceiptView.as_view(), name='process_receipt'),
     path('process-bill-images/', views.process_bill_images, name='process-bill-images'),
+    path('process-bill-images/stream/', views.process_bill_images_stream, name='process-bill-images-stream'),
+    path('receipt-jobs/', views.create_receipt_job, name='receipt-jobs'),
+    path('receipt-jobs/<int:job_id>/', views.receipt_job_detail, name='receipt-job-detail'),
+    path('receipt-scans/<int:scan_id>/', views.receipt_scan_detail, name='receipt-scan-detail'),
 ]
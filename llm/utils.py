@@ -1,7 +1,9 @@
 import os
+import json
 import base64
 import logging
-from typing import Optional, List, Dict, Any, Union
+import threading
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Union
 from django.conf import settings
 import openai
 import google.generativeai as genai
@@ -11,7 +13,13 @@ from PIL import Image
 import io
 from google.cloud import vision
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from . import cassettes
+from .compaction import compact_ocr_text
+from .rate_limit import ProviderBusy, provider_slot
+from .streaming import is_bill, parse_llm_json
+from .timing import annotate, stage
 
 
 # Configure logging
@@ -21,6 +29,128 @@ logger = logging.getLogger(__name__)
 OPENAI_MODEL = "gpt-4o-mini"
 GEMINI_MODEL = "gemini-2.0-flash-exp"
 
+# Google Cloud service account key, in the project root
+GOOGLE_CREDENTIALS_FILE = "coral-muse-452018-s2-171009389e4d.json"
+
+
+class ProviderRegistry:
+    """
+    Provider clients created once per process and shared by every request,
+    so their gRPC/HTTP connections (and TLS sessions) are reused.
+
+    Clients are dropped when the process forks (e.g. gunicorn --preload),
+    since gRPC channels must not be shared with a child process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = os.getpid()
+
+    def get(self, key: Any, factory) -> Any:
+        """
+        Return the client registered under `key`, creating it with `factory` on first use.
+        """
+        if self._pid != os.getpid():
+            self.reset()
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = factory()
+                    self._clients[key] = client
+        return client
+
+    def register(self, key: Any, client: Any) -> None:
+        """Install a client under `key`, e.g. a stub for offline benchmarks."""
+        if self._pid != os.getpid():
+            self.reset()
+        with self._lock:
+            self._clients[key] = client
+
+    def discard(self, key: Any) -> None:
+        """Forget one client, so the next get() creates a new one."""
+        with self._lock:
+            self._clients.pop(key, None)
+
+    def reset(self) -> None:
+        """Forget every client, e.g. after credentials change."""
+        with self._lock:
+            self._clients = {}
+            self._pid = os.getpid()
+
+
+providers = ProviderRegistry()
+
+def get_vision_client() -> Any:
+    """
+    Return the process-wide Google Cloud Vision client.
+    
+    Raises:
+        FileNotFoundError: If the Google Cloud credentials file is missing
+    """
+    def create():
+        credentials_path = os.path.join(Path(__file__).resolve().parent.parent, GOOGLE_CREDENTIALS_FILE)
+        if not os.path.exists(credentials_path):
+            raise FileNotFoundError(f"Google Cloud credentials file not found at: {credentials_path}")
+
+        # Set credentials via absolute path
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = str(credentials_path)
+        return vision.ImageAnnotatorClient()
+
+    return providers.get('google_vision', create)
+
+def configure_gemini(api_key: str) -> None:
+    """
+    Configure the Gemini SDK once per process and API key. Reconfiguring
+    discards the SDK's clients, so it is skipped when nothing changed.
+    """
+    def create():
+        genai.configure(api_key=api_key)
+        return api_key
+
+    if providers.get('gemini_api_key', create) != api_key:
+        providers.discard('gemini_api_key')
+        providers.get('gemini_api_key', create)
+
+def gemini_model_key(api_key: str, model_name: str, generation_config: Dict[str, Any]) -> tuple:
+    """Registry key of the GenerativeModel for an API key, model name and generation config."""
+    return ('gemini_model', api_key, model_name, json.dumps(generation_config, sort_keys=True))
+
+def get_gemini_model(api_key: str, model_name: str, generation_config: Dict[str, Any]) -> Any:
+    """
+    Return the process-wide GenerativeModel for an API key, model name and
+    generation config. Call configure_gemini(api_key) first.
+    """
+    key = gemini_model_key(api_key, model_name, generation_config)
+    return providers.get(key, lambda: genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+    ))
+
+# Prompt file contents by path, as (modification time, text)
+_prompt_cache: Dict[str, tuple] = {}
+
+def _read_prompt(path: str) -> str:
+    """
+    Read a prompt file, served from memory until the file's modification time changes.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        # Let open() report the problem
+        mtime = None
+
+    cached = _prompt_cache.get(path)
+    if mtime is not None and cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if mtime is not None:
+        _prompt_cache[path] = (mtime, text)
+    return text
+
 def encode_image_to_base64(image_data: bytes) -> str:
     """
     Convert image data to base64 encoded string.
@@ -44,6 +174,7 @@ def encode_image_to_base64(image_data: bytes) -> str:
 def read_prompt_file() -> str:
     """
     Read and return the content of the prompt file.
+    The content is kept in memory and re-read only when the file changes.
     
     Returns:
         String content of prompt file
@@ -54,15 +185,13 @@ def read_prompt_file() -> str:
     """
     prompt_file_path = os.path.join(settings.BASE_DIR, "llm", "prompts", "prompt.txt")
     try:
-        with open(prompt_file_path, "r", encoding="utf-8") as f:
-            return f.read().strip()
+        return _read_prompt(prompt_file_path)
     except FileNotFoundError:
         logger.error(f"Prompt file not found at {prompt_file_path}")
         # Fallback to the root prompt file
         root_prompt_path = os.path.join(settings.BASE_DIR, "prompt.txt")
         try:
-            with open(root_prompt_path, "r", encoding="utf-8") as f:
-                return f.read().strip()
+            return _read_prompt(root_prompt_path)
         except Exception as e:
             logger.error(f"Failed to read root prompt file: {str(e)}")
             raise FileNotFoundError(f"Failed to read prompt file: {str(e)}")
@@ -95,31 +224,40 @@ def process_receipt_with_openai(image_data: bytes) -> str:
     data_url = encode_image_to_base64(image_data)
     prompt = read_prompt_file()
     
-    try:
-        response = openai.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": data_url}},
+    with provider_slot('openai'):
+        try:
+            response = cassettes.replayable(
+                'openai', (OPENAI_MODEL, prompt, data_url, 3000),
+                lambda: openai.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": prompt},
+                                {"type": "image_url", "image_url": {"url": data_url}},
+                            ],
+                        }
                     ],
-                }
-            ],
-            max_tokens=3000,
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}")
-        raise RuntimeError(f"OpenAI API error: {str(e)}")
+                    max_tokens=3000,
+                ),
+                cassettes.encode_openai, cassettes.decode_openai
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            raise RuntimeError(f"OpenAI API error: {str(e)}")
     
-def process_receipt_with_gemini(image_bytes: bytes) -> str:
+def process_receipt_with_gemini(image_bytes: bytes, use_cache: bool = True) -> str:
     """
     Process a receipt image using Google's Gemini vision model.
+    The image is preprocessed with settings.LLM_PREPROCESSING_PROFILE before upload.
+    Responses are cached by model, generation config, prompt, image hash and
+    preprocessing profile.
     
     Args:
         image_bytes: Raw image bytes to process
+        use_cache: Whether to reuse a cached response for the same request
         
     Returns:
         String response from Gemini containing structured receipt data
@@ -128,6 +266,9 @@ def process_receipt_with_gemini(image_bytes: bytes) -> str:
         ValueError: If image data is invalid or API key is not set
         RuntimeError: If Gemini API call fails
     """
+    from .preprocessing import get_profile, preprocess_image
+    from .result_cache import llm_cache
+
     if not image_bytes:
         logger.error("No image data provided")
         raise ValueError("No image data provided. 'image_bytes' is empty or None.")
@@ -140,19 +281,12 @@ def process_receipt_with_gemini(image_bytes: bytes) -> str:
 
     # 2. Read prompt from prompt.txt
     try:
-        prompt_text = read_prompt_file()
+        with stage('prompt'):
+            prompt_text = read_prompt_file()
     except Exception as e:
         logger.error(f"Error reading prompt file: {str(e)}")
         raise ValueError(f"Error reading prompt file: {str(e)}")
 
-    # 3. Configure Gemini
-    try:
-        genai.configure(api_key=api_key)
-    except Exception as e:
-        logger.error(f"Error configuring Gemini: {str(e)}")
-        raise RuntimeError(f"Error configuring Gemini: {str(e)}")
-
-    # 4. Create a GenerativeModel with desired settings
     generation_config = {
         "temperature": 1,
         "top_p": 0.95,
@@ -160,36 +294,58 @@ def process_receipt_with_gemini(image_bytes: bytes) -> str:
         "max_output_tokens": 8192,
         "response_mime_type": "text/plain",
     }
-    
+
+    # 3. Reuse the response to an identical earlier request
+    profile_name = getattr(settings, 'LLM_PREPROCESSING_PROFILE', 'llm')
+    cache_key = llm_cache_key(GEMINI_MODEL, generation_config, prompt_text, image_bytes, get_profile(profile_name))
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Shrink the photo before uploading it
+    with stage('preprocess'):
+        upload_bytes, _ = preprocess_image(image_bytes, profile_name)
+
+    # 4. Configure Gemini (once per process)
+    try:
+        configure_gemini(api_key)
+    except Exception as e:
+        logger.error(f"Error configuring Gemini: {str(e)}")
+        raise RuntimeError(f"Error configuring Gemini: {str(e)}")
+
+    # 5. Get the shared GenerativeModel for these settings
     try:
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config=generation_config,
-        )
+        model = get_gemini_model(api_key, GEMINI_MODEL, generation_config)
     except Exception as e:
         logger.error(f"Error creating Gemini model: {str(e)}")
         raise RuntimeError(f"Error creating Gemini model: {str(e)}")
 
-    # 5. Prepare a dictionary for the binary image data
+    # 6. Prepare a dictionary for the binary image data
     image_dict = {
         "mime_type": "image/jpeg",
-        "data": image_bytes,
+        "data": upload_bytes,
     }
 
-    # 6. Call the model with both text prompt and the image dict
-    try:
-        response = model.generate_content(
-            contents=[
-                prompt_text,
-                image_dict
-            ]
-        )
-    except Exception as e:
-        logger.error(f"Gemini API error: {str(e)}")
-        traceback.print_exc()
-        raise RuntimeError(f"Gemini API error during generate_content call: {str(e)}")
+    # 7. Call the model with both text prompt and the image dict
+    with provider_slot('gemini'):
+        try:
+            response = cassettes.replayable(
+                'gemini', (GEMINI_MODEL, generation_config, prompt_text, upload_bytes),
+                lambda: model.generate_content(
+                    contents=[
+                        prompt_text,
+                        image_dict
+                    ]
+                ),
+                cassettes.encode_gemini, cassettes.decode_gemini
+            )
+        except Exception as e:
+            logger.error(f"Gemini API error: {str(e)}")
+            traceback.print_exc()
+            raise RuntimeError(f"Gemini API error during generate_content call: {str(e)}")
 
-    # 7. Validate the response
+    # 8. Validate the response
     if not response:
         logger.error("Gemini call returned no response")
         raise RuntimeError("Gemini call returned no response at all.")
@@ -197,6 +353,7 @@ def process_receipt_with_gemini(image_bytes: bytes) -> str:
         logger.error("Gemini call returned an empty text response")
         raise RuntimeError("Gemini call returned an empty text response.")
 
+    cache_llm_response(cache_key, response.text)
     return response.text
 
 def process_multiple_images_ocr(image_list: List[bytes]) -> str:
@@ -332,19 +489,8 @@ def process_images_with_google_vision(image_paths: List[str]) -> Dict[str, Any]:
     Returns:
         Dictionary containing extracted text and metadata
     """
-    # Get the absolute path to the credentials file
-    BASE_DIR = Path(__file__).resolve().parent.parent
-    CREDENTIALS_FILE = "coral-muse-452018-s2-171009389e4d.json"
-    CREDENTIALS_PATH = os.path.join(BASE_DIR, CREDENTIALS_FILE)
-
-    if not os.path.exists(CREDENTIALS_PATH):
-        raise FileNotFoundError(f"Google Cloud credentials file not found at: {CREDENTIALS_PATH}")
-
-    # Set credentials via absolute path
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = str(CREDENTIALS_PATH)
-    
-    # Initialize Google Cloud Vision client
-    client = vision.ImageAnnotatorClient()
+    # Shared Google Cloud Vision client
+    client = get_vision_client()
     
     combined_text = []
     for image_path in image_paths:
@@ -406,191 +552,488 @@ def process_images(image_paths: List[str], provider: OCRProvider = OCRProvider.G
     else:
         raise ValueError(f"Unsupported OCR provider: {provider}")
 
-def process_images_with_tesseract_bytes(image_bytes_list: List[bytes]) -> Dict[str, Any]:
+def _ocr_max_workers(max_workers: Optional[int], image_count: int) -> int:
+    """Number of concurrent OCR calls to use for a batch of images."""
+    if max_workers is None:
+        max_workers = getattr(settings, 'OCR_MAX_WORKERS', 4)
+    return max(1, min(max_workers, image_count))
+
+def process_images_with_tesseract_bytes(image_bytes_list: List[bytes], max_workers: Optional[int] = None) -> Dict[str, Any]:
     """
     Process multiple images using Tesseract OCR directly from bytes data.
+
+    Tesseract is CPU-bound, so images are OCR'd in a pool of long-lived
+    worker processes (see llm.tesseract_pool), shared by all requests.
     
     Args:
         image_bytes_list: List of image data in bytes format
+        max_workers: Maximum number of images OCR'd at once
+            (defaults to settings.OCR_MAX_WORKERS, the pool size; 1 runs sequentially)
         
     Returns:
-        Dictionary containing extracted text and metadata
+        Dictionary containing extracted text and metadata, in image_index order
     """
-    # Set tesseract path for Linux
-    pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
-    
-    combined_text = []
-    for idx, image_bytes in enumerate(image_bytes_list):
-        try:
-            # Create PIL Image directly from bytes
-            img = Image.open(io.BytesIO(image_bytes))
-            text = pytesseract.image_to_string(img)
-            combined_text.append({
-                'image_index': idx,
-                'text': text.strip()
-            })
-        except Exception as e:
-            combined_text.append({
-                'image_index': idx,
-                'error': str(e)
-            })
+    from .tesseract_pool import ocr_images
+
+    workers = _ocr_max_workers(max_workers, len(image_bytes_list))
     
     return {
         'provider': 'tesseract',
-        'results': combined_text
+        'results': ocr_images(image_bytes_list, workers)
     }
 
-def process_images_with_google_vision_bytes(image_bytes_list: List[bytes]) -> Dict[str, Any]:
+# Vision's synchronous batch annotate API takes at most 16 images per request,
+# and request payloads are capped at about 10 MB
+VISION_BATCH_SIZE = 16
+VISION_BATCH_MAX_BYTES = 10 * 1024 * 1024
+
+def _vision_batches(image_bytes_list: List[bytes]) -> List[List[int]]:
+    """
+    Split images into batch annotate requests, as lists of image indexes.
+    A batch ends at VISION_BATCH_SIZE images or VISION_BATCH_MAX_BYTES bytes.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for idx, image_bytes in enumerate(image_bytes_list):
+        if batch and (len(batch) == VISION_BATCH_SIZE or batch_bytes + len(image_bytes) > VISION_BATCH_MAX_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(idx)
+        batch_bytes += len(image_bytes)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _google_vision_ocr_batch(client: Any, indexes: List[int], image_bytes_list: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    Run Google Cloud Vision text detection on a batch of images in one request.
+
+    Args:
+        client: Vision ImageAnnotatorClient
+        indexes: image_index of every image in the batch
+        image_bytes_list: The batch's image bytes, in the same order
+
+    Returns:
+        One result per image, in batch order
+
+    Raises:
+        ProviderBusy: If the Vision rate limit had no slot for the request
+    """
+    try:
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=image_bytes),
+                features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+            )
+            for image_bytes in image_bytes_list
+        ]
+        with provider_slot('google_vision'):
+            batch_response = cassettes.replayable_batch(
+                'google_vision', ('text_detection',), image_bytes_list,
+                lambda: client.batch_annotate_images(requests=requests),
+                cassettes.split_vision, cassettes.join_vision
+            )
+    except ProviderBusy:
+        raise
+    except Exception as e:
+        # The whole request failed: every image in it failed
+        return [{'image_index': idx, 'error': str(e)} for idx in indexes]
+
+    # Responses come back in request order
+    results = []
+    for idx, response in zip(indexes, batch_response.responses):
+        if response.error.message:
+            results.append({
+                'image_index': idx,
+                'error': response.error.message
+            })
+            continue
+
+        texts = response.text_annotations
+        results.append({
+            'image_index': idx,
+            'text': texts[0].description.strip() if texts else ''
+        })
+    return results
+
+def process_images_with_google_vision_bytes(image_bytes_list: List[bytes], max_workers: Optional[int] = None) -> Dict[str, Any]:
     """
     Process multiple images using Google Cloud Vision API directly from bytes data.
+
+    Images are sent with Vision's batch annotate API, up to VISION_BATCH_SIZE
+    per request, so a multi-photo receipt usually takes a single round trip.
+    Uploads with more images send their batches from a thread pool sharing
+    one client.
     
     Args:
         image_bytes_list: List of image data in bytes format
+        max_workers: Maximum number of concurrent Vision API requests
+            (defaults to settings.OCR_MAX_WORKERS; 1 runs sequentially)
         
     Returns:
-        Dictionary containing extracted text and metadata
+        Dictionary containing extracted text and metadata, in image_index order
     """
-    # Get the absolute path to the credentials file
-    BASE_DIR = Path(__file__).resolve().parent.parent
-    CREDENTIALS_FILE = "coral-muse-452018-s2-171009389e4d.json"
-    CREDENTIALS_PATH = os.path.join(BASE_DIR, CREDENTIALS_FILE)
+    # Shared Google Cloud Vision client; replayed requests need no client (or credentials)
+    client = None if cassettes.replaying() else get_vision_client()
 
-    if not os.path.exists(CREDENTIALS_PATH):
-        raise FileNotFoundError(f"Google Cloud credentials file not found at: {CREDENTIALS_PATH}")
+    batches = _vision_batches(image_bytes_list)
+    workers = _ocr_max_workers(max_workers, len(batches))
 
-    # Set credentials via absolute path
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = str(CREDENTIALS_PATH)
-    
-    # Initialize Google Cloud Vision client
-    client = vision.ImageAnnotatorClient()
-    
-    combined_text = []
-    for idx, image_bytes in enumerate(image_bytes_list):
-        try:
-            # Create vision Image directly from bytes
-            image = vision.Image(content=image_bytes)
-            response = client.text_detection(image=image)
-            
-            if response.error.message:
-                combined_text.append({
-                    'image_index': idx,
-                    'error': response.error.message
-                })
-                continue
-            
-            texts = response.text_annotations
-            if texts:
-                combined_text.append({
-                    'image_index': idx,
-                    'text': texts[0].description.strip()
-                })
-            else:
-                combined_text.append({
-                    'image_index': idx,
-                    'text': ''
-                })
-                
-        except Exception as e:
-            combined_text.append({
-                'image_index': idx,
-                'error': str(e)
-            })
+    def run_batch(indexes):
+        return _google_vision_ocr_batch(client, indexes, [image_bytes_list[idx] for idx in indexes])
+
+    if workers == 1:
+        batch_results = [run_batch(indexes) for indexes in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batch_results = list(executor.map(run_batch, batches))
     
     return {
         'provider': 'google_cloud_vision',
-        'results': combined_text
+        'results': [result for results in batch_results for result in results]
     }
 
-def process_images_bytes(image_bytes_list: List[bytes], provider: OCRProvider = OCRProvider.GOOGLE_CLOUD) -> Dict[str, Any]:
+# Everything besides the image that determines a provider's OCR output;
+# part of the OCR cache key, so changing it invalidates cached results
+OCR_SETTINGS = {
+    OCRProvider.TESSERACT: {'engine': 'tesseract', 'config': ''},
+    OCRProvider.GOOGLE_CLOUD: {'engine': 'google_cloud_vision', 'feature': 'text_detection'},
+}
+
+def ocr_cache_key(image_bytes: bytes, provider: OCRProvider, preprocessing: str = 'none') -> str:
+    """
+    OCR cache key: SHA-256 of the image bytes as uploaded plus the provider,
+    its OCR settings and the preprocessing profile applied before OCR.
+    """
+    from .preprocessing import get_profile
+    from .result_cache import make_key
+    return make_key(image_bytes, provider.value, OCR_SETTINGS[provider], get_profile(preprocessing))
+
+def llm_cache_key(model_name: str, generation_config: Dict[str, Any], prompt: str, content: Union[str, bytes],
+                  *extra: Any) -> str:
+    """
+    LLM cache key: hash of the model, generation config, prompt, the OCR
+    text or image, and any extra inputs (e.g. a preprocessing profile). The
+    prompt is part of the key, so editing it never serves a response
+    generated for the old prompt.
+    """
+    from .result_cache import make_key
+    return make_key(model_name, generation_config, prompt, content, *extra)
+
+def cache_llm_response(cache_key: str, text: str, custom_prompt: Optional[str] = None) -> bool:
+    """
+    Cache an LLM response if it is usable: a bill in the shape the prompt asks
+    for, or any JSON object for a custom prompt. A truncated or malformed
+    answer would otherwise be served to every retry of the same request.
+
+    Returns:
+        True if the response was cached
+    """
+    from .result_cache import llm_cache
+    try:
+        data = parse_llm_json(text)
+    except ValueError:
+        data = None
+    if data is None or (not custom_prompt and not is_bill(data)):
+        logger.warning("Not caching an LLM response that is not a valid bill")
+        return False
+    llm_cache.set(cache_key, text)
+    return True
+
+def process_images_bytes(image_bytes_list: List[bytes], provider: OCRProvider = OCRProvider.GOOGLE_CLOUD,
+                         max_workers: Optional[int] = None, use_cache: bool = True,
+                         preprocessing: Optional[str] = None) -> Dict[str, Any]:
     """
     Process multiple images using the specified OCR provider directly from bytes data.
+    Images are preprocessed (see llm.preprocessing) and then OCR'd concurrently,
+    so a batch takes about as long as its slowest image.
+    Images OCR'd before with the same provider, settings and preprocessing are
+    served from the OCR cache without calling the provider.
     
     Args:
         image_bytes_list: List of image data in bytes format
         provider: OCRProvider enum specifying which OCR service to use
+        max_workers: Maximum number of images processed at once
+            (defaults to settings.OCR_MAX_WORKERS; 1 runs sequentially)
+        use_cache: Whether to read and fill the OCR cache
+        preprocessing: Preprocessing profile name
+            (defaults to settings.OCR_PREPROCESSING_PROFILE)
         
     Returns:
-        Dictionary containing the OCR results
+        Dictionary containing the OCR results, in image_index order, the
+        number of images served from the cache as 'cache_hits', and the
+        before/after sizes of every preprocessed image as 'preprocessing'
     """
+    from .preprocessing import preprocess_images
+    from .result_cache import ocr_cache
+
     if not image_bytes_list:
         raise ValueError("No image data provided")
-    
+
     if provider == OCRProvider.TESSERACT:
-        return process_images_with_tesseract_bytes(image_bytes_list)
+        process, provider_name = process_images_with_tesseract_bytes, 'tesseract'
     elif provider == OCRProvider.GOOGLE_CLOUD:
-        return process_images_with_google_vision_bytes(image_bytes_list)
+        process, provider_name = process_images_with_google_vision_bytes, 'google_cloud_vision'
     else:
         raise ValueError(f"Unsupported OCR provider: {provider}")
 
-def process_ocr_text_with_llm(ocr_text: str, custom_prompt: Optional[str] = None) -> str:
+    if preprocessing is None:
+        preprocessing = getattr(settings, 'OCR_PREPROCESSING_PROFILE', 'ocr')
+
+    keys = [ocr_cache_key(image_bytes, provider, preprocessing) for image_bytes in image_bytes_list]
+    cached = ocr_cache.get_many(keys) if use_cache else {}
+    results = [
+        {'image_index': idx, 'text': cached[key]['text']} if key in cached else None
+        for idx, key in enumerate(keys)
+    ]
+
+    missing = [idx for idx, result in enumerate(results) if result is None]
+    reports = []
+    if missing:
+        with stage('preprocess'):
+            processed_images, reports = preprocess_images([image_bytes_list[idx] for idx in missing], preprocessing)
+        with stage('ocr'):
+            ocr_results = process(processed_images, max_workers)
+        provider_name = ocr_results['provider']
+        fresh = {}
+        for idx, result, report in zip(missing, ocr_results['results'], reports):
+            results[idx] = {**result, 'image_index': idx}
+            report['image_index'] = idx
+            # Errors may be transient, so only successful results are cached
+            if 'text' in result:
+                fresh[keys[idx]] = {'text': result['text']}
+        if use_cache:
+            ocr_cache.set_many(fresh)
+
+    return {
+        'provider': provider_name,
+        'results': results,
+        'cache_hits': len(image_bytes_list) - len(missing),
+        'preprocessing': reports
+    }
+
+# Generation settings for turning OCR text into a bill
+OCR_TEXT_GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+def _prepare_ocr_text_request(ocr_text: str, custom_prompt: Optional[str],
+                              api_key_name: str = "GEMINI_API_KEY") -> Tuple[str, str, str, str]:
     """
-    Process OCR text with LLM (Gemini) by combining it with a prompt.
-    
-    Args:
-        ocr_text: The text extracted from OCR
-        custom_prompt: Optional custom prompt to use instead of the default prompt
-        
+    Validate an OCR text request and build its prompt. Unless disabled with
+    settings.OCR_TEXT_COMPACTION, the OCR text is compacted (see llm/compaction.py)
+    to settings.OCR_TEXT_TOKEN_BUDGET estimated tokens first.
+
     Returns:
-        String response from the LLM containing structured data
-        
+        Tuple of (API key, base prompt, OCR text as sent, prompt combined with the OCR text)
+
     Raises:
-        ValueError: If API key is not set or text is empty
-        RuntimeError: If LLM API call fails
+        ValueError: If API key is not set, text is empty or the prompt can't be read
     """
     if not ocr_text:
         logger.error("No OCR text provided")
         raise ValueError("No OCR text provided for processing")
 
-    # Get the Gemini API key
-    api_key = os.environ.get("GEMINI_API_KEY")
+    # Get the provider's API key
+    api_key = os.environ.get(api_key_name)
     if not api_key:
-        logger.error("GEMINI_API_KEY is not set in environment variables")
-        raise ValueError("GEMINI_API_KEY is not set in environment variables.")
+        logger.error(f"{api_key_name} is not set in environment variables")
+        raise ValueError(f"{api_key_name} is not set in environment variables.")
+
+    if getattr(settings, 'OCR_TEXT_COMPACTION', True):
+        with stage('compact'):
+            ocr_text, stats = compact_ocr_text(ocr_text, getattr(settings, 'OCR_TEXT_TOKEN_BUDGET', 1500))
+        logger.info(f"Compacted OCR text from {stats['tokens_before']} to {stats['tokens_after']} tokens")
+        annotate(ocr_tokens_before=stats['tokens_before'], ocr_tokens_after=stats['tokens_after'])
 
     # Get prompt (either custom or from file)
     try:
-        base_prompt = custom_prompt if custom_prompt else read_prompt_file()
-        # Combine prompt with OCR text
-        combined_prompt = f"{base_prompt}\n\nHere is the extracted text from the receipt:\n{ocr_text}"
+        with stage('prompt'):
+            base_prompt = custom_prompt if custom_prompt else read_prompt_file()
+            # Combine prompt with OCR text
+            combined_prompt = f"{base_prompt}\n\nHere is the extracted text from the receipt:\n{ocr_text}"
     except Exception as e:
         logger.error(f"Error preparing prompt: {str(e)}")
         raise ValueError(f"Error preparing prompt: {str(e)}")
 
-    # Configure Gemini
+    return api_key, base_prompt, ocr_text, combined_prompt
+
+def _ocr_text_model(api_key: str) -> Any:
+    """
+    Configure Gemini (once per process) and return the shared model for OCR text requests.
+
+    Raises:
+        RuntimeError: If Gemini can't be configured or the model can't be created
+    """
     try:
-        genai.configure(api_key=api_key)
+        configure_gemini(api_key)
     except Exception as e:
         logger.error(f"Error configuring Gemini: {str(e)}")
         raise RuntimeError(f"Error configuring Gemini: {str(e)}")
 
-    # Create a GenerativeModel with desired settings
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 8192,
-    }
-    
     try:
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config=generation_config,
-        )
+        return get_gemini_model(api_key, GEMINI_MODEL, OCR_TEXT_GENERATION_CONFIG)
     except Exception as e:
         logger.error(f"Error creating Gemini model: {str(e)}")
         raise RuntimeError(f"Error creating Gemini model: {str(e)}")
 
+def process_ocr_text_with_llm(ocr_text: str, custom_prompt: Optional[str] = None, use_cache: bool = True) -> str:
+    """
+    Process OCR text with LLM (Gemini) by combining it with a prompt.
+    Responses are cached by model, generation config, prompt and OCR text.
+    
+    Args:
+        ocr_text: The text extracted from OCR
+        custom_prompt: Optional custom prompt to use instead of the default prompt
+        use_cache: Whether to reuse a cached response for the same request
+        
+    Returns:
+        String response from the LLM containing structured data
+        
+    Raises:
+        ValueError: If API key is not set or text is empty
+        RuntimeError: If LLM API call fails
+    """
+    from .result_cache import llm_cache
+
+    api_key, base_prompt, ocr_text, combined_prompt = _prepare_ocr_text_request(ocr_text, custom_prompt)
+
+    # Reuse the response to an identical earlier request
+    cache_key = llm_cache_key(GEMINI_MODEL, OCR_TEXT_GENERATION_CONFIG, base_prompt, ocr_text)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    model = _ocr_text_model(api_key)
+
     # Call the model with the combined prompt
-    try:
-        response = model.generate_content(combined_prompt)
-    except Exception as e:
-        logger.error(f"Gemini API error: {str(e)}")
-        traceback.print_exc()
-        raise RuntimeError(f"Gemini API error during generate_content call: {str(e)}")
+    with provider_slot('gemini'):
+        try:
+            response = cassettes.replayable(
+                'gemini', (GEMINI_MODEL, OCR_TEXT_GENERATION_CONFIG, combined_prompt),
+                lambda: model.generate_content(combined_prompt),
+                cassettes.encode_gemini, cassettes.decode_gemini
+            )
+        except Exception as e:
+            logger.error(f"Gemini API error: {str(e)}")
+            traceback.print_exc()
+            raise RuntimeError(f"Gemini API error during generate_content call: {str(e)}")
 
     # Validate the response
     if not response or not response.text:
         logger.error("Gemini returned empty response")
         raise RuntimeError("Gemini returned empty response")
 
-    return response.text
\ No newline at end of file
+    cache_llm_response(cache_key, response.text, custom_prompt)
+    return response.text
+
+# Generation settings for turning OCR text into a bill with OpenAI
+OPENAI_TEXT_GENERATION_CONFIG = {
+    "max_tokens": 3000,
+}
+
+def process_ocr_text_with_openai(ocr_text: str, custom_prompt: Optional[str] = None, use_cache: bool = True) -> str:
+    """
+    Process OCR text with OpenAI's chat model, the same way process_ocr_text_with_llm does with Gemini.
+    
+    Args:
+        ocr_text: The text extracted from OCR
+        custom_prompt: Optional custom prompt to use instead of the default prompt
+        use_cache: Whether to reuse a cached response for the same request
+        
+    Returns:
+        String response from the LLM containing structured data
+        
+    Raises:
+        ValueError: If API key is not set or text is empty
+        RuntimeError: If OpenAI API call fails
+    """
+    from .result_cache import llm_cache
+
+    api_key, base_prompt, ocr_text, combined_prompt = _prepare_ocr_text_request(ocr_text, custom_prompt, "OPENAI_API_KEY")
+
+    cache_key = llm_cache_key(OPENAI_MODEL, OPENAI_TEXT_GENERATION_CONFIG, base_prompt, ocr_text)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    openai.api_key = api_key
+    with provider_slot('openai'):
+        try:
+            response = cassettes.replayable(
+                'openai', (OPENAI_MODEL, OPENAI_TEXT_GENERATION_CONFIG, combined_prompt),
+                lambda: openai.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=[{"role": "user", "content": combined_prompt}],
+                    **OPENAI_TEXT_GENERATION_CONFIG,
+                ),
+                cassettes.encode_openai, cassettes.decode_openai
+            )
+            content = response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            raise RuntimeError(f"OpenAI API error: {str(e)}")
+
+    if not content:
+        logger.error("OpenAI returned empty response")
+        raise RuntimeError("OpenAI returned empty response")
+
+    cache_llm_response(cache_key, content, custom_prompt)
+    return content
+
+def stream_ocr_text_with_llm(ocr_text: str, custom_prompt: Optional[str] = None, use_cache: bool = True) -> Iterator[str]:
+    """
+    Like process_ocr_text_with_llm, but yields the response text in chunks
+    as Gemini generates it. A cached response is yielded as a single chunk,
+    and a completed stream is stored in the cache.
+    
+    Args:
+        ocr_text: The text extracted from OCR
+        custom_prompt: Optional custom prompt to use instead of the default prompt
+        use_cache: Whether to reuse a cached response for the same request
+        
+    Yields:
+        Chunks of the LLM's response text
+        
+    Raises:
+        ValueError: If API key is not set or text is empty
+        RuntimeError: If LLM API call fails
+    """
+    from .result_cache import llm_cache
+
+    api_key, base_prompt, ocr_text, combined_prompt = _prepare_ocr_text_request(ocr_text, custom_prompt)
+
+    cache_key = llm_cache_key(GEMINI_MODEL, OCR_TEXT_GENERATION_CONFIG, base_prompt, ocr_text)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    model = _ocr_text_model(api_key)
+
+    chunks = []
+    with provider_slot('gemini'):
+        try:
+            chunk_stream = cassettes.replayable_stream(
+                'gemini', (GEMINI_MODEL, OCR_TEXT_GENERATION_CONFIG, combined_prompt),
+                lambda: model.generate_content(combined_prompt, stream=True)
+            )
+            for chunk in chunk_stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            logger.error(f"Gemini API error: {str(e)}")
+            raise RuntimeError(f"Gemini API error during streaming generate_content call: {str(e)}")
+
+    if not chunks:
+        logger.error("Gemini returned empty response")
+        raise RuntimeError("Gemini returned empty response")
+
+    cache_llm_response(cache_key, "".join(chunks), custom_prompt)
\ No newline at end of file
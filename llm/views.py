@@ -1,6 +1,7 @@
 import os
 import base64
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -8,19 +9,43 @@ from .utils import (
     process_receipt_with_openai, 
     process_receipt_with_gemini,
     process_images_bytes,
-    process_ocr_text_with_llm,
     OCRProvider
 )
+from .rate_limit import ProviderBusy
+from .timing import request_timer, stage, timed
+from .models import ReceiptJob, ReceiptJobMode, ReceiptJobStatus, ReceiptScan
+from .services import (
+    extract_bill_from_text,
+    stream_bill_from_images,
+    ReceiptJobService,
+    ReceiptScanService
+)
 from rest_framework.decorators import api_view
 from PIL import Image
 import tempfile
 import io
 
 
+def _use_cache(request):
+    """Cached OCR results and LLM responses are bypassed with use_cache=false."""
+    return request.POST.get('use_cache', 'true').lower() != 'false'
+
+
+def _busy_response(error):
+    """429 response for a call rejected by the provider rate limiter."""
+    response = Response({"error": str(error)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
 class ProcessReceiptView(APIView):
     """
-    Accepts an image upload and processes it using the configured LLM.
+    Accepts an image upload and processes it with the fastest available LLM provider.
+    Send use_cache=false to bypass cached responses.
+    The result is saved as a receipt scan; its id is returned as 'scan_id'.
+    Stage durations are returned in the Server-Timing header.
     """
+    @timed('process_receipt')
     def post(self, request, format=None):
         if "file" not in request.FILES:
             return Response(
@@ -29,12 +54,15 @@ class ProcessReceiptView(APIView):
             )
         
         try:
-            image_data = request.FILES["file"].read()
-            bill_content = process_receipt_with_gemini(image_data)
+            with stage('read'):
+                image_data = request.FILES["file"].read()
+            scan = ReceiptScanService.scan_image_with_llm(image_data, use_cache=_use_cache(request))
             return Response(
-                {"bill": bill_content}, 
+                {"bill": scan.result, "scan_id": scan.id}, 
                 status=status.HTTP_200_OK
             )
+        except ProviderBusy as e:
+            return _busy_response(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, 
@@ -42,7 +70,49 @@ class ProcessReceiptView(APIView):
             )
 
 
+def _read_bill_images(request):
+    """
+    Read and validate the images and OCR provider of a bill images request.
+
+    Returns:
+        Tuple of (image bytes list, OCRProvider, None), or (None, None, error Response)
+    """
+    # Check for files in both standard file upload and multipart form data
+    files = request.FILES.getlist('files[]') or request.FILES.getlist('file') or request.FILES.getlist('images')
+    
+    if not files:
+        return None, None, Response(
+            {"error": "No files uploaded. Please send image files with field name 'files[]', 'file', or 'images'."}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Validate provider
+    try:
+        provider = OCRProvider(request.POST.get('provider', 'google_cloud'))
+    except ValueError:
+        return None, None, Response(
+            {'error': f'Invalid provider. Choose from: {[p.value for p in OCRProvider]}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Process images directly from memory
+    image_bytes_list = []
+    
+    for file in files:
+        if not file.content_type.startswith('image/'):
+            return None, None, Response(
+                {"error": f"Invalid file type: {file.content_type}. Please upload only image files."}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Read the file content directly
+        image_bytes_list.append(file.read())
+
+    return image_bytes_list, provider, None
+
+
 @api_view(['POST'])
+@timed('process_bill_images')
 def process_bill_images(request):
     """
     Process multiple bill images using OCR and LLM.
@@ -50,86 +120,164 @@ def process_bill_images(request):
     - Files can be sent as multipart form data with field names 'files[]', 'file', or 'images'
     - Optional query parameter 'provider': 'google_cloud' or 'tesseract' (defaults to google_cloud)
     - Optional query parameter 'custom_prompt': Custom prompt for LLM processing
+    - Optional query parameter 'use_cache': 'false' to bypass cached OCR results and LLM responses
+    The result is saved as a receipt scan; its id is returned as 'scan_id'. Send it
+    as 'receipt_scan_id' when saving the bill to link the two.
+    Stage durations are returned in the Server-Timing header.
+    """
+    with stage('read'):
+        image_bytes_list, provider, error_response = _read_bill_images(request)
+    if error_response:
+        return error_response
+
+    try:
+        scan = ReceiptScanService.scan_images(
+            image_bytes_list, provider, request.POST.get('custom_prompt', None), _use_cache(request)
+        )
+        return Response({'bill': scan.result, 'scan_id': scan.id}, status=status.HTTP_200_OK)
+
+    except ProviderBusy as e:
+        return _busy_response(e)
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+def process_bill_images_stream(request):
+    """
+    Streaming variant of process_bill_images, with the same request format.
+    Responds with server-sent events as the bill is generated:
+    - 'item': one bill item, sent as soon as it has been parsed
+    - 'bill': the complete bill response, sent last
+    - 'error': processing failed; carries 'retry_after' when the providers are at their rate limits
+    """
+    image_bytes_list, provider, error_response = _read_bill_images(request)
+    if error_response:
+        return error_response
+
+    response = StreamingHttpResponse(
+        stream_bill_from_images(
+            image_bytes_list, provider, request.POST.get('custom_prompt', None), _use_cache(request)
+        ),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['POST'])
+def create_receipt_job(request):
+    """
+    Queue bill images for a receipt worker and return the job id right away.
+    Expected request format:
+    - Files can be sent as multipart form data with field names 'files[]', 'file', or 'images'
+    - Optional parameter 'mode': 'ocr_llm' (default) or 'gemini_image'
+    - Optional parameter 'provider': 'google_cloud' or 'tesseract' (defaults to google_cloud)
+    - Optional parameter 'custom_prompt': Custom prompt for LLM processing
+    Poll GET /api/receipt-jobs/<id>/ for the result.
     """
-    # Check for files in both standard file upload and multipart form data
     files = request.FILES.getlist('files[]') or request.FILES.getlist('file') or request.FILES.getlist('images')
-    
+
     if not files:
         return Response(
-            {"error": "No files uploaded. Please send image files with field name 'files[]', 'file', or 'images'."}, 
+            {"error": "No files uploaded. Please send image files with field name 'files[]', 'file', or 'images'."},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    provider_name = request.POST.get('provider', 'google_cloud')
-    custom_prompt = request.POST.get('custom_prompt', None)
+    try:
+        mode = ReceiptJobMode(request.POST.get('mode', ReceiptJobMode.OCR_LLM))
+    except ValueError:
+        return Response(
+            {'error': f'Invalid mode. Choose from: {ReceiptJobMode.values}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     try:
-        # Validate provider
-        try:
-            provider = OCRProvider(provider_name)
-        except ValueError:
+        provider = OCRProvider(request.POST.get('provider', 'google_cloud'))
+    except ValueError:
+        return Response(
+            {'error': f'Invalid provider. Choose from: {[p.value for p in OCRProvider]}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    for file in files:
+        if not file.content_type.startswith('image/'):
             return Response(
-                {'error': f'Invalid provider. Choose from: {[p.value for p in OCRProvider]}'},
+                {"error": f"Invalid file type: {file.content_type}. Please upload only image files."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Process images directly from memory
-        image_bytes_list = []
-        
-        for file in files:
-            if not file.content_type.startswith('image/'):
-                return Response(
-                    {"error": f"Invalid file type: {file.content_type}. Please upload only image files."}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Read the file content directly
-            file_bytes = file.read()
-            image_bytes_list.append(file_bytes)
-            
-        # Step 1: Process the images with OCR
-        ocr_results = process_images_bytes(image_bytes_list, provider)
-        
-        # Step 2: Extract and combine OCR text from results
-        combined_ocr_text = ""
-        for result in ocr_results['results']:
-            if 'text' in result:
-                combined_ocr_text += result['text'] + "\n\n"
-            elif 'error' in result:
-                return Response(
-                    {'error': f"OCR Error: {result['error']}"}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-        
-        # Step 3: Process OCR text with LLM
-        try:
-            llm_response = process_ocr_text_with_llm(combined_ocr_text, custom_prompt)
-            
-            # Return both OCR and LLM results
-            # response_data = {
-            #     'ocr_results': ocr_results,
-            #     'llm_analysis': llm_response
-            # }
-            response_data = {
-                'bill': llm_response
-            }
-            print(llm_response)
-            return Response(response_data, status=status.HTTP_200_OK)
-            
-        except Exception as e:
-            return Response(
-                {'error': f"LLM Processing Error: {str(e)}"}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        
-    except Exception as e:
+    if mode == ReceiptJobMode.GEMINI_IMAGE and len(files) > 1:
         return Response(
-            {'error': str(e)},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {"error": "The gemini_image mode accepts a single image."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    job = ReceiptJobService.enqueue(files, mode, provider, request.POST.get('custom_prompt', None))
+    return Response(
+        {'job_id': job.id, 'status': job.status},
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+@api_view(['GET'])
+def receipt_job_detail(request, job_id):
+    """
+    Report the status of a receipt job, with the parsed bill once it has succeeded.
+    """
+    try:
+        job = ReceiptJob.objects.get(id=job_id)
+    except ReceiptJob.DoesNotExist:
+        return Response(
+            {"error": "Receipt job not found."},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    response_data = {
+        'job_id': job.id,
+        'status': job.status,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == ReceiptJobStatus.SUCCEEDED:
+        response_data['bill'] = job.result
+    elif job.status == ReceiptJobStatus.FAILED:
+        response_data['error'] = job.error
+    return Response(response_data, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def receipt_scan_detail(request, scan_id):
+    """
+    Return an earlier receipt scan as it was saved; no OCR or LLM calls are made.
+    """
+    try:
+        scan = ReceiptScan.objects.get(id=scan_id)
+    except ReceiptScan.DoesNotExist:
+        return Response(
+            {"error": "Receipt scan not found."},
+            status=status.HTTP_404_NOT_FOUND
         )
 
+    return Response({
+        'scan_id': scan.id,
+        'image_hash': scan.image_hash,
+        'provider': scan.provider,
+        'ocr_text': scan.ocr_text,
+        'bill': scan.result,
+        'timings': scan.timings,
+        'bill_id': scan.bill_id,
+        'created_at': scan.created_at,
+    }, status=status.HTTP_200_OK)
+
 # write a fucntion to process the image using google ocr and llm gemini  and output the responce 
-def process_receipt_with_OCR_LLM(image_data: bytes, provider: OCRProvider = OCRProvider.GOOGLE_CLOUD, custom_prompt: str = None) -> dict:
+def process_receipt_with_OCR_LLM(image_data: bytes, provider: OCRProvider = OCRProvider.GOOGLE_CLOUD, custom_prompt: str = None,
+                                 use_cache: bool = True) -> dict:
     """
     Process a single receipt image using OCR and LLM analysis.
     
@@ -137,35 +285,40 @@ def process_receipt_with_OCR_LLM(image_data: bytes, provider: OCRProvider = OCRP
         image_data: Raw image bytes to process
         provider: OCRProvider enum specifying which OCR service to use (default: google_cloud)
         custom_prompt: Optional custom prompt for LLM processing
+        use_cache: Whether to reuse a cached OCR result and LLM response for the same image
     
     Returns:
-        Dictionary containing OCR results and LLM analysis
+        Dictionary containing OCR results, LLM analysis and stage durations in milliseconds
     
     Raises:
         ValueError: If image data is invalid
+        ProviderBusy: If every LLM provider is at its rate limit
         RuntimeError: If OCR or LLM processing fails
     """
     if not image_data:
         raise ValueError("No image data provided")
     
-    try:
-        # Process the image with OCR
-        ocr_results = process_images_bytes([image_data], provider)
-        
-        # Extract OCR text from results
-        if not ocr_results['results'] or 'text' not in ocr_results['results'][0]:
-            raise RuntimeError("OCR failed to extract text from the image")
+    with request_timer('process_receipt_with_OCR_LLM') as timer:
+        try:
+            # Process the image with OCR
+            ocr_results = process_images_bytes([image_data], provider, use_cache=use_cache)
             
-        ocr_text = ocr_results['results'][0]['text']
-        
-        # Process OCR text with LLM
-        llm_response = process_ocr_text_with_llm(ocr_text, custom_prompt)
-        
-        return {
-            'ocr_results': ocr_results,
-            'llm_analysis': llm_response
-        }
-        # print llm response 
-        print(llm_response)
-    except Exception as e:
-        raise RuntimeError(f"Error processing receipt: {str(e)}")
+            # Extract OCR text from results
+            if not ocr_results['results'] or 'text' not in ocr_results['results'][0]:
+                raise RuntimeError("OCR failed to extract text from the image")
+                
+            ocr_text = ocr_results['results'][0]['text']
+            
+            # Parse the OCR text, falling back to the LLM when the parser cannot reconcile it
+            llm_response = extract_bill_from_text(ocr_text, custom_prompt, use_cache)
+        except ProviderBusy:
+            # Callers answer 429 with Retry-After for this, not a 500
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Error processing receipt: {str(e)}")
+
+    return {
+        'ocr_results': ocr_results,
+        'llm_analysis': llm_response,
+        'timings': timer.durations_ms()
+    }